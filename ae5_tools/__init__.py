@@ -2,6 +2,7 @@
 
 from . import _version
 from .api import AEAdminSession, AEException, AEUnexpectedResponseError, AEUserSession
+from .async_api import AEAsyncAdminSession, AEAsyncUserSession
 from .common.config.environment import demand_env_var, demand_env_var_as_bool, get_env_var
 from .common.contracts.errors.environment_variable_not_found_error import EnvironmentVariableNotFoundError
 from .common.secrets import load_ae5_user_secrets
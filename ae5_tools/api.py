@@ -1,18 +1,22 @@
 from __future__ import annotations
 
+import contextlib
+import functools
 import getpass
-import io
+import hashlib
 import json
 import os
 import re
 import sys
+import threading
 import time
 import webbrowser
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from http.cookiejar import LWPCookieJar
 from os.path import abspath, basename, isdir, isfile, join
 from tempfile import TemporaryDirectory
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 
 import requests
 from dateutil import parser
@@ -21,19 +25,48 @@ from requests.adapters import HTTPAdapter
 from requests.packages import urllib3
 from urllib3 import Retry
 
-from .archiver import create_tar_archive
+from .archiver import ARCHIVE_CACHE, ARCHIVE_COMPRESSION, ARCHIVE_SUFFIXES, ArchiveCache, create_tar_archive
+from .cache import ResponseCache
 from .common.config.environment import demand_env_var, demand_env_var_as_bool, get_env_var
 from .common.contracts.errors.environment_variable_not_found_error import EnvironmentVariableNotFoundError
 from .config import config
 from .docker import build_image, get_condarc, get_dockerfile
-from .filter import filter_list_of_dicts, filter_vars, split_filter
-from .identifier import Identifier
+from .filter import exact_value, filter_list_of_dicts, filter_vars, split_filter
+from .identifier import RE_ID, RE_UUID, Identifier
 from .k8s.client import AE5K8SLocalClient, AE5K8SRemoteClient
+from .k8s.transformer import _to_float
+from .localstate import atomic_save, file_lock, load_snapshot, save_snapshot
+from .streaming import MultipartBody
+from .waiter import wait_for
 
 # Maximum page size in keycloak
 KEYCLOAK_PAGE_MAX = int(os.environ.get("KEYCLOAK_PAGE_MAX", "1000"))
-# Maximum number of ids to pass through json body to the k8s endpoint
-K8S_JSON_LIST_MAX = int(os.environ.get("K8S_JSON_LIST_MAX", "100"))
+# Number of keycloak pages fetched at once when the total number of records is unknown
+KEYCLOAK_PREFETCH = int(os.environ.get("AE5_KEYCLOAK_PREFETCH", "4"))
+# Keycloak listings with an endpoint that reports their total number of records
+KEYCLOAK_COUNT_ENDPOINTS = {"users": "users/count"}
+# Initial number of ids to pass through json body to the k8s endpoint. Each
+# session halves this whenever a request is rejected as too large (413).
+K8S_JSON_LIST_MAX = int(os.environ.get("K8S_JSON_LIST_MAX", "1000"))
+# Lifetime, in seconds, of the reduced chunk size that persistent sessions save
+# for each host, after which the endpoint is probed from K8S_JSON_LIST_MAX again
+K8S_CHUNK_SIZE_TTL = float(os.environ.get("AE5_K8S_CHUNK_SIZE_TTL", "86400"))
+
+# Maximum number of concurrent requests made by a session to fetch related records
+MAX_WORKERS = int(os.environ.get("AE5_MAX_WORKERS", "8"))
+# Timeout, in seconds, for each of those requests. Zero disables it.
+REQUEST_TIMEOUT = float(os.environ.get("AE5_REQUEST_TIMEOUT", "60"))
+# Lifetime, in seconds, of the on-disk snapshot of the realm role and group
+# memberships shared by user listings. Zero disables the snapshot.
+MEMBERSHIP_SNAPSHOT_TTL = float(os.environ.get("AE5_MEMBERSHIP_SNAPSHOT_TTL", "0"))
+# If set, persistent admin sessions keep the last login time of each user on disk,
+# and read only the newer LOGIN events. Set to 0 to read the full event history.
+LOGIN_CURSOR = os.environ.get("AE5_LOGIN_CURSOR", "1") not in ("", "0")
+# Saved admin access tokens are reused until this many seconds before they expire
+TOKEN_REFRESH_MARGIN = float(os.environ.get("AE5_TOKEN_REFRESH_MARGIN", "30"))
+
+# Size of the chunks in which streamed downloads are written to disk
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("AE5_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
 
 # Default subdomain for kubectl service
 DEFAULT_K8S_ENDPOINT = "k8s"
@@ -190,6 +223,56 @@ _DTYPES = {
     "time": "timestamp/ms",
 }
 
+
+def _cf_headers():
+    """
+    If cloudflare auth is enabled, then return the headers it requires
+    https://developers.cloudflare.com/cloudflare-one/identity/service-tokens/#connect-your-service-to-access
+    CF-Access-Client-Id: <Client ID>
+    CF-Access-Client-Secret: <Client Secret>
+    """
+
+    if get_env_var(name="CF_ACCESS_CLIENT_ID") and get_env_var(name="CF_ACCESS_CLIENT_SECRET"):
+        return {
+            "CF-Access-Client-Id": demand_env_var(name="CF_ACCESS_CLIENT_ID"),
+            "CF-Access-Client-Secret": demand_env_var(name="CF_ACCESS_CLIENT_SECRET"),
+        }
+    return {}
+
+
+def _tls_settings():
+    """Determine the TLS verification settings for client communications.
+
+    Returns a (verify, cert) tuple, where cert is the path of a client
+    certificate, or None if one was not supplied.
+    """
+
+    # Default to the prior behavior of disabled.
+    verify, cert = False, None
+
+    # Allow explicitly enabling TLS verification.
+    # This is only needed when wanting to use a system supplied certificate chain.
+    # To use a custom chain, use the environment variable `REQUESTS_CA_BUNDLE` instead.
+    if get_env_var(name="AE5_TLS_VERIFY"):
+        try:
+            verify = demand_env_var_as_bool(name="AE5_TLS_VERIFY")
+        except EnvironmentVariableNotFoundError:
+            pass
+
+    # Allow the presence of `REQUESTS_CA_BUNDLE` to toggle TLS verification on.
+    # Reduces the need for additional flags for ae5-tools under this condition.
+    if get_env_var(name="REQUESTS_CA_BUNDLE"):
+        verify = True
+
+    # Support supplying a client cert. This most likely would only
+    # be needed in edge cases outside ae5.
+    if get_env_var(name="AE5_CLIENT_CERT_PATH"):
+        verify = True
+        cert = demand_env_var(name="AE5_CLIENT_CERT_PATH")
+
+    return verify, cert
+
+
 # Used by _response_hook to help log redirected URLs
 last_redirect = None
 
@@ -226,6 +309,7 @@ class AEException(RuntimeError):
 
 class AEUnexpectedResponseError(AEException):
     def __init__(self, response, method, url, **kwargs):
+        self.status_code = getattr(response, "status_code", None)
         if isinstance(response, str):
             msg = [f"Unexpected response: {response}"]
         else:
@@ -243,8 +327,113 @@ class AEUnexpectedResponseError(AEException):
         super(AEUnexpectedResponseError, self).__init__("\n".join(msg))
 
 
+def _page_params(params, first, size, limit, pages):
+    # The query parameters for the given page numbers of a keycloak listing
+    return [{**params, "first": first + k * size, "max": min(size, limit - k * size)} for k in pages if k * size < limit]
+
+
+def _extend_pages(records, page_params, pages, limit):
+    # Add fetched pages to a keycloak listing in order, returning True once it is complete
+    for params, page in zip(page_params, pages):
+        records.extend(page)
+        if len(page) < params["max"] or len(records) == limit:
+            return True
+    return False
+
+
+def _invert_memberships(maps: dict[str, list]) -> dict[str, list]:
+    """
+    Given a mapping of role or group names to member users, returns a mapping of user ids to names.
+
+    The index is built in a single pass. Names appear in the order of the mapping,
+    once for each listing of the user, as a scan of the mapping for one user finds them.
+    """
+
+    index: dict[str, list] = {}
+    for name, members in maps.items():
+        for member in members:
+            index.setdefault(member["id"], []).append(name)
+    return index
+
+
+def _token_issued(sdata):
+    """Records the time at which a Keycloak token response was received, so that its expiry can be checked later."""
+    if isinstance(sdata, dict) and "expires_in" in sdata:
+        sdata["issued_at"] = time.time()
+    return sdata
+
+
+def _token_valid(sdata) -> bool:
+    """Whether the access token of saved Keycloak token data remains valid for at least TOKEN_REFRESH_MARGIN seconds."""
+    try:
+        return time.time() + TOKEN_REFRESH_MARGIN < sdata["issued_at"] + sdata["expires_in"]
+    except (KeyError, TypeError):
+        return False
+
+
+def _user_ident(filter) -> tuple[str | None, str | None]:
+    """
+    Returns the username and the user id that a user filter requires exactly, if any.
+
+    A plain identifier is matched by IDENT_FILTERS against both the username
+    and the id, so the same value is returned for both. Ids are only returned
+    if they have the form of a Keycloak id.
+    """
+
+    if isinstance(filter, (list, tuple)):
+        filter = ",".join(filter)
+    match = re.fullmatch(r"username=([^,|&]+)\|id=\1", filter or "")
+    if match and not any(c in match[1] for c in "*?["):
+        username = id = match[1]
+    else:
+        username, id = exact_value(filter, "username"), exact_value(filter, "id")
+    if id and not re.fullmatch(RE_UUID, id):
+        id = None
+    return username, id
+
+
+def _merge_logins(logins: dict[str, int], events: list[dict]) -> int:
+    """
+    Updates a mapping of user ids to last login times with a list of LOGIN events.
+
+    Returns the time of the latest event, or 0 if there are none. Merging the
+    same event more than once has no effect, so event listings may overlap.
+    """
+
+    mark = 0
+    for e in events:
+        if "response_mode" not in e["details"] and e["time"] > logins.get(e["userId"], 0):
+            logins[e["userId"]] = e["time"]
+        mark = max(mark, e["time"])
+    return mark
+
+
+def _login_params(mark: int) -> dict:
+    """
+    Returns the event query parameters for the LOGIN events since a given time, in ms.
+
+    Keycloak only filters events by date, so the query starts a day early to
+    allow for the time zone of the server; the overlap is harmless.
+    """
+
+    params = {"client": "anaconda-platform", "type": "LOGIN"}
+    if mark:
+        params["dateFrom"] = (datetime.fromtimestamp(mark / 1000, timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+    return params
+
+
 class AESessionBase(object):
-    """Base class for AE5 API interactions."""
+    """Base class for AE5 API interactions.
+
+    A single session may be shared by multiple threads. Re-authorization is
+    single-flight: when several threads discover at once that the session
+    has expired, one of them logs in again while the others wait, and then
+    all of them retry their requests with the new credentials. Saving the
+    session to disk is serialized and atomic.
+    """
+
+    # Record types that can be retrieved individually by ID, and their endpoints
+    _direct_endpoints = {}
 
     def __init__(self, hostname, username, password, prefix, persist):
         """Base class constructor.
@@ -270,6 +459,12 @@ class AESessionBase(object):
         self.prefix = prefix.lstrip("/")
         self.base = f"https://{self.hostname}/{self.prefix}/"
         self.session: Session = AESessionBase._build_requests_session()
+        # Guards authorization; the generation counts successful logins, so
+        # that threads waiting on the lock can tell whether to log in again.
+        self._auth_lock = threading.RLock()
+        self._auth_generation = 0
+        self._save_lock = threading.Lock()
+        self._cache = ResponseCache()
 
         # Cloudflare headers need to be present on all requests (even before auth can be start).
         self._set_cf_headers()
@@ -292,35 +487,14 @@ class AESessionBase(object):
         CF-Access-Client-Secret: <Client Secret>
         """
 
-        if get_env_var(name="CF_ACCESS_CLIENT_ID") and get_env_var(name="CF_ACCESS_CLIENT_SECRET"):
-            self.session.headers["CF-Access-Client-Id"] = demand_env_var(name="CF_ACCESS_CLIENT_ID")
-            self.session.headers["CF-Access-Client-Secret"] = demand_env_var(name="CF_ACCESS_CLIENT_SECRET")
+        self.session.headers.update(_cf_headers())
 
     def _set_tls_verify(self):
         """Configure TLS for client communications."""
 
-        # Default to the prior behavior of disabled.
-        self.session.verify = False
-
-        # Allow explicitly enabling TLS verification.
-        # This is only needed when wanting to use a system supplied certificate chain.
-        # To use a custom chain, use the environment variable `REQUESTS_CA_BUNDLE` instead.
-        if get_env_var(name="AE5_TLS_VERIFY"):
-            try:
-                self.session.verify = demand_env_var_as_bool(name="AE5_TLS_VERIFY")
-            except EnvironmentVariableNotFoundError:
-                pass
-
-        # Allow the presence of `REQUESTS_CA_BUNDLE` to toggle TLS verification on.
-        # Reduces the need for additional flags for ae5-tools under this condition.
-        if get_env_var(name="REQUESTS_CA_BUNDLE"):
-            self.session.verify = True
-
-        # Support supplying a client cert. This most likely would only
-        # be needed in edge cases outside ae5.
-        if get_env_var(name="AE5_CLIENT_CERT_PATH"):
-            self.session.verify = True
-            self.session.cert = demand_env_var(name="AE5_CLIENT_CERT_PATH")
+        self.session.verify, cert = _tls_settings()
+        if cert:
+            self.session.cert = cert
 
         # If we've determined that TLS verification is disabled, then also
         # disable the warnings. (This replicates the prior behavior).
@@ -389,37 +563,60 @@ class AESessionBase(object):
     def _is_login(self, response):
         pass
 
-    def authorize(self):
-        # Cloudflare headers need to be present on all requests (even before auth can be start).
-        self._set_cf_headers()
+    def _refresh(self):
+        """Renew the session without a password, if the session type supports it.
 
-        key = f"{self.username}@{self.hostname}"
-        need_password = self.password is None
-        last_valid = True
-        while True:
-            if need_password:
-                password = self._password_prompt(key, last_valid)
-            else:
-                password = self.password
-            self._connect(password)
+        Returns True if the session is connected again.
+        """
+        return False
+
+    def authorize(self):
+        with self._auth_lock:
+            # Cloudflare headers need to be present on all requests (even before auth can be start).
+            self._set_cf_headers()
+
+            key = f"{self.username}@{self.hostname}"
+            need_password = self.password is None
+            last_valid = True
+            if not self._refresh():
+                while True:
+                    if need_password:
+                        password = self._password_prompt(key, last_valid)
+                    else:
+                        password = self.password
+                    self._connect(password)
+                    if self._connected():
+                        break
+                    if not need_password:
+                        raise AEException("Invalid username or password.")
+                    last_valid = False
             if self._connected():
-                break
-            if not need_password:
-                raise AEException("Invalid username or password.")
-            last_valid = False
-        if self._connected():
-            self.connected = True
-            self._set_header()
-            if self.persist:
-                self._save()
+                self.connected = True
+                self._set_header()
+                self._auth_generation += 1
+                if self.persist:
+                    self._save()
+
+    def _reauthorize(self, generation):
+        """Authorize, unless another thread has done so since the given generation.
+
+        Returns True if this call performed the login itself.
+        """
+        with self._auth_lock:
+            if self.connected and self._auth_generation != generation:
+                return False
+            self.authorize()
+            return True
 
     def disconnect(self):
         self._disconnect()
-        self.session.headers.clear()
-        self.session.cookies.clear()
-        if self.persist:
-            self._save()
-        self.connected = False
+        self._cache.clear()
+        with self._auth_lock:
+            self.session.headers.clear()
+            self.session.cookies.clear()
+            if self.persist:
+                self._save()
+            self.connected = False
 
     def _filter_records(self, filter, records):
         if not filter or not records:
@@ -493,9 +690,35 @@ class AESessionBase(object):
         else:
             ident = Identifier.from_string(ident, itype)
             filter = ident.project_filter(itype=itype, ignore_revision=True)
-        matches = getattr(self, f"{record_type}_list")(filter=filter, **kwargs)
+        matches = self._ident_by_id(record_type, filter, **kwargs)
+        if matches is None:
+            matches = getattr(self, f"{record_type}_list")(filter=filter, **kwargs)
         return self._should_be_one(matches, filter, quiet)
 
+    def _ident_by_id(self, record_type, filter, **kwargs):
+        """Look up a record directly by its ID, if the filter requires an exact one.
+
+        Returns the list of matching records, or None if the record type does not
+        support direct retrieval or the filter does not pin down a single ID, in
+        which case the caller must fall back to scanning the full list.
+        """
+        endpoint = self._direct_endpoints.get(record_type)
+        id = exact_value(filter, "id") if endpoint else None
+        if not id or not re.fullmatch(RE_ID, id):
+            return None
+        try:
+            record = self._get(f"{endpoint}/{id}")
+        except AEUnexpectedResponseError as exc:
+            if exc.status_code != 404:
+                return None
+            record = None
+        except requests.exceptions.RetryError:
+            return None
+        if record:
+            # The full filter is applied, since it may constrain other fields too
+            record = self._fix_records(record_type, record, filter=filter, **kwargs)
+        return [record] if record else EmptyRecordList(record_type)
+
     def _format_table(self, response, columns):
         is_series = isinstance(response, dict)
         rlist = [response] if is_series else response
@@ -557,17 +780,65 @@ class AESessionBase(object):
             return pd.DataFrame(records, columns=columns)
         return records, columns
 
+    def _resource_prefix(self, url):
+        """Return the first path component of a URL relative to the API base."""
+        path, root = urlsplit(url).path, urlsplit(self.base).path
+        if path.startswith(root):
+            path = path[len(root) :]
+        return path.strip("/").split("/", 1)[0]
+
+    def _map(self, func, items):
+        """Apply func to each of a list of items concurrently, returning the results in order.
+
+        At most MAX_WORKERS calls run at once. If any call fails, the calls
+        that have not yet started are cancelled, and its exception is raised.
+        """
+        workers = min(MAX_WORKERS, len(items))
+        if workers <= 1:
+            return [func(item) for item in items]
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ae5-api")
+        try:
+            return list(executor.map(func, items))
+        finally:
+            executor.shutdown(cancel_futures=True)
+
     def _api(self, method, endpoint, **kwargs):
         format = kwargs.pop("format", None)
         subdomain = kwargs.pop("subdomain", None)
+        cache = kwargs.pop("cache", False)
         base = self.base.replace("//", f"//{subdomain}.") if subdomain else self.base
         url = urljoin(base, endpoint)
+        if method == "get" and cache and self._cache.enabled:
+            # Opt-in caching of GET responses. The response object itself is cached
+            # so that each caller receives a freshly decoded copy of the content.
+            # Concurrent requests for the same content share a single request.
+            cache_key = (url, json.dumps(kwargs, sort_keys=True, default=str))
+            response = self._cache.get_or_load(cache_key, self._resource_prefix(url), lambda: self._request(method, url, **kwargs))
+        else:
+            response = self._request(method, url, **kwargs)
+            if method != "get":
+                # Any write invalidates the cached reads of the same resource.
+                self._cache.invalidate(self._resource_prefix(url))
+        if format == "response":
+            return response
+        if len(response.content) == 0:
+            return None
+        if format == "blob":
+            return response.content
+        if format == "text":
+            return response.text
+        if "json" in response.headers["content-type"]:
+            return response.json()
+        return response.text
+
+    def _request(self, method, url, **kwargs):
         do_save = False
         allow_retry = True
+        generation = self._auth_generation
         if not self.connected:
-            self.authorize()
-            if self.password is not None:
+            if self._reauthorize(generation) and self.password is not None:
                 allow_retry = False
+            generation = self._auth_generation
         while True:
             try:
                 response = getattr(self.session, method)(url, allow_redirects=False, **kwargs)
@@ -577,6 +848,9 @@ class AESessionBase(object):
                 raise AEUnexpectedResponseError("Connection timeout", method, url, **kwargs)
 
             if 300 <= response.status_code < 400:
+                if kwargs.get("stream"):
+                    # Release the connection, since the body is never read
+                    response.close()
                 # Redirection here happens for two reasons, described below. We
                 # handle them ourselves to provide better behavior than requests.
                 url2 = urljoin(url, response.headers["location"].rstrip())
@@ -589,26 +863,17 @@ class AESessionBase(object):
                 url = url2
                 method = "get"
             elif allow_retry and (response.status_code == 401 or self._is_login(response)):
-                self.authorize()
-                if self.password is not None:
+                # If another thread has already logged in again while this
+                # request was in flight, simply retry with its credentials.
+                if self._reauthorize(generation) and self.password is not None:
                     allow_retry = False
+                generation = self._auth_generation
             elif response.status_code >= 400:
                 raise AEUnexpectedResponseError(response, method, url, **kwargs)
             else:
                 if do_save and self.persist:
                     self._save()
-                break
-        if format == "response":
-            return response
-        if len(response.content) == 0:
-            return None
-        if format == "blob":
-            return response.content
-        if format == "text":
-            return response.text
-        if "json" in response.headers["content-type"]:
-            return response.json()
-        return response.text
+                return response
 
     def api(self, method, endpoint, **kwargs):
         format = kwargs.pop("format", None)
@@ -618,6 +883,57 @@ class AESessionBase(object):
     def _get(self, endpoint, **kwargs):
         return self._api("get", endpoint, **kwargs)
 
+    def _download(self, endpoint, filename, progress=None, sha256=None, **kwargs):
+        """Stream the response to a GET request into a file.
+
+        The content is written in chunks of DOWNLOAD_CHUNK_SIZE bytes to a
+        temporary ".part" file, which is renamed to the final filename only
+        once the download is complete (and verified, if requested).
+
+        Parameters
+        ----------
+        endpoint: str
+            The API endpoint to retrieve.
+        filename: str
+            The destination file.
+        progress: callable, optional
+            Called after each chunk with the number of bytes received so far
+            and the total size, or None if the server did not supply one.
+        sha256: bool or str, optional
+            If True, compute the SHA-256 digest of the content while it is
+            downloaded. If a hex digest is given, the content must match it.
+
+        Returns
+        -------
+        nbytes: int
+            The number of bytes written.
+        digest: str or None
+            The SHA-256 hex digest, if one was requested.
+        """
+        response = self._get(endpoint, format="response", stream=True, **kwargs)
+        total = int(response.headers.get("content-length") or 0) or None
+        hasher = hashlib.sha256() if sha256 else None
+        nbytes = 0
+        partname = filename + ".part"
+        try:
+            with response, open(partname, "wb") as fp:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    fp.write(chunk)
+                    nbytes += len(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    if progress is not None:
+                        progress(nbytes, total)
+            digest = hasher.hexdigest() if hasher is not None else None
+            if isinstance(sha256, str) and digest != sha256.lower():
+                raise AEException(f"SHA-256 mismatch for {filename}: expected {sha256.lower()}, received {digest}")
+            os.replace(partname, filename)
+        except BaseException:
+            if os.path.exists(partname):
+                os.unlink(partname)
+            raise
+        return nbytes, digest
+
     def _delete(self, endpoint, **kwargs):
         return self._api("delete", endpoint, **kwargs)
 
@@ -635,30 +951,99 @@ class AESessionBase(object):
 
 
 class AEUserSession(AESessionBase):
+    _direct_endpoints = {
+        "project": "projects",
+        "session": "sessions",
+        "deployment": "deployments",
+        "job": "jobs",
+        "run": "runs",
+    }
+
     def __init__(self, hostname, username, password=None, persist=True, k8s_endpoint=None):
         self._filename = os.path.join(config._path, "cookies", f"{username}@{hostname}")
         super(AEUserSession, self).__init__(hostname, username, password=password, prefix="api/v2", persist=persist)
         self._k8s_endpoint = k8s_endpoint or os.environ.get("AE5_K8S_ENDPOINT") or "k8s"
         self._k8s_client = None
+        self._k8s_lock = threading.Lock()
+        self._k8s_chunk_size = self._saved_k8s_chunk_size() or K8S_JSON_LIST_MAX
+
+    def _k8s_chunk_file(self):
+        """Return the path of the file holding the chunk sizes learned for this host, or None if the session is not persistent."""
+        if not self.persist:
+            return None
+        return os.path.join(config._path, "k8s", f"{self.hostname}.json")
+
+    def _saved_k8s_chunk_size(self):
+        filename = self._k8s_chunk_file()
+        sizes = load_snapshot(filename, K8S_CHUNK_SIZE_TTL) if filename else None
+        return sizes.get(self._k8s_endpoint) if isinstance(sizes, dict) else None
+
+    def _save_k8s_chunk_size(self, size):
+        filename = self._k8s_chunk_file()
+        if filename is None:
+            return
+        with file_lock(filename):
+            sizes = load_snapshot(filename, K8S_CHUNK_SIZE_TTL) or {}
+            if sizes.get(self._k8s_endpoint, K8S_JSON_LIST_MAX) > size:
+                sizes[self._k8s_endpoint] = size
+                save_snapshot(filename, sizes)
 
     def _k8s(self, method, *args, **kwargs):
         quiet = kwargs.pop("quiet", False)
-        if self._k8s_client is None and self._k8s_endpoint is not None:
-            if self._k8s_endpoint.startswith("ssh:"):
-                username = self._k8s_endpoint[4:]
-                self._k8s_client = AE5K8SLocalClient(self.hostname, username)
-            else:
-                self._k8s_client = AE5K8SRemoteClient(self, self._k8s_endpoint)
-            estr = self._k8s_client.error()
-            if estr:
-                del self._k8s_client
-                self._k8s_endpoint = self._k8s_client = None
-                msg = ["Error establishing k8s connection:"]
-                msg.extend("  " + x for x in estr.splitlines())
-                raise AEException("\n".join(msg))
-        if self._k8s_client is None:
+        with self._k8s_lock:
+            if self._k8s_client is None and self._k8s_endpoint is not None:
+                if self._k8s_endpoint.startswith("ssh:"):
+                    username = self._k8s_endpoint[4:]
+                    client = AE5K8SLocalClient(self.hostname, username)
+                else:
+                    client = AE5K8SRemoteClient(self, self._k8s_endpoint)
+                estr = client.error()
+                if estr:
+                    del client
+                    self._k8s_endpoint = None
+                    msg = ["Error establishing k8s connection:"]
+                    msg.extend("  " + x for x in estr.splitlines())
+                    raise AEException("\n".join(msg))
+                self._k8s_client = client
+            client = self._k8s_client
+        if client is None:
             raise AEException("No k8s connection available")
-        return getattr(self._k8s_client, method)(*args, **kwargs)
+        return getattr(client, method)(*args, **kwargs)
+
+    def _pod_info_chunk(self, ids):
+        try:
+            return self._k8s("pod_info", ids)
+        except (AEException, requests.exceptions.HTTPError) as exc:
+            status_code = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+            if status_code != 413 or len(ids) == 1:
+                raise
+        # Use smaller chunks from now on, in this session and in later ones. The
+        # size is read again for each piece, so that a limit learned by a
+        # concurrent request is used at once.
+        size = min(self._k8s_chunk_size, (len(ids) + 1) // 2)
+        if size < self._k8s_chunk_size:
+            self._k8s_chunk_size = size
+            self._save_k8s_chunk_size(size)
+        results = []
+        start = 0
+        while start < len(ids):
+            size = self._k8s_chunk_size
+            results.extend(self._pod_info_chunk(ids[start : start + size]))
+            start += size
+        return results
+
+    def _pod_info(self, ids):
+        """Call pod_info for a list of ids, splitting them into chunks that are sent concurrently.
+
+        The chunk size starts at K8S_JSON_LIST_MAX, and adapts to the largest
+        request the endpoint accepts. Persistent sessions save the reduced size
+        for the host, so later sessions start from it for K8S_CHUNK_SIZE_TTL.
+        """
+        size = self._k8s_chunk_size
+        results = []
+        for part in self._map(self._pod_info_chunk, [ids[k : k + size] for k in range(0, len(ids), size)]):
+            results.extend(part)
+        return results
 
     def _set_header(self):
         s = self.session
@@ -710,15 +1095,18 @@ class AEUserSession(AESessionBase):
         # This will actually close out the session, so even if the cookie had
         # been captured for use elsewhere, it would no longer be useful.
         self._get("/logout")
-        if self._k8s_client is not None:
-            self._k8s_client.disconnect()
-            del self._k8s_client
-            self._k8s_client = None
+        with self._k8s_lock:
+            if self._k8s_client is not None:
+                self._k8s_client.disconnect()
+                del self._k8s_client
+                self._k8s_client = None
 
     def _save(self):
-        os.makedirs(os.path.dirname(self._filename), mode=0o700, exist_ok=True)
-        self.session.cookies.save(self._filename, ignore_discard=True)
-        os.chmod(self._filename, 0o600)
+        cookies = self.session.cookies
+        # Holding the jar's own lock keeps responses on other threads from
+        # modifying the cookies while they are being written out.
+        with self._save_lock, cookies._cookies_lock:
+            atomic_save(self._filename, lambda fname: cookies.save(fname, ignore_discard=True))
 
     def _api_records(self, method, endpoint, filter=None, **kwargs):
         record_type = kwargs.pop("record_type", None)
@@ -741,6 +1129,11 @@ class AEUserSession(AESessionBase):
     def _post_record(self, endpoint, filter=None, **kwargs):
         return self._api_records("post", endpoint, filter=filter, **kwargs)
 
+    def _project_map(self):
+        # Sessions, jobs, runs and endpoints are all annotated with their project
+        # records, so the project list is cached to avoid fetching it repeatedly.
+        return {x["id"]: x for x in self._get_records("projects", api_kwargs={"cache": True})}
+
     def _post_project(self, records, collaborators=False):
         if collaborators:
             self._join_collaborators("projects", records)
@@ -913,7 +1306,7 @@ class AEUserSession(AESessionBase):
         return response
 
     def resource_profile_list(self, filter=None, format=None):
-        response = self._get("projects/actions", params={"q": "create_action"})
+        response = self._get("projects/actions", params={"q": "create_action"}, cache=True)
         response = response[0]["resource_profiles"]
         response = self._fix_records("resource_profile", response, filter=filter)
         return self._format_response(response, format=format)
@@ -932,7 +1325,7 @@ class AEUserSession(AESessionBase):
         return response
 
     def editor_list(self, filter=None, format=None):
-        response = self._get("projects/actions", params={"q": "create_action"})
+        response = self._get("projects/actions", params={"q": "create_action"}, cache=True)
         response = response[0]["editors"]
         response = self._fix_records("editor", response, filter=filter)
         return self._format_response(response, format=format)
@@ -1076,7 +1469,15 @@ class AEUserSession(AESessionBase):
         rrec = self._revision(ident, quiet=quiet)
         return self._format_response(rrec["_commands"], format=format)
 
-    def project_download(self, ident, filename=None, format=None):
+    def project_download(self, ident, filename=None, format=None, progress=None, sha256=None, report=False):
+        """Download a project revision archive.
+
+        The archive is streamed to disk, so it is never held in memory in full.
+        See _download for a description of the progress and sha256 arguments.
+        Returns the filename, if one was not supplied. If report is True,
+        returns instead a record of the filename, the size of the archive in
+        bytes, and its SHA-256 digest, if one was requested.
+        """
         rrec = self._revision(ident, keep_latest=True)
         prec, rev = rrec["_project"], rrec["id"]
         if rrec["name"] == "latest":
@@ -1085,9 +1486,12 @@ class AEUserSession(AESessionBase):
         if need_filename:
             revdash = f'-{rrec["name"]}' if rrec["name"] != "latest" else ""
             filename = f'{prec["name"]}{revdash}.tar.gz'
-        response = self._get(f'projects/{prec["id"]}/revisions/{rev}/archive', format="blob")
-        with open(filename, "wb") as fp:
-            fp.write(response)
+        nbytes, digest = self._download(f'projects/{prec["id"]}/revisions/{rev}/archive', filename, progress=progress, sha256=sha256)
+        if report:
+            record = {"filename": filename, "size": nbytes}
+            if digest is not None:
+                record["sha256"] = digest
+            return self._format_response(record, format=format, columns=("filename", "size", "sha256"))
         if need_filename:
             return filename
 
@@ -1137,19 +1541,39 @@ class AEUserSession(AESessionBase):
             print("Starting image build. This may take several minutes.")
             build_image(tempdir, tag=tag, debug=debug)
 
+    def _wait_for(self, states, fetch, done):
+        try:
+            return wait_for(states, fetch, done)
+        except TimeoutError as exc:
+            raise AEException(str(exc)) from None
+
     def _wait(self, response):
-        index = 0
-        id = response.get("project_id", response["id"])
-        status = response["action"]
-        while not status["done"] and not status["error"]:
-            time.sleep(1)
-            params = {"sort": "-updated", "page[size]": index + 1}
-            activity = self._get(f"projects/{id}/activity", params=params)
-            try:
-                status = next(s for s in activity["data"] if s["id"] == status["id"])
-            except StopIteration:
-                index = index + 1
-        response["action"] = status
+        """Wait for the action of a project response to finish, storing its final status in the response.
+
+        Each poll reads the most recent page of the project activity, and looks
+        one entry further back whenever the action is not in it.
+        """
+        pid = response.get("project_id", response["id"])
+        page = {"size": 1}
+
+        def fetch(aids):
+            activity = self._get(f"projects/{pid}/activity", params={"sort": "-updated", "page[size]": page["size"]})
+            statuses = {s["id"]: s for s in activity["data"] if s["id"] in aids}
+            if not statuses:
+                page["size"] += 1
+            return statuses
+
+        action = response["action"]
+        response["action"] = self._wait_for({action["id"]: action}, fetch, lambda s: s["done"] or s["error"])[action["id"]]
+
+    def _wait_record(self, record_type, record, done):
+        """Poll a record until done(record) is True, returning the final record."""
+        rid = record["id"]
+
+        def fetch(ids):
+            return {rid: self._get_records(f"{record_type}s/{rid}", record_type=record_type)}
+
+        return self._wait_for({rid: record}, fetch, done)[rid]
 
     def project_create(self, url, name=None, tag=None, make_unique=None, wait=True, format=None):
         if not name:
@@ -1170,7 +1594,15 @@ class AEUserSession(AESessionBase):
         if wait:
             return self.project_info(response["id"], format=format, retry=True)
 
-    def project_upload(self, project_archive, name, tag, wait=True, format=None):
+    def project_upload(self, project_archive, name, tag, wait=True, format=None, compression=None, compression_level=None, cache=None):
+        """Upload a project archive, or a project directory.
+
+        When given a directory, an archive is created while it is uploaded,
+        using the given compression type ("gz", "bz2", or "xz") and level;
+        see archiver.create_tar_archive for the defaults. If cache is True
+        (default: ARCHIVE_CACHE), the archive is saved under ~/.ae5/archives,
+        and reused by later uploads of the unchanged directory.
+        """
         if not name:
             if type(project_archive) == bytes:
                 raise RuntimeError("Project name must be supplied for binary input")
@@ -1179,29 +1611,28 @@ class AEUserSession(AESessionBase):
                 if name.endswith(suffix):
                     name = name[: -len(suffix)]
                     break
-        try:
-            f = None
-            if type(project_archive) == bytes:
-                f = io.BytesIO(project_archive)
-            elif not os.path.exists(project_archive):
-                raise RuntimeError(f"File/directory not found: {project_archive}")
-            elif not isdir(project_archive):
-                f = open(project_archive, "rb")
-            elif not isfile(join(project_archive, "anaconda-project.yml")):
-                raise RuntimeError(f"Project directory must include anaconda-project.yml")
+        if type(project_archive) == bytes:
+            source, filename = project_archive, f"{name}.tar.gz"
+        elif not os.path.exists(project_archive):
+            raise RuntimeError(f"File/directory not found: {project_archive}")
+        elif not isdir(project_archive):
+            source, filename = project_archive, project_archive
+        elif not isfile(join(project_archive, "anaconda-project.yml")):
+            raise RuntimeError(f"Project directory must include anaconda-project.yml")
+        else:
+            # The archive is created on a producer thread while it is being uploaded
+            compression = compression or ARCHIVE_COMPRESSION
+            if ARCHIVE_CACHE if cache is None else cache:
+                source = ArchiveCache(os.path.join(config._path, "archives")).source(project_archive, "project", compression, compression_level)
             else:
-                f = io.BytesIO()
-                create_tar_archive(project_archive, "project", f)
-                project_archive = project_archive + ".tar.gz"
-            f.seek(0)
-            data = {"name": name}
-            if tag:
-                data["tag"] = tag
-            f = (project_archive, f)
-            response = self._post_record("projects/upload", record_type="project", api_kwargs={"files": {b"project_file": f}, "data": data})
-        finally:
-            if f is not None:
-                f[1].close()
+                source = functools.partial(create_tar_archive, project_archive, "project", compression=compression, level=compression_level)
+            filename = project_archive + ARCHIVE_SUFFIXES[compression]
+        data = {"name": name}
+        if tag:
+            data["tag"] = tag
+        body = MultipartBody(data, "project_file", filename, source)
+        api_kwargs = {"data": body, "headers": {"Content-Type": body.content_type}}
+        response = self._post_record("projects/upload", record_type="project", api_kwargs=api_kwargs)
         if response.get("error"):
             raise RuntimeError("Error uploading project: {}".format(response["error"]["message"]))
         if wait:
@@ -1212,14 +1643,17 @@ class AEUserSession(AESessionBase):
             return self.project_info(response["id"], format=format, retry=True)
 
     def _join_collaborators(self, what, response):
+        def _collaborators(rec):
+            api_kwargs = {"timeout": REQUEST_TIMEOUT} if REQUEST_TIMEOUT else None
+            return self._get_records(f'{rec["_record_type"]}s/{rec["id"]}/collaborators', api_kwargs=api_kwargs)
+
         if isinstance(response, dict):
-            what, id = response["_record_type"], response["id"]
-            collabs = self._get_records(f"{what}s/{id}/collaborators")
-            response["collaborators"] = ", ".join(c["id"] for c in collabs)
-            response["_collaborators"] = collabs
-        elif response:
-            for rec in response:
-                self._join_collaborators(what, rec)
+            response = [response]
+        if response:
+            # One request per record, so these are made concurrently
+            for rec, collabs in zip(response, self._map(_collaborators, response)):
+                rec["collaborators"] = ", ".join(c["id"] for c in collabs)
+                rec["_collaborators"] = collabs
         elif hasattr(response, "_columns"):
             response._columns.extend(("collaborators", "_collaborators"))
 
@@ -1228,9 +1662,7 @@ class AEUserSession(AESessionBase):
         rlist = [record] if is_single else record
         if rlist:
             rlist2 = []
-            # Limit the size of the input to pod_info to avoid 413 errors
-            idchunks = [[r["id"] for r in rlist[k : k + K8S_JSON_LIST_MAX]] for k in range(0, len(rlist), K8S_JSON_LIST_MAX)]
-            record2 = sum((self._k8s("pod_info", ch) for ch in idchunks), [])
+            record2 = self._pod_info([r["id"] for r in rlist])
             for rec, rec2 in zip(rlist, record2):
                 if not rec2:
                     continue
@@ -1238,9 +1670,10 @@ class AEUserSession(AESessionBase):
                 rec["phase"] = rec2["phase"]
                 rec["since"] = rec2["since"]
                 rec["rst"] = rec2["restarts"]
-                rec["usage/mem"] = rec2["usage"]["mem"]
-                rec["usage/cpu"] = rec2["usage"]["cpu"]
-                rec["usage/gpu"] = rec2["usage"]["gpu"]
+                # Numbers; _to_float also parses the text of endpoints that predate raw mode
+                rec["usage/mem"] = _to_float(rec2["usage"]["mem"])
+                rec["usage/cpu"] = _to_float(rec2["usage"]["cpu"])
+                rec["usage/gpu"] = _to_float(rec2["usage"]["gpu"])
                 if changes:
                     if "changes" in rec2:
                         chg = rec2["changes"]
@@ -1266,7 +1699,7 @@ class AEUserSession(AESessionBase):
         # The "name" value in an internal AE5 session record is nothing
         # more than the "id" value with the "a1-" stub removed. Not very
         # helpful, even if understandable.
-        precs = {x["id"]: x for x in self._get_records("projects")}
+        precs = self._project_map()
         for rec in records:
             pid = "a0-" + rec["project_url"].rsplit("/", 1)[-1]
             prec = precs.get(pid, {})
@@ -1373,10 +1806,8 @@ class AEUserSession(AESessionBase):
         return self._format_response(record, format=format)
 
     def _pre_endpoint(self, records):
-        dlist = self.deployment_list()
-        plist = self.project_list()
+        dlist, pmap = self._map(lambda func: func(), [self.deployment_list, self._project_map])
         dmap = {drec["endpoint"]: drec for drec in dlist if drec["endpoint"]}
-        pmap = {prec["id"]: prec for prec in plist}
         newrecs = []
         for rec in records:
             drec = dmap.get(rec["id"])
@@ -1499,9 +1930,7 @@ class AEUserSession(AESessionBase):
             self.deployment_collaborator_list_set(id, collaborators)
         # The _wait method doesn't work here. The action isn't even updated, it seems
         if wait or stop_on_error:
-            while response["state"] in ("initial", "starting"):
-                time.sleep(2)
-                response = self._get_records(f"deployments/{id}", record_type="deployment")
+            response = self._wait_record("deployment", response, lambda r: r["state"] not in ("initial", "starting"))
             if response["state"] != "started":
                 if stop_on_error:
                     self.deployment_stop(id)
@@ -1524,16 +1953,14 @@ class AEUserSession(AESessionBase):
         self.deployment_stop(drec)
 
         # Ensure the deployment has been stopped.
-        stopping: bool = True
-        time.sleep(2)
-        while stopping:
+        def stopped(ids):
             try:
                 self.deployment_info(ident=drec["id"])
             except Exception as error:
-                if str(error).startswith("No deployments found matching"):
-                    stopping = False
-                else:
-                    time.sleep(2)
+                return {drec["id"]: str(error).startswith("No deployments found matching")}
+            return {}
+
+        self._wait_for({drec["id"]: False}, stopped, bool)
 
         # Complete the restart
         return self.deployment_start(
@@ -1601,7 +2028,7 @@ class AEUserSession(AESessionBase):
         return self._format_response(response, format=format)
 
     def _pre_job(self, records):
-        precs = {x["id"]: x for x in self._get_records("projects")}
+        precs = self._project_map()
         for rec in records:
             if rec.get("project_url"):
                 pid = "a0-" + (rec.get("project_url") or "").rsplit("/", 1)[-1]
@@ -1728,10 +2155,7 @@ class AEUserSession(AESessionBase):
             jid = response["id"]
             run = self._get_records(f"jobs/{jid}/runs")[-1]
             if wait:
-                rid = run["id"]
-                while run["state"] not in ("completed", "error", "failed"):
-                    time.sleep(5)
-                    run = self._get(f"runs/{rid}")
+                run = self._wait_record("run", run, lambda r: r["state"] in ("completed", "error", "failed"))
                 if cleanup:
                     self._delete(f"jobs/{jid}")
             if show_run:
@@ -1798,7 +2222,10 @@ class AEUserSession(AESessionBase):
         return self._join_k8s(records, changes=True)
 
     def pod_list(self, filter=None, format=None):
-        records = self.session_list(filter=filter) + self.deployment_list(filter=filter) + self.run_list(filter=filter)
+        # The three listings are independent, so they are fetched concurrently
+        records = []
+        for part in self._map(lambda func: func(filter=filter), [self.session_list, self.deployment_list, self.run_list]):
+            records.extend(part)
         records = self._fix_records("pod", records)
         return self._format_response(records, format=format)
 
@@ -1815,27 +2242,27 @@ class AEUserSession(AESessionBase):
                     "role": rec["role"],
                     "ready": rec["ready"],
                     "capacity/pod": rec["capacity"]["pods"],
-                    "capacity/mem": rec["capacity"]["mem"],
-                    "capacity/cpu": rec["capacity"]["cpu"],
-                    "capacity/gpu": rec["capacity"]["gpu"],
+                    "capacity/mem": _to_float(rec["capacity"]["mem"]),
+                    "capacity/cpu": _to_float(rec["capacity"]["cpu"]),
+                    "capacity/gpu": _to_float(rec["capacity"]["gpu"]),
                     "usage/pod": rec["total"]["pods"],
-                    "usage/mem": rec["total"]["usage"]["mem"],
-                    "usage/cpu": rec["total"]["usage"]["cpu"],
-                    "usage/gpu": rec["total"]["usage"]["gpu"],
+                    "usage/mem": _to_float(rec["total"]["usage"]["mem"]),
+                    "usage/cpu": _to_float(rec["total"]["usage"]["cpu"]),
+                    "usage/gpu": _to_float(rec["total"]["usage"]["gpu"]),
                     "sessions/pod": rec["sessions"]["pods"],
-                    "sessions/mem": rec["sessions"]["usage"]["mem"],
-                    "sessions/cpu": rec["sessions"]["usage"]["cpu"],
-                    "sessions/gpu": rec["sessions"]["usage"]["gpu"],
+                    "sessions/mem": _to_float(rec["sessions"]["usage"]["mem"]),
+                    "sessions/cpu": _to_float(rec["sessions"]["usage"]["cpu"]),
+                    "sessions/gpu": _to_float(rec["sessions"]["usage"]["gpu"]),
                     "deployments/pod": rec["deployments"]["pods"],
-                    "deployments/mem": rec["deployments"]["usage"]["mem"],
-                    "deployments/cpu": rec["deployments"]["usage"]["cpu"],
-                    "deployments/gpu": rec["deployments"]["usage"]["gpu"],
+                    "deployments/mem": _to_float(rec["deployments"]["usage"]["mem"]),
+                    "deployments/cpu": _to_float(rec["deployments"]["usage"]["cpu"]),
+                    "deployments/gpu": _to_float(rec["deployments"]["usage"]["gpu"]),
                     "middleware/pod": rec["middleware"]["pods"],
-                    "middleware/mem": rec["middleware"]["usage"]["mem"],
-                    "middleware/cpu": rec["middleware"]["usage"]["cpu"],
+                    "middleware/mem": _to_float(rec["middleware"]["usage"]["mem"]),
+                    "middleware/cpu": _to_float(rec["middleware"]["usage"]["cpu"]),
                     "system/pod": rec["system"]["pods"],
-                    "system/mem": rec["system"]["usage"]["mem"],
-                    "system/cpu": rec["system"]["usage"]["cpu"],
+                    "system/mem": _to_float(rec["system"]["usage"]["mem"]),
+                    "system/cpu": _to_float(rec["system"]["usage"]["cpu"]),
                     "_k8s": rec,
                     "_record_type": "node",
                 }
@@ -1851,25 +2278,60 @@ class AEUserSession(AESessionBase):
 class AEAdminSession(AESessionBase):
     def __init__(self, hostname, username, password=None, persist=True):
         self._sdata = None
+        self._filename = os.path.join(config._path, "tokens", f"{username}@{hostname}")
         self._login_base = f"https://{hostname}/auth/realms/master/protocol/openid-connect"
+        # The last refresh token that Keycloak rejected, so that it is not tried twice
+        self._rejected_refresh = None
         super(AEAdminSession, self).__init__(hostname, username, password, prefix="auth/admin/realms/AnacondaPlatform", persist=persist)
 
     def _load(self):
-        self._filename = os.path.join(config._path, "tokens", f"{self.username}@{self.hostname}")
         if os.path.exists(self._filename):
-            with open(self._filename, "r") as fp:
-                sdata = json.load(fp)
-            if isinstance(sdata, dict) and "refresh_token" in sdata:
-                resp = self.session.post(
-                    self._login_base + "/token",
-                    data={
-                        "refresh_token": sdata["refresh_token"],
-                        "grant_type": "refresh_token",
-                        "client_id": "admin-cli",
-                    },
-                )
-                if resp.status_code == 200:
-                    self._sdata = resp.json()
+            self._refresh()
+
+    def _refresh(self):
+        """
+        Obtains a valid access token without a password.
+
+        The saved token is reused if it is not close to expiry, and is not the
+        one the server has just rejected. Otherwise it is renewed with the refresh
+        token. For persistent sessions this happens under a lock on the token
+        file, so that concurrent processes renew the token once and share it.
+
+        Returns
+        -------
+        connected: bool
+            True if a valid token was obtained.
+        """
+
+        rejected = self._sdata.get("access_token") if self._connected() else None
+        with file_lock(self._filename) if self.persist else contextlib.nullcontext():
+            sdata = self._sdata
+            if self.persist and os.path.exists(self._filename):
+                with open(self._filename, "r") as fp:
+                    sdata = json.load(fp)
+            if not isinstance(sdata, dict):
+                return False
+            if sdata.get("access_token") != rejected and _token_valid(sdata):
+                self._sdata = sdata
+                return True
+            refresh_token = sdata.get("refresh_token")
+            if refresh_token is None or refresh_token == self._rejected_refresh:
+                return False
+            resp = self.session.post(
+                self._login_base + "/token",
+                data={
+                    "refresh_token": refresh_token,
+                    "grant_type": "refresh_token",
+                    "client_id": "admin-cli",
+                },
+            )
+            if resp.status_code != 200:
+                self._rejected_refresh = refresh_token
+                return False
+            self._sdata = _token_issued(resp.json())
+            if self.persist:
+                self._save()
+            return True
 
     def _connected(self):
         return isinstance(self._sdata, dict) and "access_token" in self._sdata
@@ -1891,7 +2353,7 @@ class AEAdminSession(AESessionBase):
 
             if resp.status_code not in [401]:
                 try:
-                    self._sdata = resp.json()
+                    self._sdata = _token_issued(resp.json())
                 except json.decoder.JSONDecodeError as error:
                     # The response is not json parsable.
                     # This is most likely some type of error (serialized, or html content, etc).
@@ -1927,23 +2389,45 @@ class AEAdminSession(AESessionBase):
             self._sdata.clear()
 
     def _save(self):
-        os.makedirs(os.path.dirname(self._filename), mode=0o700, exist_ok=True)
-        with open(self._filename, "w") as fp:
-            json.dump(self._sdata, fp)
+        def _dump(fname):
+            with open(fname, "w") as fp:
+                json.dump(self._sdata, fp)
+
+        with self._save_lock:
+            atomic_save(self._filename, _dump)
+
+    def _keycloak_count(self, path, params):
+        endpoint = KEYCLOAK_COUNT_ENDPOINTS.get(path)
+        if endpoint is not None:
+            try:
+                count = self._get(endpoint, params={k: v for k, v in params.items() if k not in ("first", "max")})
+            except AEException:
+                return None
+            if isinstance(count, int):
+                return count
 
     def _get_paginated(self, path, **kwargs):
+        """Retrieve the records of a paginated keycloak listing, in order.
+
+        If the endpoint reports its total number of records, every page is
+        requested at once. Otherwise, if the first page is full, the next
+        KEYCLOAK_PREFETCH pages are requested together, and so on until a
+        page comes back short. Requests are made concurrently, through _map.
+        """
         records = []
         limit = kwargs.pop("limit", sys.maxsize)
-        kwargs.setdefault("first", 0)
+        first = kwargs.pop("first", 0)
+        size = min(KEYCLOAK_PAGE_MAX, limit)
+        count = self._keycloak_count(path, kwargs)
+        npages = 1 if count is None else max(1, -(-min(count - first, limit) // size))
+        page = 0
         while True:
-            kwargs["max"] = min(KEYCLOAK_PAGE_MAX, limit)
-            t_records = self._get(path, params=kwargs)
-            records.extend(t_records)
-            n_records = len(t_records)
-            if n_records < kwargs["max"] or n_records == limit:
+            page_params = _page_params(kwargs, first, size, limit, range(page, page + npages))
+            pages = self._map(lambda params: self._get(path, params=params), page_params)
+            if _extend_pages(records, page_params, pages, limit):
                 return records
-            kwargs["first"] += n_records
-            limit -= n_records
+            page += npages
+            npages = KEYCLOAK_PREFETCH
 
     def user_events(self, format=None, **kwargs):
         first = kwargs.pop("first", 0)
@@ -2048,7 +2532,7 @@ class AEAdminSession(AESessionBase):
         """
 
         # Get user id
-        user_info = self.user_info(ident=username, format=None, quiet=False, include_login=True)
+        user_info = self.user_info(ident=username, format=None, quiet=False, include_login=False, fast=True)
 
         # Create list of role to add
         data: list[dict] = []
@@ -2062,6 +2546,7 @@ class AEAdminSession(AESessionBase):
 
         # Add the roles
         self._post(endpoint=f"users/{user_info['id']}/role-mappings/realm", json=data)
+        self._drop_membership_snapshot()
 
     def user_roles_remove(self, username: str, names: list[str], **kwargs) -> None:
         """
@@ -2077,7 +2562,7 @@ class AEAdminSession(AESessionBase):
         """
 
         # Get user id
-        user_info = self.user_info(ident=username, format=None, quiet=False, include_login=True)
+        user_info = self.user_info(ident=username, format=None, quiet=False, include_login=False, fast=True)
 
         # Create list of role to add
         data: list[dict] = []
@@ -2091,6 +2576,7 @@ class AEAdminSession(AESessionBase):
 
         # Add the roles
         self._delete(endpoint=f"users/{user_info['id']}/role-mappings/realm", json=data)
+        self._drop_membership_snapshot()
 
     def user_delete(self, username: str, format=None):
         """
@@ -2103,18 +2589,48 @@ class AEAdminSession(AESessionBase):
             The username of the account to remove.
         """
 
-        user_info = self.user_info(ident=username, format=None, quiet=False, include_login=True)
+        user_info = self.user_info(ident=username, format=None, quiet=False, include_login=False, fast=True)
         self._delete(endpoint=f"users/{user_info['id']}")
+        self._drop_membership_snapshot()
+
+    def _login_cursor(self) -> str | None:
+        """
+        Returns the path of the file holding the last login times for this host,
+        or `None` if the session is not persistent or the cursor is disabled.
+        """
+
+        if not (self.persist and LOGIN_CURSOR):
+            return None
+        return os.path.join(config._path, "logins", f"{self.hostname}.json")
+
+    def _last_logins(self) -> dict[str, int]:
+        """
+        Returns a mapping of user ids to their last login times, in ms.
+
+        With a login cursor, the mapping and the time of the latest event seen
+        are kept on disk, so that only the events since then are read.
+        """
+
+        filename = self._login_cursor()
+        if filename is None:
+            logins: dict[str, int] = {}
+            _merge_logins(logins, self._get_paginated("events", **_login_params(0)))
+            return logins
+        with file_lock(filename):
+            state = load_snapshot(filename, float("inf")) or {"mark": 0, "logins": {}}
+            mark = _merge_logins(state["logins"], self._get_paginated("events", **_login_params(state["mark"])))
+            if mark > state["mark"]:
+                state["mark"] = mark
+                save_snapshot(filename, state)
+        return state["logins"]
 
     def _post_user(self, users, include_login=False):
         users = {u["id"]: u for u in users}
-        if include_login:
-            events = self._get_paginated("events", client="anaconda-platform", type="LOGIN")
-            for e in events:
-                if "response_mode" not in e["details"]:
-                    urec = users.get(e["userId"])
-                    if urec and "lastLogin" not in urec:
-                        urec["lastLogin"] = e["time"]
+        if include_login and users:
+            logins = self._last_logins()
+            for uid, urec in users.items():
+                if uid in logins and "lastLogin" not in urec:
+                    urec["lastLogin"] = logins[uid]
         users = list(users.values())
         for urec in users:
             urec.setdefault("lastLogin", 0)
@@ -2149,11 +2665,8 @@ class AEAdminSession(AESessionBase):
             users = self._fix_records("user", users, filter)
             return self._format_response(users, format=format)
 
-        # Get realm roles user map
-        role_maps: dict[str, list] = self._build_realm_role_user_map()
-
-        # Get realm groups user map
-        group_maps: dict[str, list] = self._build_realm_group_user_map()
+        # Get realm roles and groups user maps
+        role_maps, group_maps = self._realm_membership_maps()
 
         # Get realm roles for the users and merge results
         users = self._merge_users_with_realm_roles(users=users, role_maps=role_maps)
@@ -2234,10 +2747,8 @@ class AEAdminSession(AESessionBase):
         """
 
         realm_groups: list[dict] = self._get_realm_groups()
-        group_maps: dict[str, list] = {}
-        for group in realm_groups:
-            maps = self._get_group_members(group_id=group["id"])
-            group_maps[group["name"]] = maps
+        maps = self._map(lambda group: self._get_group_members(group_id=group["id"]), realm_groups)
+        group_maps: dict[str, list] = {group["name"]: members for group, members in zip(realm_groups, maps)}
         return group_maps
 
     def _build_realm_role_user_map(self) -> dict[str, list]:
@@ -2250,11 +2761,57 @@ class AEAdminSession(AESessionBase):
         """
 
         realm_roles: list[dict] = self._get_realm_roles()
-        role_maps: dict[str, list] = {}
-        for role in realm_roles:
-            role_maps[role["name"]] = self._get_role_users(role_name=role["name"])
+        maps = self._map(lambda role: self._get_role_users(role_name=role["name"]), realm_roles)
+        role_maps: dict[str, list] = {role["name"]: users for role, users in zip(realm_roles, maps)}
         return role_maps
 
+    def _membership_snapshot(self) -> str | None:
+        """
+        Returns the path of the on-disk snapshot of the realm membership maps,
+        or `None` if snapshots are disabled (AE5_MEMBERSHIP_SNAPSHOT_TTL=0).
+        """
+
+        if MEMBERSHIP_SNAPSHOT_TTL <= 0:
+            return None
+        return os.path.join(config._path, "snapshots", f"memberships-{self.username}@{self.hostname}.json")
+
+    def _drop_membership_snapshot(self) -> None:
+        """
+        Removes the membership snapshot, if any, after a change to the role or group memberships.
+        """
+
+        filename = self._membership_snapshot()
+        if filename is not None:
+            with file_lock(filename):
+                try:
+                    os.unlink(filename)
+                except FileNotFoundError:
+                    pass
+
+    def _realm_membership_maps(self) -> tuple[dict[str, list], dict[str, list]]:
+        """
+        Builds the realm role and group user maps, or reuses them from a recent snapshot.
+
+        The snapshot is read and written under a lock, so that concurrent
+        invocations (e.g., from a script) crawl Keycloak only once per TTL.
+
+        Returns
+        -------
+        maps: tuple[dict[str, list], dict[str, list]]
+            The role and group maps, as returned by `_build_realm_role_user_map` and `_build_realm_group_user_map`.
+        """
+
+        filename = self._membership_snapshot()
+        if filename is None:
+            return self._build_realm_role_user_map(), self._build_realm_group_user_map()
+        with file_lock(filename):
+            maps = load_snapshot(filename, MEMBERSHIP_SNAPSHOT_TTL)
+            if maps is None:
+                maps = self._build_realm_role_user_map(), self._build_realm_group_user_map()
+                save_snapshot(filename, maps)
+        role_maps, group_maps = maps
+        return role_maps, group_maps
+
     def _get_realm_roles(self, **kwargs) -> list[dict]:
         """
         Returns the list of realm roles.
@@ -2305,7 +2862,7 @@ class AEAdminSession(AESessionBase):
         limit = kwargs.pop("limit", sys.maxsize)
         return self._get_paginated(path="groups", first=first, max=limit, **kwargs)
 
-    def _get_user_realm_roles(self, user: dict, role_maps: dict[str, list]) -> list[str]:
+    def _get_user_realm_roles(self, user: dict, role_maps: dict[str, list], index: dict[str, list] | None = None) -> list[str]:
         """
         Given a user object and a mapping of roles to users, returns the list of realm roles the user has mapped.
 
@@ -2315,6 +2872,9 @@ class AEAdminSession(AESessionBase):
             A user object (as a dictionary)
         role_maps: dict[str, list]
             A diction of roles to mapped users.
+        index: dict[str, list], optional
+            The role_maps inverted by _invert_memberships. Callers that look up
+            many users build it once; otherwise the maps are indexed afresh.
 
         Returns
         -------
@@ -2322,14 +2882,12 @@ class AEAdminSession(AESessionBase):
             A list of realm roles the user is mapped to.
         """
 
-        user_realm_roles: list[str] = []
-        for role_name, role_users in role_maps.items():
-            for role_user in role_users:
-                if user["id"] == role_user["id"]:
-                    user_realm_roles.append(role_name)
+        if index is None:
+            index = _invert_memberships(role_maps)
+        user_realm_roles: list[str] = list(index.get(user.get("id"), ()))
         return user_realm_roles
 
-    def _get_user_realm_groups(self, user: dict, group_maps: dict[str, list]) -> list[str]:
+    def _get_user_realm_groups(self, user: dict, group_maps: dict[str, list], index: dict[str, list] | None = None) -> list[str]:
         """
         Given a user object and a mapping of groups to users, returns the list of realm groups the user has mapped.
 
@@ -2339,6 +2897,9 @@ class AEAdminSession(AESessionBase):
             A user object (as a dictionary)
         group_maps: dict[str, list]
             A diction of groups to mapped users.
+        index: dict[str, list], optional
+            The group_maps inverted by _invert_memberships. Callers that look up
+            many users build it once; otherwise the maps are indexed afresh.
 
         Returns
         -------
@@ -2346,11 +2907,9 @@ class AEAdminSession(AESessionBase):
             A list of realm groups the user is mapped to.
         """
 
-        user_realm_groups: list[str] = []
-        for group_name, group_users in group_maps.items():
-            for group_user in group_users:
-                if user["id"] == group_user["id"]:
-                    user_realm_groups.append(group_name)
+        if index is None:
+            index = _invert_memberships(group_maps)
+        user_realm_groups: list[str] = list(index.get(user.get("id"), ()))
         return user_realm_groups
 
     def _merge_users_with_realm_roles(self, users: list[dict], role_maps: dict[str, list]) -> list[dict]:
@@ -2370,8 +2929,9 @@ class AEAdminSession(AESessionBase):
             A list of user objects with realm role information included.
         """
 
+        index = _invert_memberships(role_maps)
         for user in users:
-            user["realm_roles"] = self._get_user_realm_roles(user=user, role_maps=role_maps)
+            user["realm_roles"] = self._get_user_realm_roles(user=user, role_maps=role_maps, index=index)
         return users
 
     def _merge_users_with_realm_groups(self, users: list[dict], group_maps: dict[str, list]) -> list[dict]:
@@ -2391,10 +2951,58 @@ class AEAdminSession(AESessionBase):
             A list of user objects with realm group information included.
         """
 
+        index = _invert_memberships(group_maps)
         for user in users:
-            user["realm_groups"] = self._get_user_realm_groups(user=user, group_maps=group_maps)
+            user["realm_groups"] = self._get_user_realm_groups(user=user, group_maps=group_maps, index=index)
         return users
 
+    def _ident_by_id(self, record_type, filter, **kwargs):
+        """
+        Looks up a user directly by username or id, rather than scanning the full user list.
+
+        Returns `None`, so that the caller falls back to the full scan, for other
+        record types, for filters that do not pin down a single user, and if a
+        direct query fails. As with `user_list`, the realm roles and groups are
+        skipped in fast mode.
+        """
+
+        if record_type != "user":
+            return super()._ident_by_id(record_type, filter, **kwargs)
+        username, id = _user_ident(filter)
+        if not username and not id:
+            return None
+        fast = kwargs.pop("fast", False)
+        try:
+            users = []
+            if id:
+                try:
+                    users = [self._get(f"users/{id}")]
+                except AEUnexpectedResponseError as exc:
+                    if exc.status_code != 404:
+                        raise
+            if username and not users:
+                users = self._get("users", params={"username": username, "exact": "true"})
+            if fast:
+                users = self._fix_records("user", users, filter)
+                return users or EmptyRecordList("user")
+            self._map(self._join_user_memberships, users)
+        except (AEUnexpectedResponseError, requests.exceptions.RetryError):
+            return None
+        users = self._fix_records("user", users, filter, **kwargs)
+        return users or EmptyRecordList("user")
+
+    def _join_user_memberships(self, user: dict) -> None:
+        """
+        Adds the realm roles and groups of a single user, as `user_list` does for all of them.
+
+        From https://www.keycloak.org/docs-api/22.0.4/rest-api/index.html
+        GET /admin/realms/{realm}/users/{id}/role-mappings/realm
+        GET /admin/realms/{realm}/users/{id}/groups
+        """
+
+        user["realm_roles"] = [role["name"] for role in self._get(f"users/{user['id']}/role-mappings/realm")]
+        user["realm_groups"] = [group["name"] for group in self._get_paginated(f"users/{user['id']}/groups")]
+
     def user_info(self, ident, format=None, quiet=False, include_login=True, fast=False):
         response = self._ident_record("user", ident, quiet=False, include_login=include_login, fast=fast)
         return self._format_response(response, format)
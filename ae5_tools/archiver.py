@@ -1,17 +1,101 @@
+import bz2
+import contextlib
 import fnmatch
+import gzip
+import hashlib
+import lzma
 import os
 import re
+import stat
+import struct
 import subprocess
 import tarfile
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+# Compression applied to project archives: "gz", "bz2", or "xz"
+ARCHIVE_COMPRESSION = os.environ.get("AE5_ARCHIVE_COMPRESSION", "gz")
+# Compression level; the default for each compressor is used if unset
+ARCHIVE_COMPRESSION_LEVEL = int(os.environ.get("AE5_ARCHIVE_COMPRESSION_LEVEL", "0")) or None
+# Number of threads used for gzip compression; 1 disables parallel compression
+ARCHIVE_COMPRESSION_THREADS = int(os.environ.get("AE5_ARCHIVE_COMPRESSION_THREADS", "0")) or os.cpu_count() or 1
+# Size of the blocks compressed independently by the parallel gzip writer
+GZIP_BLOCK_SIZE = 128 * 1024
 
-def _list_project(project_directory):
-    anchors, nonanchors = [".git/"], []
+# List project files with "git ls-files" rather than walking the directory tree
+ARCHIVE_GIT_LISTING = os.environ.get("AE5_ARCHIVE_GIT_LISTING", "").lower() in ("1", "true", "yes")
+
+# Filename suffix for archives created with each compression type
+ARCHIVE_SUFFIXES = {"gz": ".tar.gz", "bz2": ".tar.bz2", "xz": ".txz"}
+
+# Reuse cached archives of unchanged project directories when uploading
+ARCHIVE_CACHE = os.environ.get("AE5_ARCHIVE_CACHE", "").lower() in ("1", "true", "yes")
+# Maximum total size of the archive cache, in megabytes
+ARCHIVE_CACHE_SIZE = int(os.environ.get("AE5_ARCHIVE_CACHE_SIZE", "1024"))
+# Identify unchanged files by their content, rather than by size and modification time
+ARCHIVE_CACHE_HASH = os.environ.get("AE5_ARCHIVE_CACHE_HASH", "").lower() in ("1", "true", "yes")
+
+
+# Characters that give a git path special meaning when it is used as a regex
+_REGEX_SPECIAL = frozenset("^$*+?{}[]\\|()")
+
+
+def _git_spec(line):
+    # git output lines are used verbatim as anchored regular expressions, in
+    # which an unescaped dot matches any character; see _IgnoreMatcher.
+    if _REGEX_SPECIAL.isdisjoint(line):
+        return ("dotted", line) if "." in line else ("literal", line)
+
+
+def _glob_spec(line, pattern):
+    """Classify a .projectignore rule that can be matched without its regex.
+
+    Returns None for rules that need the regex: those with character sets or
+    "?" wildcards, more than one "*", or a "/" within a non-anchored rule. As a
+    safeguard, the regex the rule would have if it were classified correctly is
+    compared with the actual one.
+    """
+    anchored, is_dir = line.startswith("/"), line.endswith("/")
+    body = line.lstrip("/")
+    core = body[:-1] if is_dir else body
+    if any(c in core for c in "?[]") or not core.strip("*"):
+        return None
+    if anchored:
+        if "*" in core:
+            return None
+        spec, expected = ("dir", core) if is_dir else ("literal", core), re.escape(body)
+    else:
+        if "/" in core or core.count("*") > 1 or "*" in core[1:-1]:
+            return None
+        if core.startswith("*"):
+            spec, expected = ("suffix", core[1:], is_dir), "[^/]*" + re.escape(core[1:])
+        elif core.endswith("*"):
+            spec, expected = ("prefix", core[:-1], is_dir), re.escape(core[:-1]) + "[^/]*"
+        else:
+            spec, expected = ("name", core, is_dir), re.escape(core)
+        if is_dir:
+            expected += "/"
+    if is_dir:
+        expected += ".*"
+    return spec if pattern == expected else None
+
+
+def _ignore_rules(project_directory, git_ignored=True):
+    """Collect the ignore rules of a project directory.
+
+    Returns a list of (anchored, pattern, spec) tuples, where pattern is the
+    regular expression for the rule, and spec describes it in a form that
+    _IgnoreMatcher can match without regular expressions (or is None). If
+    git_ignored is True, the untracked files that git ignores are included.
+    """
+    rules = [(True, ".git/", _git_spec(".git/"))]
 
     gitdir = os.path.join(project_directory, ".git")
-    if os.path.exists(gitdir):
+    if git_ignored and os.path.exists(gitdir):
         output = subprocess.check_output(["git", "ls-files", "--others", "--ignored", "--exclude-standard", "--directory"], cwd=project_directory)
-        anchors.extend(output.decode("utf-8").splitlines())
+        rules.extend((True, line, _git_spec(line)) for line in output.decode("utf-8").splitlines())
 
     igfile = os.path.join(project_directory, ".projectignore")
     if os.path.exists(igfile):
@@ -26,11 +110,13 @@ def _list_project(project_directory):
                 pattern = re.sub(r"(?<!\\)[.]", "[^/]", pattern)
                 if line.endswith("/"):
                     pattern = pattern + r".*"
-                if line.startswith("/"):
-                    anchors.append(pattern)
-                else:
-                    nonanchors.append(pattern)
+                rules.append((line.startswith("/"), pattern, _glob_spec(line, pattern)))
+    return rules
 
+
+def _combined_regex(rules):
+    anchors = [pattern for anchored, pattern, _ in rules if anchored]
+    nonanchors = [pattern for anchored, pattern, _ in rules if not anchored]
     if anchors or nonanchors:
         if nonanchors:
             nonanchors = nonanchors[0] if len(nonanchors) == 1 else "(?:" + "|".join(nonanchors) + ")"
@@ -39,25 +125,426 @@ def _list_project(project_directory):
         pattern = r"\A" + anchors + r"(?:/.*)?\Z"
     else:
         pattern = "^$"
-    regex = re.compile(pattern)
-
-    for root, dirs, files in os.walk(project_directory):
-        filtered_dirs = []
-        filtered = False
-        for d in dirs:
-            abspath = os.path.join(root, d)
-            relpath = os.path.relpath(abspath, project_directory)
-            if not regex.match(relpath + "/"):
-                filtered_dirs.append(d)
-        dirs[:] = filtered_dirs
-        for f in files:
-            abspath = os.path.join(root, f)
-            relpath = os.path.relpath(abspath, project_directory)
-            if not regex.match(relpath):
-                yield (abspath, relpath)
-
-
-def create_tar_archive(project_directory, arcname, fp):
-    with tarfile.open(fileobj=fp, mode="w|gz") as tf:
-        for abspath, relpath in _list_project(project_directory):
-            tf.add(abspath, os.path.join(arcname, relpath))
+    return re.compile(pattern)
+
+
+def _self_contained(pattern):
+    # Parentheses in a verbatim git path could change the structure of the
+    # combined regex, in which case the rules cannot be matched separately.
+    depth, escaped = 0, False
+    for c in pattern:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        else:
+            depth += (c == "(") - (c == ")")
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+class _IgnoreMatcher(object):
+    """Match project paths against ignore rules, avoiding regexes where possible.
+
+    A path is ignored if it matches the combined regex of all of the rules;
+    directory paths are matched with a trailing slash. Most rules are literal
+    paths, names, or name prefixes or suffixes, and these are indexed so that
+    they can be checked with set lookups. The remaining rules are combined
+    into a smaller regex.
+
+    The checks are incremental: they assume that paths are visited top-down,
+    and that no ancestor directory of the path was itself ignored. Under that
+    assumption, the results are identical to matching the combined regex.
+    """
+
+    def __init__(self, rules):
+        self.regex = _combined_regex(rules)
+        self.fast = os.sep == "/" and all(_self_contained(pattern) for _, pattern, spec in rules if spec is None)
+        complex_rules = [rule for rule in rules if rule[2] is None]
+        self.complex = _combined_regex(complex_rules) if complex_rules else None
+        # Anchored paths, which must be followed by a slash or the end of the path
+        self.paths = set()
+        # Anchored directories, which must be followed by a slash
+        self.dirs = set()
+        # Anchored paths whose dots match any character, by length
+        self.dotted = {}
+        # Name, prefix, and suffix indexes for components anywhere in the path,
+        # and for components that must be followed by a slash
+        self.anywhere = (set(), {}, {})
+        self.inner = (set(), {}, {})
+        for _, _, spec in rules:
+            if spec is None:
+                continue
+            kind, value = spec[:2]
+            if kind == "literal":
+                self.paths.add(value)
+            elif kind == "dir":
+                self.dirs.add(value)
+            elif kind == "dotted":
+                spans, start = [], 0
+                for k, c in enumerate(value + "."):
+                    if c == ".":
+                        if k > start:
+                            spans.append((start, k))
+                        start = k + 1
+                spans = tuple(spans)
+                key = "".join(value[a:b] for a, b in spans)
+                groups = self.dotted.setdefault(len(value), {})
+                groups.setdefault(spans, set()).add(key)
+            else:
+                names, prefixes, suffixes = self.inner if spec[2] else self.anywhere
+                if kind == "name":
+                    names.add(value)
+                else:
+                    index = prefixes if kind == "prefix" else suffixes
+                    index.setdefault(len(value), set()).add(value)
+
+    @staticmethod
+    def _component(name, index):
+        names, prefixes, suffixes = index
+        if name in names:
+            return True
+        for n, values in prefixes.items():
+            if name[:n] in values:
+                return True
+        for n, values in suffixes.items():
+            if name[-n:] in values:
+                return True
+        return False
+
+    def _path(self, path):
+        if path in self.paths:
+            return True
+        groups = self.dotted.get(len(path))
+        if groups:
+            for spans, keys in groups.items():
+                if "".join(path[a:b] for a, b in spans) in keys:
+                    return True
+        return False
+
+    def match_dir(self, relpath, name):
+        """Return True if the directory relpath, whose last component is name, is ignored."""
+        path = relpath + "/"
+        if not self.fast or "\n" in path:
+            return self.regex.match(path) is not None
+        if self._component(name, self.anywhere) or self._component(name, self.inner):
+            return True
+        if relpath in self.dirs or self._path(relpath) or self._path(path):
+            return True
+        return self.complex is not None and self.complex.match(path) is not None
+
+    def match_file(self, relpath, name):
+        """Return True if the file relpath, whose last component is name, is ignored."""
+        if not self.fast or "\n" in relpath:
+            return self.regex.match(relpath) is not None
+        if self._component(name, self.anywhere) or self._path(relpath):
+            return True
+        return self.complex is not None and self.complex.match(relpath) is not None
+
+
+def _walk_project(project_directory, matcher):
+    # Equivalent to os.walk (top-down, not following symbolic links, skipping
+    # unreadable directories), pruning ignored directories as it goes.
+    stack = [(project_directory, "")]
+    while stack:
+        root, relroot = stack.pop()
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            relpath = relroot + name if relroot else name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not matcher.match_dir(relpath, name) and not entry.is_symlink():
+                    subdirs.append((os.path.join(root, name), relpath + os.sep))
+            elif not matcher.match_file(relpath, name):
+                yield (os.path.join(root, name), relpath)
+        stack.extend(reversed(subdirs))
+
+
+def _git_project_files(project_directory, matcher):
+    # The files that git tracks, plus the untracked files it does not ignore.
+    output = subprocess.check_output(["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"], cwd=project_directory)
+    ignored_dirs = {}
+    for relpath in output.decode("utf-8").split("\0"):
+        abspath = os.path.join(project_directory, relpath)
+        # Skip deleted files, submodules, and links to directories, as os.walk would
+        if not relpath or not os.path.lexists(abspath) or os.path.isdir(abspath):
+            continue
+        parts = relpath.split("/")
+        ignored = False
+        for k in range(1, len(parts)):
+            dirpath = "/".join(parts[:k])
+            ignored = ignored_dirs.get(dirpath)
+            if ignored is None:
+                ignored = ignored_dirs[dirpath] = matcher.match_dir(dirpath, parts[k - 1])
+            if ignored:
+                break
+        if not ignored and not matcher.match_file(relpath, parts[-1]):
+            yield (abspath, relpath)
+
+
+def _list_project(project_directory, use_git=None):
+    """Enumerate the files of a project, honoring its .projectignore and git ignore rules.
+
+    Yields (abspath, relpath) tuples in os.walk order. If use_git is True
+    (default: ARCHIVE_GIT_LISTING) and the project is the root of a git
+    repository, the file list is instead read from "git ls-files", in git's
+    order; it includes the same files, as long as git's own ignore rules are
+    the only ones that apply to untracked files.
+    """
+    if use_git is None:
+        use_git = ARCHIVE_GIT_LISTING
+    use_git = use_git and os.path.exists(os.path.join(project_directory, ".git"))
+    matcher = _IgnoreMatcher(_ignore_rules(project_directory, git_ignored=not use_git))
+    if use_git:
+        yield from _git_project_files(project_directory, matcher)
+    else:
+        yield from _walk_project(project_directory, matcher)
+
+
+class ParallelGzipWriter(object):
+    """A write-only file object that gzip-compresses its content using a thread pool.
+
+    The input is split into blocks that are compressed concurrently, as pigz
+    does: each block is a raw deflate stream, primed with the preceding 32 KiB
+    of input as a dictionary and ended with a sync flush, so the concatenated
+    blocks form a single deflate stream. The output is a standard, single-member
+    gzip file. The underlying file object is not closed.
+    """
+
+    def __init__(self, fileobj, level=6, threads=None, block_size=GZIP_BLOCK_SIZE):
+        self._fileobj = fileobj
+        self._level = level
+        self._block_size = block_size
+        threads = threads or ARCHIVE_COMPRESSION_THREADS
+        self._executor = ThreadPoolExecutor(threads)
+        # Bounds the number of blocks held in memory at once
+        self._max_pending = 2 * threads
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._dict = b""
+        self._crc = 0
+        self._size = 0
+        xfl = 2 if level == 9 else 4 if level == 1 else 0
+        # Magic, deflate, no flags, zero mtime (for reproducible output), unknown OS
+        self._fileobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<I", 0) + bytes((xfl, 255)))
+
+    def _compress(self, data, zdict, final):
+        if zdict:
+            cobj = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+        else:
+            cobj = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return cobj.compress(data) + cobj.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, data, final=False):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._pending.append(self._executor.submit(self._compress, data, self._dict, final))
+        self._dict = data[-32768:] if len(data) >= 32768 else (self._dict + data)[-32768:]
+        while len(self._pending) > (0 if final else self._max_pending):
+            self._fileobj.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[: self._block_size])
+            del self._buffer[: self._block_size]
+            self._submit(block)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._executor is None:
+            return
+        try:
+            # The final block, even if empty, terminates the deflate stream
+            self._submit(bytes(self._buffer), final=True)
+            self._fileobj.write(struct.pack("<II", self._crc & 0xFFFFFFFF, self._size & 0xFFFFFFFF))
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def abort(self):
+        """Release the thread pool without completing the output."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._pending.clear()
+
+
+def _compressor(fileobj, compression, level, threads):
+    """Return a file object that compresses its content into fileobj."""
+    if compression == "gz":
+        level = level or 6
+        if (threads or ARCHIVE_COMPRESSION_THREADS) > 1:
+            return ParallelGzipWriter(fileobj, level, threads)
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=level, mtime=0)
+    elif compression == "bz2":
+        return bz2.BZ2File(fileobj, "wb", compresslevel=level or 9)
+    elif compression == "xz":
+        return lzma.LZMAFile(fileobj, "wb", preset=level)
+    raise ValueError(f"Unsupported archive compression: {compression}")
+
+
+def _normalize_tarinfo(tarinfo):
+    # Drop the metadata that varies between otherwise identical checkouts
+    tarinfo.mtime = 0
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    return tarinfo
+
+
+def create_tar_archive(project_directory, arcname, fp, compression=None, level=None, threads=None, files=None, deterministic=False):
+    """Write a compressed tar archive of a project directory to a file object.
+
+    Parameters
+    ----------
+    project_directory: str
+        The directory to archive, subject to its .projectignore and git ignore rules.
+    arcname: str
+        The name of the top-level directory within the archive.
+    fp: file object
+        The destination, which is not closed.
+    compression: str, optional
+        "gz", "bz2", or "xz". Defaults to ARCHIVE_COMPRESSION.
+    level: int, optional
+        The compression level. Defaults to ARCHIVE_COMPRESSION_LEVEL, if set,
+        or else the compressor's own default.
+    threads: int, optional
+        The number of gzip compression threads. Defaults to ARCHIVE_COMPRESSION_THREADS.
+    files: list of (abspath, relpath) tuples, optional
+        The files to include. Defaults to the output of _list_project.
+    deterministic: bool, optional
+        If True, modification times and file ownership are omitted, so that
+        the archive depends only on the names, modes, and content of the files.
+    """
+    cfp = _compressor(fp, compression or ARCHIVE_COMPRESSION, level or ARCHIVE_COMPRESSION_LEVEL, threads)
+    try:
+        with tarfile.open(fileobj=cfp, mode="w|") as tf:
+            for abspath, relpath in _list_project(project_directory) if files is None else files:
+                tf.add(abspath, os.path.join(arcname, relpath), filter=_normalize_tarinfo if deterministic else None)
+    except BaseException:
+        # The output is incomplete in any case, so just release the compressor
+        with contextlib.suppress(Exception):
+            getattr(cfp, "abort", cfp.close)()
+        raise
+    cfp.close()
+
+
+class _Tee(object):
+    """A write-only file object that copies its content to two others."""
+
+    def __init__(self, fp1, fp2):
+        self._fp1 = fp1
+        self._fp2 = fp2
+
+    def write(self, data):
+        self._fp1.write(data)
+        self._fp2.write(data)
+        return len(data)
+
+    def flush(self):
+        self._fp1.flush()
+        self._fp2.flush()
+
+
+class ArchiveCache(object):
+    """A local cache of project archives, keyed by the project's file manifest.
+
+    The manifest lists the name, mode, and size of every file that would be
+    archived, along with its modification time or, if content_hash is True,
+    a hash of its content. An archive is reused as long as the manifest, the
+    top-level directory name, and the compression settings are unchanged.
+
+    Cached archives are deterministic: modification times and ownership are
+    omitted, so identical content always produces the same archive. When the
+    total size of the cache exceeds max_size bytes, the least recently used
+    archives are removed.
+    """
+
+    def __init__(self, path, max_size=None, content_hash=None):
+        self.path = path
+        self.max_size = ARCHIVE_CACHE_SIZE * 1024 * 1024 if max_size is None else max_size
+        self.content_hash = ARCHIVE_CACHE_HASH if content_hash is None else content_hash
+
+    def _file_digest(self, abspath, st):
+        if stat.S_ISLNK(st.st_mode):
+            return os.readlink(abspath)
+        digest = hashlib.sha256()
+        with open(abspath, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def key(self, files, arcname, compression, level):
+        """Return the cache key for an archive of the given (abspath, relpath) files."""
+        digest = hashlib.sha256(f"{arcname}\0{compression}\0{level}\0{self.content_hash}\n".encode("utf-8"))
+        for abspath, relpath in files:
+            st = os.lstat(abspath)
+            version = self._file_digest(abspath, st) if self.content_hash else st.st_mtime_ns
+            digest.update(f"{relpath}\0{st.st_mode}\0{st.st_size}\0{version}\n".encode("utf-8", "surrogateescape"))
+        return digest.hexdigest()
+
+    def _entries(self):
+        # Temporary files start with a dot, and are not part of the cache
+        with os.scandir(self.path) as it:
+            return [entry for entry in it if not entry.name.startswith(".") and entry.is_file()]
+
+    def evict(self, keep=None):
+        """Remove the least recently used archives until the cache fits within max_size."""
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            if entry.path != keep:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(entry.path)
+                total -= entry.stat().st_size
+
+    def clear(self):
+        """Remove all cached archives."""
+        for entry in self._entries():
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(entry.path)
+
+    def source(self, project_directory, arcname, compression=None, level=None):
+        """Return the archive of a project directory, as a MultipartBody source.
+
+        If an archive of the unchanged project is in the cache, its path is
+        returned. Otherwise, the return value is a callable that writes a new
+        archive to a file object, adding a copy of it to the cache as it does.
+        """
+        compression = compression or ARCHIVE_COMPRESSION
+        level = level or ARCHIVE_COMPRESSION_LEVEL
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        files = list(_list_project(project_directory))
+        target = os.path.join(self.path, self.key(files, arcname, compression, level) + ARCHIVE_SUFFIXES[compression])
+        if os.path.isfile(target):
+            # Mark the archive as recently used
+            os.utime(target)
+            return target
+
+        def produce(fp):
+            fd, tmpname = tempfile.mkstemp(prefix=".", suffix=ARCHIVE_SUFFIXES[compression], dir=self.path)
+            try:
+                with os.fdopen(fd, "wb") as cfp:
+                    create_tar_archive(project_directory, arcname, _Tee(fp, cfp), compression, level, files=files, deterministic=True)
+                os.replace(tmpname, target)
+            except BaseException:
+                os.unlink(tmpname)
+                raise
+            self.evict(keep=target)
+
+        return produce
@@ -0,0 +1,1029 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import inspect
+import json
+import os
+import re
+import ssl
+import sys
+from http.cookiejar import LWPCookieJar
+from urllib.parse import urljoin
+from urllib.request import Request
+
+import aiohttp
+from multidict import CIMultiDict
+from requests.packages import urllib3
+
+from .api import (
+    IDENT_FILTERS,
+    KEYCLOAK_COUNT_ENDPOINTS,
+    KEYCLOAK_PAGE_MAX,
+    KEYCLOAK_PREFETCH,
+    MEMBERSHIP_SNAPSHOT_TTL,
+    AEAdminSession,
+    AEException,
+    AESessionBase,
+    AEUnexpectedResponseError,
+    AEUserSession,
+    EmptyRecordList,
+    _cf_headers,
+    _extend_pages,
+    _login_params,
+    _merge_logins,
+    _page_params,
+    _tls_settings,
+    _token_issued,
+    _token_valid,
+    _user_ident,
+)
+from .config import config
+from .filter import exact_value, split_filter
+from .identifier import RE_ID, Identifier
+from .localstate import atomic_save, file_lock, load_snapshot, save_snapshot
+from .waiter import async_wait_for
+
+# Maximum number of simultaneous requests issued by a single async session
+ASYNC_CONCURRENCY = int(os.environ.get("AE5_ASYNC_CONCURRENCY", "16"))
+
+# How deeply the running task is nested within _gather calls
+_gather_depth = contextvars.ContextVar("_gather_depth", default=0)
+
+# These mirror the urllib3 Retry settings of AESessionBase._build_requests_session
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.1
+RETRY_STATUSES = (403, 502, 503, 504)
+MAX_REDIRECTS = 30
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class _CookieResponse(object):
+    """Presents aiohttp response headers in the form http.cookiejar expects."""
+
+    def __init__(self, headers):
+        self._headers = headers
+
+    def info(self):
+        return self
+
+    def get_all(self, name, default=None):
+        return self._headers.getall(name, default)
+
+
+class AEAsyncResponse(object):
+    """A fully read response, with the attributes of requests.Response that the
+    session logic and AEUnexpectedResponseError rely upon."""
+
+    def __init__(self, method, url, status_code, reason, headers, content):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        match = re.search(r"charset=([^\s;]+)", self.headers.get("content-type", ""))
+        encoding = match.group(1) if match else "utf-8"
+        return self.content.decode(encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AEAsyncSessionBase(object):
+    """Base class for asyncio-native AE5 API interactions.
+
+    The public interface mirrors AESessionBase, except that all methods that
+    touch the network are coroutines. Cookies are held in an LWPCookieJar,
+    so the files saved in ~/.ae5 are shared with the synchronous sessions.
+    Sessions should be closed with ``await session.close()``, or used as an
+    async context manager.
+    """
+
+    _direct_endpoints = {}
+
+    def __init__(self, hostname, username, password, prefix, persist):
+        if not hostname or not username:
+            raise ValueError("Must supply hostname and username")
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.persist = persist
+        self.prefix = prefix.lstrip("/")
+        self.base = f"https://{self.hostname}/{self.prefix}/"
+        self.cookies = LWPCookieJar()
+        self.headers = {}
+        self._client = None
+        self._semaphores = {}
+
+        # Cloudflare headers need to be present on all requests (even before auth can be start).
+        self._set_cf_headers()
+
+        # Set TLS verification settings
+        self._set_tls_verify()
+
+        # Proceed with auth flow
+        if self.persist:
+            self._load()
+        self.connected = self._connected()
+        if self.connected:
+            self._set_header()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _set_cf_headers(self):
+        self.headers.update(_cf_headers())
+
+    def _set_tls_verify(self):
+        verify, cert = _tls_settings()
+        if verify:
+            self._ssl = ssl.create_default_context(cafile=os.environ.get("REQUESTS_CA_BUNDLE") or None)
+            if cert:
+                self._ssl.load_cert_chain(cert)
+        else:
+            self._ssl = False
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    _auth_message = staticmethod(AESessionBase._auth_message)
+    _password_prompt = staticmethod(AESessionBase._password_prompt)
+    _filter_records = AESessionBase._filter_records
+    _should_be_one = AESessionBase._should_be_one
+    _format_table = AESessionBase._format_table
+    _format_response = AESessionBase._format_response
+
+    def _is_login(self, response):
+        pass
+
+    async def close(self):
+        if not self.persist and self.connected:
+            try:
+                await self.disconnect()
+            except Exception:
+                pass
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def authorize(self):
+        # Cloudflare headers need to be present on all requests (even before auth can be start).
+        self._set_cf_headers()
+
+        key = f"{self.username}@{self.hostname}"
+        need_password = self.password is None
+        last_valid = True
+        while True:
+            if need_password:
+                loop = asyncio.get_running_loop()
+                password = await loop.run_in_executor(None, self._password_prompt, key, last_valid)
+            else:
+                password = self.password
+            await self._connect(password)
+            if self._connected():
+                break
+            if not need_password:
+                raise AEException("Invalid username or password.")
+            last_valid = False
+        if self._connected():
+            self.connected = True
+            self._set_header()
+            if self.persist:
+                self._save()
+
+    async def disconnect(self):
+        await self._disconnect()
+        self.headers.clear()
+        self.cookies.clear()
+        if self.persist:
+            self._save()
+        self.connected = False
+
+    async def _fix_records(self, record_type, records, filter=None, **kwargs):
+        pre = f"_pre_{record_type}"
+        if isinstance(records, dict) and "data" in records:
+            records = records["data"]
+        is_single = isinstance(records, dict)
+        if is_single:
+            records = [records]
+        if hasattr(self, pre):
+            records = await _maybe_await(getattr(self, pre)(records))
+        for rec in records:
+            rec["_record_type"] = record_type
+        if not records:
+            records = EmptyRecordList(record_type)
+        if records and filter:
+            prefilt, postfilt = split_filter(filter, records[0])
+            records = self._filter_records(prefilt, records)
+        post = f"_post_{record_type}"
+        if hasattr(self, post):
+            records = await _maybe_await(getattr(self, post)(records, **kwargs))
+        if records and filter:
+            records = self._filter_records(postfilt, records)
+        if is_single:
+            return records[0] if records else None
+        return records
+
+    async def _ident_record(self, record_type, ident, quiet=False, **kwargs):
+        if isinstance(ident, dict) and ident.get("_record_type", "") == record_type:
+            return ident
+        itype = record_type + "s"
+        if isinstance(ident, Identifier):
+            filter = ident.project_filter(itype=itype, ignore_revision=True)
+        elif isinstance(ident, tuple):
+            ident, filter = ",".join(ident), ident
+        elif record_type in IDENT_FILTERS:
+            ident = filter = IDENT_FILTERS[record_type].format(value=ident)
+        else:
+            ident = Identifier.from_string(ident, itype)
+            filter = ident.project_filter(itype=itype, ignore_revision=True)
+        matches = await self._ident_by_id(record_type, filter, **kwargs)
+        if matches is None:
+            matches = await getattr(self, f"{record_type}_list")(filter=filter, **kwargs)
+        return self._should_be_one(matches, filter, quiet)
+
+    async def _ident_by_id(self, record_type, filter, **kwargs):
+        # See AESessionBase._ident_by_id
+        endpoint = self._direct_endpoints.get(record_type)
+        id = exact_value(filter, "id") if endpoint else None
+        if not id or not re.fullmatch(RE_ID, id):
+            return None
+        try:
+            record = await self._get(f"{endpoint}/{id}")
+        except AEUnexpectedResponseError as exc:
+            if exc.status_code != 404:
+                return None
+            record = None
+        if record:
+            record = await self._fix_records(record_type, record, filter=filter, **kwargs)
+        return [record] if record else EmptyRecordList(record_type)
+
+    async def _gather(self, *coros):
+        """Run coroutines concurrently, bounded by ASYNC_CONCURRENCY, preserving order.
+
+        Each level of nesting has its own semaphore, so that a coroutine may
+        itself call _gather without waiting on the slot it holds.
+        """
+        depth = _gather_depth.get()
+        semaphore = self._semaphores.get(depth)
+        if semaphore is None:
+            semaphore = self._semaphores[depth] = asyncio.Semaphore(ASYNC_CONCURRENCY)
+
+        async def _bounded(coro):
+            async with semaphore:
+                _gather_depth.set(depth + 1)
+                return await coro
+
+        return await asyncio.gather(*(_bounded(c) for c in coros))
+
+    async def _client_session(self):
+        if self._client is None:
+            # Cookies are managed by our own LWPCookieJar, so disable aiohttp's jar.
+            self._client = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar(), connector=aiohttp.TCPConnector(ssl=self._ssl))
+        return self._client
+
+    async def _send(self, method, url, allow_redirects=False, **kwargs):
+        """Issue a single HTTP request, applying our headers and cookies.
+
+        Redirects are followed only if allow_redirects is True, in which case
+        cookies are extracted from every hop. Retry behavior mirrors the
+        urllib3 Retry configuration used by the synchronous sessions.
+        """
+        client = await self._client_session()
+        timeout = kwargs.pop("timeout", None)
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        extra_headers = kwargs.pop("headers", None) or {}
+        for hop in range(MAX_REDIRECTS + 1):
+            for attempt in range(RETRY_TOTAL + 1):
+                request = Request(url, method=method.upper())
+                self.cookies.add_cookie_header(request)
+                headers = dict(self.headers)
+                headers.update(extra_headers)
+                if request.get_header("Cookie"):
+                    headers["Cookie"] = request.get_header("Cookie")
+                try:
+                    async with client.request(method, url, headers=headers, allow_redirects=False, **kwargs) as resp:
+                        content = await resp.read()
+                        rheaders = CIMultiDict(resp.headers)
+                        response = AEAsyncResponse(method, url, resp.status, resp.reason, rheaders, content)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt == RETRY_TOTAL:
+                        raise
+                    await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+                    continue
+                self.cookies.extract_cookies(_CookieResponse(rheaders), request)
+                if response.status_code in RETRY_STATUSES and attempt < RETRY_TOTAL:
+                    await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+                    continue
+                break
+            if not allow_redirects or not (300 <= response.status_code < 400) or "location" not in response.headers:
+                return response
+            url = urljoin(url, response.headers["location"].rstrip())
+            method = "get"
+            for key in ("params", "data", "json"):
+                kwargs.pop(key, None)
+        raise AEUnexpectedResponseError("Too many redirects", method, url)
+
+    async def _api(self, method, endpoint, **kwargs):
+        format = kwargs.pop("format", None)
+        subdomain = kwargs.pop("subdomain", None)
+        base = self.base.replace("//", f"//{subdomain}.") if subdomain else self.base
+        url = urljoin(base, endpoint)
+        do_save = False
+        allow_retry = True
+        if not self.connected:
+            await self.authorize()
+            if self.password is not None:
+                allow_retry = False
+        while True:
+            try:
+                response = await self._send(method, url, **kwargs)
+            except aiohttp.ClientConnectionError:
+                raise AEUnexpectedResponseError("Unable to connect", method, url, **kwargs)
+            except asyncio.TimeoutError:
+                raise AEUnexpectedResponseError("Connection timeout", method, url, **kwargs)
+
+            if 300 <= response.status_code < 400:
+                # See AESessionBase._api for a description of the redirection cases.
+                url2 = urljoin(url, response.headers["location"].rstrip())
+                if url2 != url:
+                    do_save = True
+                url = url2
+                method = "get"
+            elif allow_retry and (response.status_code == 401 or self._is_login(response)):
+                await self.authorize()
+                if self.password is not None:
+                    allow_retry = False
+            elif response.status_code >= 400:
+                raise AEUnexpectedResponseError(response, method, url, **kwargs)
+            else:
+                if do_save and self.persist:
+                    self._save()
+                break
+        if format == "response":
+            return response
+        if len(response.content) == 0:
+            return None
+        if format == "blob":
+            return response.content
+        if format == "text":
+            return response.text
+        if "json" in response.headers.get("content-type", ""):
+            return response.json()
+        return response.text
+
+    async def api(self, method, endpoint, **kwargs):
+        format = kwargs.pop("format", None)
+        response = await self._api(method, endpoint, **kwargs)
+        return self._format_response(response, format=format)
+
+    async def _get(self, endpoint, **kwargs):
+        return await self._api("get", endpoint, **kwargs)
+
+    async def _delete(self, endpoint, **kwargs):
+        return await self._api("delete", endpoint, **kwargs)
+
+    async def _post(self, endpoint, **kwargs):
+        return await self._api("post", endpoint, **kwargs)
+
+    async def _head(self, endpoint, **kwargs):
+        return await self._api("head", endpoint, **kwargs)
+
+    async def _put(self, endpoint, **kwargs):
+        return await self._api("put", endpoint, **kwargs)
+
+    async def _patch(self, endpoint, **kwargs):
+        return await self._api("patch", endpoint, **kwargs)
+
+
+class AEAsyncUserSession(AEAsyncSessionBase):
+    """Asyncio-native counterpart of AEUserSession.
+
+    The k8s-backed features (pods, nodes, and the k8s=True options) are
+    not available in this session; use AEUserSession for those.
+    """
+
+    _direct_endpoints = AEUserSession._direct_endpoints
+
+    def __init__(self, hostname, username, password=None, persist=True):
+        self._filename = os.path.join(config._path, "cookies", f"{username}@{hostname}")
+        super(AEAsyncUserSession, self).__init__(hostname, username, password=password, prefix="api/v2", persist=persist)
+
+    def _set_header(self):
+        for cookie in self.cookies:
+            if cookie.name == "_xsrf":
+                self.headers["x-xsrftoken"] = cookie.value
+                break
+
+        # Ensure that Cloudflare headers get added [back] to session when setting the other auth headers.
+        self._set_cf_headers()
+
+    def _load(self):
+        if os.path.exists(self._filename):
+            self.cookies.load(self._filename, ignore_discard=True)
+            os.utime(self._filename)
+
+    def _save(self):
+        atomic_save(self._filename, lambda fname: self.cookies.save(fname, ignore_discard=True))
+
+    def _connected(self):
+        return any(c.name == "_xsrf" for c in self.cookies)
+
+    _is_login = AEUserSession._is_login
+
+    async def _connect(self, password):
+        if isinstance(password, AEAsyncAdminSession):
+            self.cookies = await password.impersonate(self.username)
+        elif isinstance(password, AEAdminSession):
+            self.cookies = password.impersonate(self.username)
+        params = {
+            "client_id": "anaconda-platform",
+            "scope": "openid",
+            "response_type": "code",
+            "redirect_uri": f"https://{self.hostname}/login",
+        }
+        url = f"https://{self.hostname}/auth/realms/AnacondaPlatform/protocol/openid-connect/auth"
+        resp = await self._send("get", url, params=params, allow_redirects=True)
+        match = re.search(r'<form id="kc-form-login".*?action="([^"]*)"', resp.text, re.M)
+        if not match:
+            # This means we are already logged in.
+            # This will reliably happen in impersonation mode
+            return
+        data = {"username": self.username, "password": password}
+        resp = await self._send("post", match.groups()[0].replace("&amp;", "&"), data=data, allow_redirects=True)
+        if "Invalid username or password." in resp.text:
+            self.cookies.clear()
+
+    async def _disconnect(self):
+        await self._get("/logout")
+
+    async def _api_records(self, method, endpoint, filter=None, **kwargs):
+        record_type = kwargs.pop("record_type", None)
+        api_kwargs = kwargs.pop("api_kwargs", None) or {}
+        retry_if_empty = kwargs.pop("retry_if_empty", False)
+        if not record_type:
+            record_type = endpoint.rsplit("/", 1)[-1].rstrip("s")
+        for attempt in range(20):
+            records = await self._api(method, endpoint, **api_kwargs)
+            if records or not retry_if_empty:
+                break
+            await asyncio.sleep(0.25)
+        else:
+            raise AEException(f"Unexpected empty {record_type} recordset")
+        return await self._fix_records(record_type, records, filter, **kwargs)
+
+    async def _get_records(self, endpoint, filter=None, **kwargs):
+        return await self._api_records("get", endpoint, filter=filter, **kwargs)
+
+    async def _post_record(self, endpoint, filter=None, **kwargs):
+        return await self._api_records("post", endpoint, filter=filter, **kwargs)
+
+    async def _join_collaborators(self, what, response):
+        if isinstance(response, dict):
+            what, id = response["_record_type"], response["id"]
+            collabs = await self._get_records(f"{what}s/{id}/collaborators")
+            response["collaborators"] = ", ".join(c["id"] for c in collabs)
+            response["_collaborators"] = collabs
+        elif response:
+            await self._gather(*(self._join_collaborators(what, rec) for rec in response))
+        elif hasattr(response, "_columns"):
+            response._columns.extend(("collaborators", "_collaborators"))
+
+    # These stages involve no API calls, so they are shared with AEUserSession.
+    _pre_resource_profile = AEUserSession._pre_resource_profile
+    _pre_editor = AEUserSession._pre_editor
+    _pre_sample = AEUserSession._pre_sample
+    _pre_revision = AEUserSession._pre_revision
+    _post_revision = AEUserSession._post_revision
+    _pre_deployment = AEUserSession._pre_deployment
+
+    async def _post_project(self, records, collaborators=False):
+        if collaborators:
+            await self._join_collaborators("projects", records)
+        return records
+
+    async def _pre_session(self, records):
+        precs = {x["id"]: x for x in await self._get_records("projects")}
+        for rec in records:
+            pid = "a0-" + rec["project_url"].rsplit("/", 1)[-1]
+            prec = precs.get(pid, {})
+            rec["session_name"] = rec["name"]
+            rec["name"] = prec["name"]
+            rec["project_id"] = pid
+            rec["_project"] = prec
+        return records
+
+    async def _pre_job(self, records):
+        precs = {x["id"]: x for x in await self._get_records("projects")}
+        for rec in records:
+            if rec.get("project_url"):
+                pid = "a0-" + (rec.get("project_url") or "").rsplit("/", 1)[-1]
+                rec["project_id"] = pid
+                rec["_project"] = precs.get(pid, {})
+        return records
+
+    _pre_run = _pre_job
+
+    async def _post_deployment(self, records, collaborators=False):
+        if collaborators:
+            await self._join_collaborators("deployments", records)
+        return records
+
+    async def _wait_for(self, states, fetch, done):
+        try:
+            return await async_wait_for(states, fetch, done)
+        except TimeoutError as exc:
+            raise AEException(str(exc)) from None
+
+    async def _wait(self, response):
+        pid = response.get("project_id", response["id"])
+        page = {"size": 1}
+
+        async def fetch(aids):
+            activity = await self._get(f"projects/{pid}/activity", params={"sort": "-updated", "page[size]": page["size"]})
+            statuses = {s["id"]: s for s in activity["data"] if s["id"] in aids}
+            if not statuses:
+                page["size"] += 1
+            return statuses
+
+        action = response["action"]
+        response["action"] = (await self._wait_for({action["id"]: action}, fetch, lambda s: s["done"] or s["error"]))[action["id"]]
+
+    async def _wait_record(self, record_type, record, done):
+        rid = record["id"]
+
+        async def fetch(ids):
+            return {rid: await self._get_records(f"{record_type}s/{rid}", record_type=record_type)}
+
+        return (await self._wait_for({rid: record}, fetch, done))[rid]
+
+    async def project_list(self, filter=None, collaborators=False, format=None):
+        records = await self._get_records("projects", filter, collaborators=collaborators)
+        return self._format_response(records, format=format)
+
+    async def project_info(self, ident, collaborators=False, format=None, quiet=False):
+        record = await self._ident_record("project", ident, collaborators=collaborators, quiet=quiet)
+        return self._format_response(record, format=format)
+
+    async def project_patch(self, ident, format=None, **kwargs):
+        prec = await self._ident_record("project", ident)
+        data = {k: v for k, v in kwargs.items() if v is not None}
+        if data:
+            id = prec["id"]
+            await self._patch(f"projects/{id}", json=data)
+            prec = await self._ident_record("project", id)
+        return self._format_response(prec, format=format)
+
+    async def project_delete(self, ident, format=None):
+        id = (await self._ident_record("project", ident))["id"]
+        await self._delete(f"projects/{id}")
+
+    async def project_collaborator_list(self, ident, filter=None, format=None):
+        id = (await self._ident_record("project", ident))["id"]
+        response = await self._get_records(f"projects/{id}/collaborators", filter)
+        return self._format_response(response, format=format)
+
+    async def project_activity(self, ident, limit=None, all=False, latest=False, format=None):
+        id = (await self._ident_record("project", ident))["id"]
+        if all and latest:
+            raise AEException("Cannot specify both all=True and latest=True")
+        elif limit is None:
+            limit = 1 if latest else (0 if all else 10)
+        elif all and limit > 0:
+            raise AEException(f"Cannot specify both all=True and limit={limit}")
+        elif latest and limit > 1:
+            raise AEException(f"Cannot specify both latest=True and limit={limit}")
+        elif limit <= 0:
+            limit = 999999
+        api_kwargs = {"params": {"sort": "-updated", "page[size]": limit}}
+        response = await self._get_records(f"projects/{id}/activity", api_kwargs=api_kwargs)
+        if latest:
+            response = response[0]
+        return self._format_response(response, format=format)
+
+    async def resource_profile_list(self, filter=None, format=None):
+        response = await self._get("projects/actions", params={"q": "create_action"})
+        response = await self._fix_records("resource_profile", response[0]["resource_profiles"], filter=filter)
+        return self._format_response(response, format=format)
+
+    async def resource_profile_info(self, name, format=None, quiet=False):
+        response = await self._ident_record("resource_profile", name, quiet)
+        return self._format_response(response, format=format)
+
+    async def editor_list(self, filter=None, format=None):
+        response = await self._get("projects/actions", params={"q": "create_action"})
+        response = await self._fix_records("editor", response[0]["editors"], filter=filter)
+        return self._format_response(response, format=format)
+
+    async def editor_info(self, name, format=None, quiet=False):
+        response = await self._ident_record("editor", name, quiet)
+        return self._format_response(response, format=format)
+
+    async def sample_list(self, filter=None, format=None):
+        templates, samples = await asyncio.gather(self._get("template_projects"), self._get("sample_projects"))
+        response = await self._fix_records("sample", templates + samples, filter)
+        return self._format_response(response, format=format)
+
+    async def sample_info(self, ident, format=None, quiet=False):
+        response = await self._ident_record("sample", ident, quiet)
+        return self._format_response(response, format=format)
+
+    async def _revisions(self, ident, filter=None, latest=False, single=False, quiet=False):
+        if isinstance(ident, dict):
+            revision = ident.get("_revision")
+        elif isinstance(ident, tuple):
+            revision = "".join(r[9:] for r in ident if r.startswith("revision="))
+            ident = tuple(r for r in ident if not r.startswith("revision="))
+        else:
+            if isinstance(ident, str):
+                ident = Identifier.from_string(ident)
+            revision = ident.revision
+        if revision == "latest":
+            latest = latest or True
+            revision = None
+        elif revision:
+            latest = False
+        prec = await self._ident_record("project", ident, quiet=quiet)
+        if prec is None:
+            return None
+        id = prec["id"]
+        if not filter:
+            filter = ()
+        if latest:
+            filter = (f"latest=True",) + filter
+        elif revision and revision != "*":
+            filter = (f"name={revision}",) + filter
+        response = await self._get_records(f"projects/{id}/revisions", filter=filter, project=prec, retry_if_empty=True)
+        if latest == "keep" and response:
+            response[0]["name"] = "latest"
+        if single:
+            response = self._should_be_one(response, filter, quiet)
+        return response
+
+    async def _revision(self, ident, keep_latest=False, quiet=False):
+        latest = "keep" if keep_latest else True
+        return await self._revisions(ident, latest=latest, single=True, quiet=quiet)
+
+    async def revision_list(self, ident, filter=None, format=None):
+        response = await self._revisions(ident, filter, quiet=False)
+        return self._format_response(response, format=format)
+
+    async def revision_info(self, ident, format=None, quiet=False):
+        rrec = await self._revision(ident, quiet=quiet)
+        return self._format_response(rrec, format=format)
+
+    async def session_list(self, filter=None, format=None):
+        records = await self._get_records("sessions", filter)
+        return self._format_response(records, format, record_type="session")
+
+    async def session_info(self, ident, format=None, quiet=False):
+        record = await self._ident_record("session", ident, quiet=quiet)
+        return self._format_response(record, format)
+
+    async def session_start(self, ident, editor=None, resource_profile=None, wait=True, format=None):
+        prec = await self._ident_record("project", ident)
+        id = prec["id"]
+        patches = {}
+        if editor and prec["editor"] != editor:
+            patches["editor"] = editor
+        if resource_profile and prec["resource_profile"] != resource_profile:
+            patches["resource_profile"] = resource_profile
+        if patches:
+            await self._patch(f"projects/{id}", json=patches)
+        response = await self._post_record(f"projects/{id}/sessions")
+        if response.get("error"):
+            raise RuntimeError("Error starting project: {}".format(response["error"]["message"]))
+        if wait:
+            await self._wait(response)
+        if response["action"].get("error"):
+            raise RuntimeError("Error completing session start: {}".format(response["action"]["message"]))
+        return self._format_response(response, format=format)
+
+    async def session_stop(self, ident, format=None):
+        id = (await self._ident_record("session", ident))["id"]
+        await self._delete(f"sessions/{id}")
+
+    async def session_restart(self, ident, wait=True, format=None):
+        srec = await self._ident_record("session", ident)
+        id, pid = srec["id"], srec["project_id"]
+        await self._delete(f"sessions/{id}")
+        return await self.session_start(pid, wait=wait, format=format)
+
+    async def deployment_list(self, filter=None, collaborators=False, format=None):
+        response = await self._get_records("deployments", filter=filter, collaborators=collaborators)
+        return self._format_response(response, format=format)
+
+    async def deployment_info(self, ident, collaborators=False, format=None, quiet=False):
+        record = await self._ident_record("deployment", ident, collaborators=collaborators, quiet=quiet)
+        return self._format_response(record, format=format)
+
+    async def deployment_collaborator_list(self, ident, filter=None, format=None):
+        id = (await self._ident_record("deployment", ident))["id"]
+        response = await self._get_records(f"deployments/{id}/collaborators", filter)
+        return self._format_response(response, format=format)
+
+    async def deployment_start(
+        self,
+        ident,
+        name=None,
+        endpoint=None,
+        command=None,
+        resource_profile=None,
+        public=False,
+        wait=True,
+        stop_on_error=False,
+        format=None,
+    ):
+        rrec = await self._revision(ident, keep_latest=True)
+        id, prec = rrec["project_id"], rrec["_project"]
+        if command is None:
+            command = rrec["commands"].split(",", 1)[0]
+        if resource_profile is None:
+            resource_profile = prec["resource_profile"]
+        data = {
+            "source": rrec["url"],
+            "revision": rrec["name"],
+            "resource_profile": resource_profile,
+            "command": command,
+            "public": bool(public),
+            "target": "deploy",
+        }
+        if name:
+            data["name"] = name
+        if endpoint:
+            if not re.match(r"[A-Za-z0-9-]+", endpoint):
+                raise AEException(f"Invalid endpoint: {endpoint}")
+            data["static_endpoint"] = endpoint
+        response = await self._post_record(f"projects/{id}/deployments", api_kwargs={"json": data})
+        id = response["id"]
+        if response.get("error"):
+            raise AEException("Error starting deployment: {}".format(response["error"]["message"]))
+        if wait or stop_on_error:
+            response = await self._wait_record("deployment", response, lambda r: r["state"] not in ("initial", "starting"))
+            if response["state"] != "started":
+                if stop_on_error:
+                    await self.deployment_stop(id)
+                raise AEException(f'Error completing deployment start: {response["status_text"]}')
+        return self._format_response(response, format=format)
+
+    async def deployment_stop(self, ident, format=None):
+        id = (await self._ident_record("deployment", ident))["id"]
+        await self._delete(f"deployments/{id}")
+
+    async def job_list(self, filter=None, format=None):
+        response = await self._get_records("jobs", filter=filter)
+        return self._format_response(response, format=format)
+
+    async def job_info(self, ident, format=None, quiet=False):
+        response = await self._ident_record("job", ident, quiet=quiet)
+        return self._format_response(response, format=format)
+
+    async def job_run(self, ident, format=None, quiet=False):
+        job_id = (await self._ident_record("job", ident, quiet=quiet))["id"]
+        response = await self._post(f"jobs/{job_id}/runs", format="json")
+        return self._format_response(response, format=format)
+
+    async def job_delete(self, ident, format=None):
+        id = (await self._ident_record("job", ident))["id"]
+        await self._delete(f"jobs/{id}")
+
+    async def run_list(self, filter=None, format=None):
+        response = await self._get_records("runs", filter=filter)
+        return self._format_response(response, format=format)
+
+    async def run_info(self, ident, format=None, quiet=False):
+        response = await self._ident_record("run", ident, quiet=quiet)
+        return self._format_response(response, format=format)
+
+    async def run_stop(self, ident, format=None):
+        id = (await self._ident_record("run", ident))["id"]
+        response = await self._post(f"runs/{id}/stop")
+        return self._format_response(response, format=format)
+
+    async def run_delete(self, ident, format=None):
+        id = (await self._ident_record("run", ident))["id"]
+        await self._delete(f"runs/{id}")
+
+
+class AEAsyncAdminSession(AEAsyncSessionBase):
+    """Asyncio-native counterpart of AEAdminSession."""
+
+    def __init__(self, hostname, username, password=None, persist=True):
+        self._sdata = None
+        self._refresh_token = None
+        self._filename = os.path.join(config._path, "tokens", f"{username}@{hostname}")
+        self._login_base = f"https://{hostname}/auth/realms/master/protocol/openid-connect"
+        super(AEAsyncAdminSession, self).__init__(hostname, username, password, prefix="auth/admin/realms/AnacondaPlatform", persist=persist)
+
+    def _load(self):
+        # A saved access token is reused while it remains valid. Otherwise the
+        # refresh requires a network call, so it is deferred to the first call
+        # to authorize() rather than performed here.
+        if os.path.exists(self._filename):
+            with file_lock(self._filename), open(self._filename, "r") as fp:
+                sdata = json.load(fp)
+            if _token_valid(sdata):
+                self._sdata = sdata
+            if isinstance(sdata, dict) and "refresh_token" in sdata:
+                self._refresh_token = sdata["refresh_token"]
+
+    def _save(self):
+        def _dump(fname):
+            with open(fname, "w") as fp:
+                json.dump(self._sdata, fp)
+
+        atomic_save(self._filename, _dump)
+
+    def _connected(self):
+        return isinstance(self._sdata, dict) and "access_token" in self._sdata
+
+    def _set_header(self):
+        self.headers["Authorization"] = f'Bearer {self._sdata["access_token"]}'
+
+    async def authorize(self):
+        if self._refresh_token is not None:
+            data = {"refresh_token": self._refresh_token, "grant_type": "refresh_token", "client_id": "admin-cli"}
+            self._refresh_token = None
+            resp = await self._send("post", self._login_base + "/token", data=data)
+            if resp.status_code == 200:
+                self._sdata = _token_issued(resp.json())
+                self.connected = True
+                self._set_header()
+                if self.persist:
+                    self._save()
+                return
+        await super(AEAsyncAdminSession, self).authorize()
+
+    async def _connect(self, password):
+        self._sdata = {}
+        data = {"username": self.username, "password": password, "grant_type": "password", "client_id": "admin-cli"}
+        try:
+            resp = await self._send("post", self._login_base + "/token", data=data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            print(f"Unknown error calling {self._login_base}/token")
+            print(str(error))
+            return
+        if resp.status_code not in [401]:
+            try:
+                self._sdata = _token_issued(resp.json())
+            except json.decoder.JSONDecodeError:
+                print(f"Received an unexpected response.\nStatus Code: {resp.status_code}\n{resp.text}")
+
+    async def _disconnect(self):
+        if self._sdata:
+            data = {"refresh_token": self._sdata["refresh_token"], "client_id": "admin-cli"}
+            await self._send("post", self._login_base + "/logout", data=data)
+            self._sdata.clear()
+
+    async def _keycloak_count(self, path, params):
+        endpoint = KEYCLOAK_COUNT_ENDPOINTS.get(path)
+        if endpoint is not None:
+            try:
+                count = await self._get(endpoint, params={k: v for k, v in params.items() if k not in ("first", "max")})
+            except AEException:
+                return None
+            if isinstance(count, int):
+                return count
+
+    async def _get_paginated(self, path, **kwargs):
+        records = []
+        limit = kwargs.pop("limit", sys.maxsize)
+        first = kwargs.pop("first", 0)
+        size = min(KEYCLOAK_PAGE_MAX, limit)
+        count = await self._keycloak_count(path, kwargs)
+        npages = 1 if count is None else max(1, -(-min(count - first, limit) // size))
+        page = 0
+        while True:
+            page_params = _page_params(kwargs, first, size, limit, range(page, page + npages))
+            pages = await self._gather(*(self._get(path, params=params) for params in page_params))
+            if _extend_pages(records, page_params, pages, limit):
+                return records
+            page += npages
+            npages = KEYCLOAK_PREFETCH
+
+    async def user_events(self, format=None, **kwargs):
+        first = kwargs.pop("first", 0)
+        limit = kwargs.pop("limit", sys.maxsize)
+        records = await self._get_paginated("events", limit=limit, first=first, **kwargs)
+        return self._format_response(records, format=format, columns=[])
+
+    _login_cursor = AEAdminSession._login_cursor
+
+    async def _last_logins(self):
+        # As with the membership snapshot, the cursor is not locked
+        filename = self._login_cursor()
+        state = (load_snapshot(filename, float("inf")) if filename else None) or {"mark": 0, "logins": {}}
+        mark = _merge_logins(state["logins"], await self._get_paginated("events", **_login_params(state["mark"])))
+        if filename and mark > state["mark"]:
+            state["mark"] = mark
+            save_snapshot(filename, state)
+        return state["logins"]
+
+    async def _post_user(self, users, include_login=False):
+        users = {u["id"]: u for u in users}
+        if include_login and users:
+            logins = await self._last_logins()
+            for uid, urec in users.items():
+                if uid in logins and "lastLogin" not in urec:
+                    urec["lastLogin"] = logins[uid]
+        users = list(users.values())
+        for urec in users:
+            urec.setdefault("lastLogin", 0)
+        return users
+
+    # The role and group merges involve no API calls, so they are shared with AEAdminSession.
+    _get_user_realm_roles = AEAdminSession._get_user_realm_roles
+    _get_user_realm_groups = AEAdminSession._get_user_realm_groups
+    _merge_users_with_realm_roles = AEAdminSession._merge_users_with_realm_roles
+    _merge_users_with_realm_groups = AEAdminSession._merge_users_with_realm_groups
+
+    async def _build_realm_role_user_map(self):
+        realm_roles = await self._get_paginated("roles")
+        maps = await self._gather(*(self._get_paginated(f'roles/{role["name"]}/users') for role in realm_roles))
+        return {role["name"]: users for role, users in zip(realm_roles, maps)}
+
+    async def _build_realm_group_user_map(self):
+        realm_groups = await self._get_paginated("groups")
+        maps = await self._gather(*(self._get_paginated(f'groups/{group["id"]}/members') for group in realm_groups))
+        return {group["name"]: users for group, users in zip(realm_groups, maps)}
+
+    _membership_snapshot = AEAdminSession._membership_snapshot
+
+    async def _realm_membership_maps(self):
+        # Unlike AEAdminSession, the snapshot is not locked, to avoid blocking the event loop
+        filename = self._membership_snapshot()
+        maps = load_snapshot(filename, MEMBERSHIP_SNAPSHOT_TTL) if filename else None
+        if maps is None:
+            maps = await asyncio.gather(self._build_realm_role_user_map(), self._build_realm_group_user_map())
+            if filename:
+                save_snapshot(filename, maps)
+        role_maps, group_maps = maps
+        return role_maps, group_maps
+
+    async def user_list(self, filter=None, format=None, include_login=True, fast=False):
+        users = await self._get_paginated("users")
+        if fast:
+            users = await self._fix_records("user", users, filter)
+            return self._format_response(users, format=format)
+        role_maps, group_maps = await self._realm_membership_maps()
+        users = self._merge_users_with_realm_roles(users=users, role_maps=role_maps)
+        users = self._merge_users_with_realm_groups(users=users, group_maps=group_maps)
+        users = await self._fix_records("user", users, filter, include_login=include_login)
+        return self._format_response(users, format=format)
+
+    async def _ident_by_id(self, record_type, filter, **kwargs):
+        # See AEAdminSession._ident_by_id
+        if record_type != "user":
+            return await super()._ident_by_id(record_type, filter, **kwargs)
+        username, id = _user_ident(filter)
+        if not username and not id:
+            return None
+        fast = kwargs.pop("fast", False)
+        try:
+            users = []
+            if id:
+                try:
+                    users = [await self._get(f"users/{id}")]
+                except AEUnexpectedResponseError as exc:
+                    if exc.status_code != 404:
+                        raise
+            if username and not users:
+                users = await self._get("users", params={"username": username, "exact": "true"})
+            if fast:
+                users = await self._fix_records("user", users, filter)
+                return users or EmptyRecordList("user")
+            await self._gather(*(self._join_user_memberships(user) for user in users))
+        except AEUnexpectedResponseError:
+            return None
+        users = await self._fix_records("user", users, filter, **kwargs)
+        return users or EmptyRecordList("user")
+
+    async def _join_user_memberships(self, user):
+        roles, groups = await asyncio.gather(self._get(f"users/{user['id']}/role-mappings/realm"), self._get_paginated(f"users/{user['id']}/groups"))
+        user["realm_roles"] = [role["name"] for role in roles]
+        user["realm_groups"] = [group["name"] for group in groups]
+
+    async def user_info(self, ident, format=None, quiet=False, include_login=True, fast=False):
+        response = await self._ident_record("user", ident, quiet=quiet, include_login=include_login, fast=fast)
+        return self._format_response(response, format)
+
+    async def impersonate(self, user_or_id):
+        record = await self.user_info(user_or_id, fast=True)
+        old_headers = dict(self.headers)
+        try:
+            await self._post(f'users/{record["id"]}/impersonation')
+            return self.cookies
+        finally:
+            self.cookies = LWPCookieJar()
+            self.headers = old_headers
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Lifetime, in seconds, of a cached API response. Zero disables caching.
+RESPONSE_CACHE_TTL = float(os.environ.get("AE5_CACHE_TTL", "10"))
+# Maximum number of responses retained by each session
+RESPONSE_CACHE_SIZE = int(os.environ.get("AE5_CACHE_SIZE", "128"))
+
+
+class ResponseCache(object):
+    """A thread-safe, size-bounded LRU cache of API responses with a TTL.
+
+    Each entry is stored under a key and a resource prefix (the first
+    path component of the endpoint, e.g. "projects"), so that a write
+    to a resource can invalidate everything read from it.
+    """
+
+    def __init__(self, ttl=None, maxsize=None):
+        self.ttl = RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.maxsize = RESPONSE_CACHE_SIZE if maxsize is None else maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Events for the loads in progress in get_or_load, by key
+        self._loading = {}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key):
+        """Return the value stored under key, or None if it is absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, key, prefix, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, prefix, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, prefix, load):
+        """Return the value stored under key, calling load() to supply it if necessary.
+
+        Concurrent calls for the same key share a single call to load: the
+        first caller loads and stores the value, and the others wait for it.
+        If that load fails, each waiting caller makes its own attempt.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            event = self._loading.get(key)
+            if event is None:
+                event = self._loading[key] = threading.Event()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            event.wait()
+            value = self.get(key)
+            return load() if value is None else value
+        try:
+            value = load()
+            self.put(key, prefix, value)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def invalidate(self, prefix):
+        """Drop every entry stored under the given resource prefix."""
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v[1] == prefix]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
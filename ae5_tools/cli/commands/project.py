@@ -159,6 +159,7 @@ def status():
     default="",
     help="Filename to save to. If not supplied, the filename is constructed from the name of the project.",
 )
+@click.option("--sha256", default=None, help="Verify that the SHA-256 digest of the archive matches this value.")
 @global_options
 def download(**kwargs):
     """Download an archive of a project.
@@ -203,15 +204,24 @@ def image(**kwargs):
 @click.option("--name", default="", help="Name of the project.")
 @click.option("--tag", default="", help="Commit tag to use for initial revision of project.")
 @click.option("--no-wait", is_flag=True, help="Do not wait for the creation session to complete before exiting.")
+@click.option("--compression", type=click.Choice(["gz", "bz2", "xz"]), default=None, help="Compression used when uploading a directory.")
+@click.option("--compression-level", type=click.IntRange(1, 9), default=None, help="Compression level used when uploading a directory.")
+@click.option(
+    "--cache/--no-cache",
+    default=None,
+    help="Reuse the cached archive of an unchanged directory, and cache new archives. Defaults to the AE5_ARCHIVE_CACHE setting.",
+)
 @global_options
-def upload(filename, name, tag, no_wait):
+def upload(filename, name, tag, no_wait, compression, compression_level, cache):
     """Upload a project.
 
     By default, the name of the project is taken from the basename of
     the file. This can be overridden by using the --name option. The
     name must not be the same as an existing project.
     """
-    cluster_call("project_upload", filename, name=name, tag=tag, wait=not no_wait)
+    cluster_call(
+        "project_upload", filename, name=name, tag=tag, wait=not no_wait, compression=compression, compression_level=compression_level, cache=cache
+    )
 
 
 @project.command()
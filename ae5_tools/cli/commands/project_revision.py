@@ -1,6 +1,10 @@
+import sys
+import time
+
 import click
 
 from ...identifier import Identifier
+from ...k8s.transformer import _to_text
 from ..login import cluster_call
 from ..utils import global_options, ident_filter
 
@@ -53,14 +57,39 @@ def commands(**kwargs):
     cluster_call("revision_commands", **kwargs)
 
 
+def _progress():
+    """Return a callback that shows the bytes downloaded so far after the prefix, or None if stderr is not a terminal."""
+    if not sys.stderr.isatty():
+        return None
+    state = {"text": "", "time": 0.0}
+
+    def progress(nbytes, total):
+        now = time.monotonic()
+        if nbytes != total and now - state["time"] < 0.1:
+            return
+        state["time"] = now
+        text = f"{_to_text(float(nbytes))}B"
+        if total:
+            text += f" of {_to_text(float(total))}B ({100 * nbytes // total}%)"
+        text += " "
+        # Overwrite the previous count in place
+        pad = max(0, len(state["text"]) - len(text))
+        click.echo("\b" * len(state["text"]) + text + " " * pad + "\b" * pad, nl=False, err=True)
+        state["text"] = text
+
+    return progress
+
+
 def _download(**kwargs):
     file_s = f' to {kwargs["filename"]}' if kwargs.get("filename") else ""
-    cluster_call("project_download", **kwargs, prefix=f"Downloading project {{ident}}{file_s}...", postfix="downloaded.")
+    prefix = f"Downloading project {{ident}}{file_s}... "
+    cluster_call("project_download", **kwargs, progress=_progress(), report=True, prefix=prefix, postfix="downloaded.")
 
 
 @revision.command()
 @ident_filter("project", required=True, handle_revision=True)
 @click.option("--filename", default="", help="Filename")
+@click.option("--sha256", default=None, help="Verify that the SHA-256 digest of the archive matches this value.")
 @global_options
 def download(**kwargs):
     """Download a project revision.
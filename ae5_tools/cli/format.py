@@ -1,14 +1,13 @@
 import csv
 import json
 import os
-import re
 import sys
 from datetime import datetime
-from fnmatch import fnmatch
 
 import click
 
-from ..k8s.transformer import _to_float
+from ..filter import compile_filter, is_quantity
+from ..k8s.transformer import _to_float, _to_raw, _to_text
 from .utils import GLOBAL_OPTIONS, click_text, get_options, param_callback
 
 IS_WIN = sys.platform.startswith("win")
@@ -58,7 +57,9 @@ where <op> is a binary comparison operator:
 The field name must exactly match a column of the table.
 Whitespace on either side of the operator is ignored. The single
 equals sign accepts wildcard values, matched using fnmatch.
-All other operators perform standard string comparison.
+All other operators perform standard string comparison, except on the
+resource columns (mem, cpu, gpu), where all operators compare quantities
+such as 2Gi or 500m numerically.
 
 AND combinations can be separated by either ampersands or commas:
     - <filter1>&<filter2>&...&<filterN>
@@ -88,6 +89,7 @@ _format_help = {
     "width": 'Output width, in characters. The default behavior is to determine the width of the surrounding window and truncate the table to that width. Only applies to the "text" format.',
     "wide": "Do not limit output width. Equivalent to --width=infinity.",
     "no-header": 'Omit the header. Applies to "text" and "csv" formats only.',
+    "raw": 'Print resource quantities (cpu, gpu, mem) as plain numbers of cores and bytes, rather than as text such as "1.500Gi" or "250m". Applies to "csv" and "json" formats only.',
 }
 
 
@@ -106,6 +108,7 @@ _format_options = [
     click.option("--width", type=int, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option("--wide", is_flag=True, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option("--header/--no-header", default=None, expose_value=False, callback=param_callback, hidden=True),
+    click.option("--raw", is_flag=True, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option(
         "--help-format",
         is_flag=True,
@@ -139,47 +142,28 @@ def format_options():
     return apply
 
 
-OPS = {
-    "<": lambda x, y: x < y,
-    ">": lambda x, y: x > y,
-    "=": lambda x, y: fnmatch(x, y),
-    "<=": lambda x, y: x <= y,
-    ">=": lambda x, y: x >= y,
-    "==": lambda x, y: x == y,
-    "!=": lambda x, y: not fnmatch(x, y),
-}
-
-
 def filter_df(records, _columns, filter, columns, drop_under):
     if columns:
         columns = columns.split(",")
         missing = "\n  - ".join(set(columns) - set(_columns))
         if missing:
             raise click.UsageError(f"One or more of the requested columns were not found:\n  - {missing}")
-    mask0 = None
-    for filt1 in filter or ():
-        mask1 = None
-        for filt2 in filt1.split(","):
-            mask2 = None
-            for filt3 in filt2.split("|"):
-                mask3 = None
-                for filt4 in filt3.split("&"):
-                    parts = re.split(r"(==?|!=|>=?|<=?)", filt4.strip())
-                    if len(parts) != 3:
-                        raise click.UsageError(f"Invalid filter string: {filt4}\n   Required format: <fieldname><op><value>")
-                    field, op, value = list(map(str.strip, parts))
-                    try:
-                        ndx = _columns.index(field)
-                    except ValueError:
-                        raise click.UsageError(f"Invalid filter field: {field}")
-                    op = OPS[op]
-                    mask4 = [op(_str(rec[ndx]), value) for rec in records]
-                    mask3 = mask4 if mask3 is None else [m1 and m2 for m1, m2 in zip(mask3, mask4)]
-                mask2 = mask3 if mask2 is None else [m1 or m2 for m1, m2 in zip(mask2, mask3)]
-            mask1 = mask2 if mask1 is None else [m1 and m2 for m1, m2 in zip(mask1, mask2)]
-        mask0 = mask1 if mask0 is None else [m1 and m2 for m1, m2 in zip(mask0, mask1)]
-    if mask0:
-        records = [rec for rec, flag in zip(records, mask0) if flag]
+    if filter:
+
+        def accessor(field):
+            try:
+                ndx = _columns.index(field)
+            except ValueError:
+                raise click.UsageError(f"Invalid filter field: {field}")
+            if is_quantity(field):
+                return lambda rec: rec[ndx]
+            return lambda rec: _str(rec[ndx])
+
+        try:
+            predicate = compile_filter(filter, accessor)
+        except ValueError as exc:
+            raise click.UsageError(str(exc))
+        records = [rec for rec in records if predicate(rec)]
     if not columns and drop_under:
         columns = [c for c in _columns if not c.startswith("_")]
     if columns:
@@ -210,8 +194,8 @@ def sort_df(records, columns, s_columns):
             ndxc = columns.index(col)
         except ValueError:
             raise click.UsageError(f"Invalid sort field: {col}")
-        # A bit of a hack here to allow these fields to be sorted semantically
-        if col in ("cpu", "gpu", "mem") or col.endswith(("/cpu", "/gpu", "/mem")):
+        # Quantities are numbers, but may be given as text by older k8s endpoints
+        if is_quantity(col):
             sfunc = _to_float
         else:
             sfunc = _strsort
@@ -221,6 +205,20 @@ def sort_df(records, columns, s_columns):
     return [records[x] for x in ndxs]
 
 
+def format_quantities(records, columns, raw=False):
+    """Format the resource quantities in a table as text, such as "1.234Gi" or "250m".
+
+    With raw=True, quantities are instead given as plain numbers of bytes or cores.
+    """
+    convert = (lambda v: _to_raw(_to_float(v))) if raw else _to_text
+    if columns == ["field", "value"]:
+        return [[k, convert(v) if is_quantity(k) else v] for k, v in records]
+    quantities = [is_quantity(col) for col in columns]
+    if not any(quantities):
+        return records
+    return [[convert(v) if q else v for v, q in zip(rec, quantities)] for rec in records]
+
+
 def _str(x, isodate=False):
     if x is None:
         return ""
@@ -371,6 +369,8 @@ def print_output(result):
     fmt = opts.get("format")
     drop_under = fmt not in ("json", "csv")
     result, columns = filter_df(result, columns, opts.get("filter"), opts.get("columns"), drop_under)
+    raw = fmt in ("json", "csv") and bool(opts.get("raw"))
+    result = format_quantities(result, columns, raw)
     if fmt == "json":
         print_json(result, columns)
     elif fmt == "csv":
@@ -1,6 +1,14 @@
+import operator
+import os
 import re
 from datetime import datetime
-from fnmatch import fnmatch
+from fnmatch import fnmatch, translate
+from functools import lru_cache
+
+from .k8s.transformer import _to_float
+
+# Returned by filter accessors for records that lack the field
+_MISSING = object()
 
 
 def _str(x, isodate=False):
@@ -24,6 +32,126 @@ OPS = {
     "!=": lambda x, y: not fnmatch(x, y),
 }
 
+# Comparisons of resource quantities, which are numeric for every operator
+QUANTITY_OPS = {
+    "<": operator.lt,
+    ">": operator.gt,
+    "=": operator.eq,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# Maximum number of parsed filters to retain
+FILTER_CACHE_SIZE = int(os.environ.get("AE5_FILTER_CACHE_SIZE", "256"))
+
+# fnmatch normalizes the case of both arguments on case-insensitive platforms
+_NORMCASE = os.path.normcase if os.path.normcase("A/") != "A/" else None
+
+
+def is_quantity(field):
+    """Return True if a field holds a resource quantity: a memory size, or a number of CPUs or GPUs."""
+    return field in ("cpu", "gpu", "mem") or field.endswith(("/cpu", "/gpu", "/mem"))
+
+
+def _compile_op(op, value, quantity=False):
+    """Return a single-argument test equivalent to OPS[op](x, value).
+
+    The test returns a truthy or falsy value rather than a strict boolean.
+    For a quantity field with a value such as "2Gi" or "500m", the test
+    compares numbers instead, and accepts either numbers or text.
+    """
+    if quantity:
+        number = _to_float(value)
+        if isinstance(number, float):
+            func = QUANTITY_OPS[op]
+
+            def test(x):
+                x = _to_float(x)
+                return isinstance(x, (int, float)) and func(x, number)
+
+            return test
+        test = _compile_op(op, value)
+        return lambda x: test(x if x.__class__ is str else _str(x))
+    if op in ("=", "!="):
+        match = re.compile(translate(_NORMCASE(value) if _NORMCASE else value)).match
+        if _NORMCASE:
+            test = lambda x: match(_NORMCASE(x))  # noqa: E731
+        else:
+            test = match
+        return test if op == "=" else lambda x: test(x) is None
+    if op == "==":
+        return value.__eq__
+    func = OPS[op]
+    return lambda x: func(x, value)
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def parse_filter(filter):
+    """Parse a filter tuple into nested AND/OR/AND tuples of terms.
+
+    Each term is a (field, test) pair, where test is a compiled predicate on
+    the string value of the field, or on the value itself for a quantity field. Terms that cannot be parsed are returned
+    as (None, message), so that errors are raised in the order the terms
+    appear, just as they would be by evaluating the filter term by term.
+    """
+    result = []
+    for filt1 in filter:
+        for filt2 in filt1.split(","):
+            alts = []
+            for filt3 in filt2.split("|"):
+                terms = []
+                for filt4 in filt3.split("&"):
+                    parts = re.split(r"(==?|!=|>=?|<=?)", filt4.strip())
+                    if len(parts) != 3:
+                        terms.append((None, f"Invalid filter string: {filt4}\n   Required format: <fieldname><op><value>"))
+                        continue
+                    field, op, value = list(map(str.strip, parts))
+                    terms.append((field, _compile_op(op, value, is_quantity(field))))
+                alts.append(tuple(terms))
+            result.append(tuple(alts))
+    return tuple(result)
+
+
+def compile_filter(filter, accessor):
+    """Compile a filter into a single predicate on records.
+
+    The accessor is called once for each term with the name of its field, and
+    returns a function that extracts the string value of that field from a
+    record, or _MISSING if the record does not have it. The accessor should
+    raise an exception for unknown fields. The predicate evaluates the terms
+    with short-circuiting, and returns True if the record passes the filter.
+    """
+    if isinstance(filter, str):
+        filter = (filter,)
+    clauses = []
+    for alts in parse_filter(tuple(filter)):
+        calts = []
+        for terms in alts:
+            cterms = []
+            for field, test in terms:
+                if field is None:
+                    raise ValueError(test)
+                cterms.append((accessor(field), test))
+            calts.append(cterms)
+        clauses.append(calts)
+
+    def predicate(rec):
+        for alts in clauses:
+            for terms in alts:
+                for get, test in terms:
+                    value = get(rec)
+                    if value is _MISSING or not test(value):
+                        break
+                else:
+                    break
+            else:
+                return False
+        return True
+
+    return predicate
+
 
 def filter_vars(filter):
     vars = []
@@ -62,28 +190,40 @@ def split_filter(filter, columns, negative=False):
 def filter_list_of_dicts(records, filter):
     if not filter or not records:
         return records
-    mask0 = None
     rec0 = records[0]
+
+    def accessor(field):
+        if field not in rec0:
+            raise ValueError(f'Invalid filter string: unknown field "{field}"')
+        if is_quantity(field):
+            return lambda rec: rec.get(field, _MISSING)
+
+        def get(rec):
+            value = rec.get(field, _MISSING)
+            return value if value.__class__ is str or value is _MISSING else _str(value)
+
+        return get
+
+    predicate = compile_filter(filter, accessor)
+    return [rec for rec in records if predicate(rec)]
+
+
+def exact_value(filter, field):
+    """Return the value a filter requires the given field to equal exactly, if any.
+
+    Only clauses that every matching record must satisfy are considered;
+    clauses within an alternation ("|") are ignored.
+    """
     if isinstance(filter, str):
         filter = (filter,)
     for filt1 in filter or ():
-        mask1 = None
         for filt2 in filt1.split(","):
-            mask2 = None
-            for filt3 in filt2.split("|"):
-                mask3 = None
-                for filt4 in filt3.split("&"):
-                    parts = re.split(r"(==?|!=|>=?|<=?)", filt4.strip())
-                    if len(parts) != 3:
-                        raise ValueError(f"Invalid filter string: {filt4}\n   Required format: <fieldname><op><value>")
-                    field, op, value = list(map(str.strip, parts))
-                    if field not in rec0:
-                        raise ValueError(f'Invalid filter string: unknown field "{field}"')
-                    mask4 = [OPS[op](_str(rec[field]), value) if field in rec else False for rec in records]
-                    mask3 = mask4 if mask3 is None else [m1 and m2 for m1, m2 in zip(mask3, mask4)]
-                mask2 = mask3 if mask2 is None else [m1 or m2 for m1, m2 in zip(mask2, mask3)]
-            mask1 = mask2 if mask1 is None else [m1 and m2 for m1, m2 in zip(mask1, mask2)]
-        mask0 = mask1 if mask0 is None else [m1 and m2 for m1, m2 in zip(mask0, mask1)]
-    if mask0:
-        records = [rec for rec, flag in zip(records, mask0) if flag]
-    return records
+            if "|" in filt2:
+                continue
+            for filt4 in filt2.split("&"):
+                parts = re.split(r"(==?|!=|>=?|<=?)", filt4.strip())
+                if len(parts) != 3:
+                    continue
+                fname, op, value = list(map(str.strip, parts))
+                if fname == field and (op == "==" or op == "=" and not any(c in value for c in "*?[")):
+                    return value
@@ -3,6 +3,8 @@ from collections import namedtuple
 
 # from anaconda_platform/ui/base.py
 RE_ID = r"[a-f0-9]{2}-[a-f0-9]{32}"
+# Keycloak user ids
+RE_UUID = r"[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}"
 SLUG_MAP = {"a0": "projects", "a1": "sessions", "a2": "deployments", "a3": "channels"}
 REVERSE_SLUG_MAP = {v: k for k, v in SLUG_MAP.items()}
 # pods can be a1- or a2- so we have to handle them specially in the code below
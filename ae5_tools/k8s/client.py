@@ -14,10 +14,14 @@ class AE5K8SClient(object):
         return self._api("get", "").text
 
     def node_info(self):
-        return self._api("get", "nodes").json()
+        return self._api("get", "nodes", params={"raw": 1}).json()
 
     def pod_info(self, ids):
-        result = self._api("post", "pods", json=ids).json()
+        response = self._api("post", "pods", params={"raw": 1}, json=ids)
+        if response.status_code == 413:
+            # Too many ids for one request; the caller splits them up
+            response.raise_for_status()
+        result = response.json()
         result = [result.get(x) for x in ids]
         return result
 
@@ -40,7 +44,9 @@ class AE5K8SLocalClient(AE5K8SClient):
         except RuntimeError as exc:
             self._error = str(exc)
             return
-        cmd = ["python", "-u", "-m", "ae5_tools.k8s.server", ssh_url]
+        # The server lives only as long as this session, too briefly for
+        # informers to repay their full listings of the cluster
+        cmd = ["python", "-u", "-m", "ae5_tools.k8s.server", ssh_url, "--informers=0"]
         try:
             self._server = launch_background(cmd, "======== Running on", "start server")
             self._error = None
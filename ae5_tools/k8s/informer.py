@@ -0,0 +1,418 @@
+import asyncio
+import os
+import time
+
+from .transformer import (
+    ID_LABELS,
+    NODE_SUBSETS,
+    _add_resources,
+    _format_node,
+    _node_record,
+    _pod_placement,
+    _pod_resources,
+    _pod_usage,
+    _resources,
+)
+
+# Set to 0 to disable the informers, so that every request queries the API server
+INFORMER_ENABLED = os.environ.get("AE5_K8S_INFORMER", "1") not in ("", "0")
+# Interval, in seconds, at which an informer lists its collection again in full
+INFORMER_RESYNC = int(os.environ.get("AE5_K8S_INFORMER_RESYNC", "300"))
+# Time, in seconds, for which an informer that has lost its watch may still answer requests
+INFORMER_MAX_STALENESS = float(os.environ.get("AE5_K8S_INFORMER_MAX_STALENESS", "60"))
+# Interval, in seconds, at which the node aggregates merge the latest pod metrics
+METRICS_INTERVAL = float(os.environ.get("AE5_K8S_METRICS_INTERVAL", "15"))
+# Longest delay between attempts to reconnect to the API server, in seconds
+INFORMER_MAX_BACKOFF = 30
+# A watch that ends sooner than this, in seconds, without delivering an event has failed
+INFORMER_MIN_WATCH = 5
+# After this many consecutive failed watches, the informer no longer answers requests
+INFORMER_MAX_WATCH_FAILURES = 3
+
+
+def _object_key(obj):
+    metadata = obj["metadata"]
+    return f'{metadata.get("namespace", "")}/{metadata["name"]}'
+
+
+class Informer(object):
+    """An in-memory copy of a Kubernetes collection, kept current with list and watch.
+
+    The collection is listed in full, then watched from the resource version
+    of the listing. When the server ends the watch, every INFORMER_RESYNC
+    seconds, or it fails, the collection is listed again. Failed watches,
+    such as those refused for lack of permission, back off exponentially,
+    and mark the informer stale once INFORMER_MAX_WATCH_FAILURES of them
+    follow one another. Subclasses maintain
+    their own indexes through _on_replace and _on_change, which see every
+    change to the collection in order.
+    """
+
+    def __init__(self, xfrm, path, resync=None):
+        self._xfrm = xfrm
+        self._path = path
+        self.resync = INFORMER_RESYNC if resync is None else resync
+        self.objects = {}
+        self.resource_version = None
+        self.synced = False
+        self.watching = False
+        self.last_contact = None
+        self.lists = 0
+        self.events = 0
+        self.errors = 0
+        self.last_error = None
+        self.watch_failures = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.watching = False
+
+    def staleness(self):
+        """Return the time, in seconds, since the informer was last known to be current, or None before its first listing."""
+        if not self.synced:
+            return None
+        return 0.0 if self.watching else time.time() - self.last_contact
+
+    def fresh(self):
+        """Whether the informer is current enough to answer requests."""
+        staleness = self.staleness()
+        if self.watch_failures >= INFORMER_MAX_WATCH_FAILURES:
+            return False
+        return staleness is not None and staleness <= INFORMER_MAX_STALENESS
+
+    def status(self):
+        return {
+            "path": self._path,
+            "synced": self.synced,
+            "watching": self.watching,
+            "fresh": self.fresh(),
+            "staleness": self.staleness(),
+            "objects": len(self.objects),
+            "resource_version": self.resource_version,
+            "lists": self.lists,
+            "events": self.events,
+            "errors": self.errors,
+            "watch_failures": self.watch_failures,
+            "last_error": self.last_error,
+        }
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                await self._list()
+                if await self._watch():
+                    delay = 1
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.watching = False
+                self.errors += 1
+                self.last_error = f"{type(exc).__name__}: {exc}"
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INFORMER_MAX_BACKOFF)
+
+    async def _list(self):
+        data = await self._xfrm.get(self._path)
+        self.replace(data["items"], data["metadata"].get("resourceVersion"))
+
+    async def _watch(self):
+        """Watch the collection until the server ends the watch, and return whether it worked.
+
+        A watch works if it delivers an event or lasts INFORMER_MIN_WATCH
+        seconds. Only then is the informer known to have been current when
+        the watch ended.
+        """
+        params = {"allowWatchBookmarks": "true", "timeoutSeconds": self.resync}
+        if self.resource_version:
+            params["resourceVersion"] = self.resource_version
+        started = time.monotonic()
+        received = False
+        self.watching = True
+        try:
+            async for event in self._xfrm.watch(self._path, **params):
+                if event["type"] == "ERROR":
+                    # Typically 410 Gone: the resource version is too old to resume from
+                    status = event["object"]
+                    self.last_error = f'{status.get("code")}: {status.get("message")}'
+                    break
+                received = True
+                self.apply(event["type"], event["object"])
+        except Exception:
+            self.watch_failures += 1
+            raise
+        finally:
+            self.watching = False
+        if received or time.monotonic() - started >= INFORMER_MIN_WATCH:
+            self.watch_failures = 0
+            self.last_contact = time.time()
+            return True
+        self.watch_failures += 1
+        return False
+
+    def replace(self, items, resource_version):
+        """Replace the contents of the collection with a full listing."""
+        old = self.objects
+        self.objects = {_object_key(obj): obj for obj in items}
+        self.resource_version = resource_version
+        self.synced = True
+        self.last_contact = time.time()
+        self.lists += 1
+        self._on_replace(old)
+
+    def apply(self, type, obj):
+        """Apply a single watch event to the collection."""
+        self.resource_version = obj["metadata"].get("resourceVersion", self.resource_version)
+        self.last_contact = time.time()
+        if type == "BOOKMARK":
+            return
+        self.events += 1
+        key = _object_key(obj)
+        old = self.objects.get(key)
+        if type == "DELETED":
+            self.objects.pop(key, None)
+            obj = None
+        else:
+            self.objects[key] = obj
+        self._on_change(key, old, obj)
+
+    def _on_replace(self, old):
+        pass
+
+    def _on_change(self, key, old, new):
+        pass
+
+
+def pod_ids(pod):
+    """Yield the AE5 ids of a pod, with the position of each label in ID_LABELS as its priority."""
+    labels = pod["metadata"].get("labels") or {}
+    for priority, (prefix, label, vprefix) in enumerate(ID_LABELS):
+        value = labels.get(label)
+        if value and value.startswith(vprefix):
+            yield f"{prefix}-{value[len(vprefix):]}", priority
+
+
+class PodInformer(Informer):
+    """An informer for the pods of a namespace, indexed by their AE5 ids.
+
+    When several pods carry the same id, for instance while a deployment is
+    restarted, get returns the one a label-selector search would find first:
+    the pod matched by the earliest label in ID_LABELS, then by name.
+    """
+
+    def __init__(self, xfrm, namespace, resync=None):
+        super(PodInformer, self).__init__(xfrm, f"namespaces/{namespace}/pods", resync)
+        self._index = {}
+
+    def get(self, id):
+        """Return the pod with the given AE5 id, or None."""
+        candidates = self._index.get(id)
+        if not candidates:
+            return None
+        key = min(candidates, key=lambda k: (candidates[k], k))
+        return self.objects[key]
+
+    def status(self):
+        return dict(super(PodInformer, self).status(), ids=len(self._index))
+
+    def _add(self, key, pod):
+        for id, priority in pod_ids(pod):
+            self._index.setdefault(id, {})[key] = priority
+
+    def _remove(self, key, pod):
+        for id, _ in pod_ids(pod):
+            candidates = self._index.get(id)
+            if candidates is not None:
+                candidates.pop(key, None)
+                if not candidates:
+                    del self._index[id]
+
+    def _on_replace(self, old):
+        self._index = {}
+        for key, pod in self.objects.items():
+            self._add(key, pod)
+
+    def _on_change(self, key, old, new):
+        if old is not None:
+            self._remove(key, old)
+        if new is not None:
+            self._add(key, new)
+
+
+class _AggregatedPods(Informer):
+    """The pods of the cluster, reporting every change to a NodeAggregates."""
+
+    def __init__(self, aggregates, xfrm, resync=None):
+        super(_AggregatedPods, self).__init__(xfrm, "pods", resync)
+        self._aggregates = aggregates
+
+    def _on_replace(self, old):
+        self._aggregates._pods_replaced(self.objects)
+
+    def _on_change(self, key, old, new):
+        self._aggregates._pod_changed(key, new)
+
+
+class NodeAggregates(object):
+    """Per-node totals of pod requests, limits, and usage, maintained from watched pods and nodes.
+
+    The requests and limits of each pod are parsed once, when it is added or
+    updated, and the pods are tracked by node. A change to a pod only marks
+    its node dirty; the totals of dirty nodes are summed again from the
+    parsed values when the nodes are next read. Usage is merged separately,
+    every METRICS_INTERVAL seconds, from a single bulk metrics query.
+    """
+
+    def __init__(self, xfrm, resync=None):
+        self._xfrm = xfrm
+        self.pods = _AggregatedPods(self, xfrm, resync)
+        self.nodes = Informer(xfrm, "nodes", resync)
+        # Pod key -> (node, subset, count field, resources), for the pods that are totalled
+        self._placements = {}
+        # Node name -> keys of its pods, and the totals computed from them
+        self._node_pods = {}
+        self._totals = {}
+        self._dirty = set()
+        # Node name -> window, timestamp, and usage by subset, from the latest metrics
+        self._usage = {}
+        self.metrics_time = None
+        self.metrics_error = None
+        self._task = None
+
+    def start(self):
+        self.pods.start()
+        self.nodes.start()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run_metrics())
+
+    async def stop(self):
+        await self.pods.stop()
+        await self.nodes.stop()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def staleness(self):
+        """Return the greatest staleness of the pod and node informers, or None before both have listed."""
+        values = (self.pods.staleness(), self.nodes.staleness())
+        return None if None in values else max(values)
+
+    def fresh(self):
+        """Whether the aggregates are current enough to answer requests, including recent usage."""
+        if not (self.pods.fresh() and self.nodes.fresh()) or self.metrics_time is None:
+            return False
+        return time.time() - self.metrics_time <= max(INFORMER_MAX_STALENESS, 2 * METRICS_INTERVAL)
+
+    def status(self):
+        return {
+            "fresh": self.fresh(),
+            "pods": self.pods.status(),
+            "nodes": self.nodes.status(),
+            "dirty": len(self._dirty),
+            "metrics_age": None if self.metrics_time is None else time.time() - self.metrics_time,
+            "metrics_error": self.metrics_error,
+        }
+
+    def _place(self, key, pod):
+        placement = _pod_placement(pod)
+        if placement is not None:
+            self._placements[key] = placement + (_pod_resources(pod),)
+            self._node_pods.setdefault(placement[0], set()).add(key)
+            self._dirty.add(placement[0])
+
+    def _pods_replaced(self, pods):
+        self._placements = {}
+        self._node_pods = {}
+        self._totals = {}
+        self._dirty = set()
+        for key, pod in pods.items():
+            self._place(key, pod)
+
+    def _pod_changed(self, key, pod):
+        old = self._placements.pop(key, None)
+        if old is not None:
+            self._node_pods[old[0]].discard(key)
+            self._dirty.add(old[0])
+        if pod is not None:
+            self._place(key, pod)
+
+    def _node_totals(self, name):
+        if name in self._dirty:
+            totals = {subset: {"pods": 0, "pending": 0, "requests": _resources(), "limits": _resources()} for subset in NODE_SUBSETS}
+            for key in self._node_pods.get(name, ()):
+                _, t_sub, pfld, resources = self._placements[key]
+                for subset in ("total", t_sub):
+                    subRec = totals[subset]
+                    subRec[pfld] += 1
+                    for which in ("requests", "limits"):
+                        _add_resources(subRec[which], resources[which])
+            self._totals[name] = totals
+            self._dirty.discard(name)
+        return self._totals.get(name)
+
+    async def _run_metrics(self):
+        while True:
+            try:
+                await self.merge_metrics()
+                self.metrics_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.metrics_error = f"{type(exc).__name__}: {exc}"
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    async def merge_metrics(self):
+        metrics = await self._xfrm.metrics_snapshot()
+        self._merge_metrics(metrics.values())
+
+    def _merge_metrics(self, items):
+        usage = {}
+        for mRec in items:
+            placement = self._placements.get(_object_key(mRec))
+            if placement is None:
+                continue
+            nodeName, t_sub = placement[:2]
+            nodeUsage = usage.setdefault(nodeName, {"window": mRec["window"], "timestamp": mRec["timestamp"], "subsets": {}})
+            podUsage = _pod_usage(mRec)
+            for subset in ("total", t_sub):
+                _add_resources(nodeUsage["subsets"].setdefault(subset, _resources()), podUsage)
+        self._usage = usage
+        self.metrics_time = time.time()
+
+    def node_records(self, raw=False):
+        """Return the node records, formatted as AE5K8STransformer.node_info does."""
+        nodeList = []
+        for rec in self.nodes.objects.values():
+            nodeRec = _node_record(rec, raw)
+            totals = self._node_totals(nodeRec["name"])
+            usage = self._usage.get(nodeRec["name"], {})
+            nodeRec["window"] = usage.get("window")
+            nodeRec["timestamp"] = usage.get("timestamp")
+            for subset in NODE_SUBSETS:
+                subRec = nodeRec[subset]
+                if totals is not None:
+                    for field in ("pods", "pending"):
+                        subRec[field] = totals[subset][field]
+                    for which in ("requests", "limits"):
+                        _add_resources(subRec[which], totals[subset][which])
+                subRec["usage"]["gpu"] = subRec["requests"]["gpu"]
+                _add_resources(subRec["usage"], usage.get("subsets", {}).get(subset, _resources()))
+            _format_node(nodeRec, raw)
+            nodeList.append(nodeRec)
+        return nodeList
@@ -8,6 +8,12 @@ from urllib.parse import unquote, urlencode
 import requests
 from aiohttp import web
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from .informer import INFORMER_ENABLED, NodeAggregates, PodInformer
 from .ssh import tunneled_k8s_url
 from .transformer import AE5K8STransformer, AE5PromQLTransformer
 
@@ -18,11 +24,29 @@ DEFAULT_K8S_TOKEN_FILES = (
 )
 K8S_ENDPOINT_PORT = int(os.environ.get("AE5_K8S_PORT") or "8086")
 DEFAULT_PROMETHEUS_PORT = 9090
+# JSON responses of at least this many bytes are compressed, if the client accepts it
+COMPRESS_MIN_SIZE = int(os.environ.get("AE5_K8S_COMPRESS_MIN_SIZE", "1024"))
+
+
+def _dumps(result):
+    """Serialize a result as compact JSON, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(result)
+    return json.dumps(result, separators=(",", ":")).encode()
+
 
+def _raw(request):
+    """Return True if a request asks for quantities as plain numbers, with ?raw=1."""
+    return request.query.get("raw", "") not in ("", "0", "false")
 
-def _json(result):
-    text = json.dumps(result, indent=2)
-    return web.Response(text=text, content_type="application/json")
+
+def _json(result, headers=None):
+    body = _dumps(result)
+    response = web.Response(body=body, content_type="application/json", headers=headers)
+    if len(body) >= COMPRESS_MIN_SIZE:
+        # gzip or deflate, as negotiated with the Accept-Encoding header
+        response.enable_compression()
+    return response
 
 
 class WebStream(object):
@@ -44,8 +68,11 @@ class WebStream(object):
 
 
 class AE5K8SHandler(object):
-    def __init__(self, url, token, namespace, prometheus_url=None):
+    def __init__(self, url, token, namespace, prometheus_url=None, informers=INFORMER_ENABLED):
         self.xfrm = AE5K8STransformer(url, token, namespace)
+        if informers:
+            self.xfrm.informer = PodInformer(self.xfrm, self.xfrm._ns)
+            self.xfrm.node_aggregates = NodeAggregates(self.xfrm)
         if prometheus_url:
             self.promql = AE5PromQLTransformer(prometheus_url, token)
 
@@ -60,20 +87,44 @@ class AE5K8SHandler(object):
         assert len(entries) == 1, "More than one prometheus-k8s service found"
         return entries[0]["spec"]["clusterIP"]
 
-    async def cleanup(self):
+    async def startup(self, app=None):
+        for informer in (self.xfrm.informer, self.xfrm.node_aggregates):
+            if informer is not None:
+                informer.start()
+
+    async def cleanup(self, app=None):
+        for informer in (self.xfrm.informer, self.xfrm.node_aggregates):
+            if informer is not None:
+                await informer.stop()
         await self.xfrm.close()
 
+    def _informer_headers(self, informer):
+        """Report whether a request was answered from memory, and how current it was."""
+        if informer is None:
+            return {"X-AE5-Informer": "disabled"}
+        staleness = informer.staleness()
+        headers = {"X-AE5-Informer": "fresh" if informer.fresh() else "stale"}
+        if staleness is not None:
+            headers["X-AE5-Informer-Staleness"] = f"{staleness:.1f}"
+        return headers
+
+    async def informer_status(self, request):
+        if self.xfrm.informer is None:
+            return _json({"enabled": False})
+        return _json({"enabled": True, "pods": self.xfrm.informer.status(), "nodes": self.xfrm.node_aggregates.status()})
+
     async def hello(self, request):
         return web.Response(text="Alive and kicking")
 
     async def nodeinfo(self, request):
-        result = await self.xfrm.node_info()
-        return _json(result)
+        headers = self._informer_headers(self.xfrm.node_aggregates)
+        result = await self.xfrm.node_info(raw=_raw(request))
+        return _json(result, headers)
 
-    async def _podinfo(self, ids, quiet=False):
+    async def _podinfo(self, ids, quiet=False, raw=False):
         is_single = isinstance(ids, str)
         idset = [ids] if is_single else ids
-        results = await self.xfrm.pod_info(idset, return_exceptions=True)
+        results = await self.xfrm.pod_info(idset, return_exceptions=True, raw=raw)
         invalid = [id for id, q in zip(idset, results) if isinstance(q, Exception)]
         if invalid and not quiet:
             plural = "s" if len(invalid) > 1 else ""
@@ -84,14 +135,15 @@ class AE5K8SHandler(object):
         return values
 
     async def podinfo_get_query(self, request):
-        if not request.query:
+        if "id" not in request.query:
             raise web.HTTPUnprocessableEntity(reason="Must supply an ID")
-        invalid_keys = set(k for k in request.query if k != "id")
+        invalid_keys = set(k for k in request.query if k not in ("id", "raw"))
         if invalid_keys:
             query = urlencode(request.query)
             raise web.HTTPUnprocessableEntity(reason=f"Invalid query: {query}")
-        result = await self._podinfo(list(request.query.values()), True)
-        return _json(result)
+        headers = self._informer_headers(self.xfrm.informer)
+        result = await self._podinfo([v for k, v in request.query.items() if k == "id"], True, _raw(request))
+        return _json(result, headers)
 
     async def podinfo_post(self, request):
         try:
@@ -100,11 +152,13 @@ class AE5K8SHandler(object):
             data = None
         if not isinstance(data, list):
             raise web.HTTPUnprocessableEntity(reason="Must be a list of IDs")
-        result = await self._podinfo(data, True)
-        return _json(result)
+        headers = self._informer_headers(self.xfrm.informer)
+        result = await self._podinfo(data, True, _raw(request))
+        return _json(result, headers)
 
     async def podinfo_get_path(self, request):
-        return _json(await self._podinfo(request.match_info["id"]))
+        headers = self._informer_headers(self.xfrm.informer)
+        return _json(await self._podinfo(request.match_info["id"], raw=_raw(request)), headers)
 
     async def podlog(self, request):
         id = request.match_info["id"]
@@ -155,7 +209,7 @@ class AE5K8SHandler(object):
         raise web.HTTPUnprocessableEntity(reason=f'Prometheus query returned status {resp["status"]}.')
 
 
-def main(url=None, token=None, namespace=None, port=None, promql_port=None):
+def main(url=None, token=None, namespace=None, port=None, promql_port=None, informers=INFORMER_ENABLED):
     if url:
         print("API url supplied as argument")
     elif os.environ.get("AE5_K8S_URL"):
@@ -202,11 +256,14 @@ def main(url=None, token=None, namespace=None, port=None, promql_port=None):
         promql_url = None
 
     app = web.Application()
-    handler = AE5K8SHandler(url, token, namespace, promql_url)
+    handler = AE5K8SHandler(url, token, namespace, promql_url, informers=informers)
+    app.on_startup.append(handler.startup)
+    app.on_cleanup.append(handler.cleanup)
     app.add_routes(
         [
             web.get("/", handler.hello),
             web.get("/__status__", handler.hello),
+            web.get("/informer/__status__", handler.informer_status),
             web.get("/nodes", handler.nodeinfo),
             web.get("/pods", handler.podinfo_get_query),
             web.post("/pods", handler.podinfo_post),
@@ -224,7 +281,11 @@ def main(url=None, token=None, namespace=None, port=None, promql_port=None):
 if __name__ == "__main__":
     url = None
     skip = False
+    informers = INFORMER_ENABLED
     for arg in sys.argv[1:]:
+        if arg.startswith("--informers="):
+            informers = arg.split("=", 1)[1] not in ("", "0")
+            continue
         if skip or arg.startswith("--"):
             skip = not (skip or "=" in arg)
             continue
@@ -234,4 +295,4 @@ if __name__ == "__main__":
     if url and url.startswith("ssh:"):
         username, hostname = url[4:].split("@", 1)
         proc, url = tunneled_k8s_url(hostname, username)
-    main(url=url, token=False if url else None)
+    main(url=url, token=False if url else None, informers=informers)
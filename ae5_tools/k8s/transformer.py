@@ -2,13 +2,19 @@ import asyncio
 import datetime
 import io
 import json
+import os
 import re
 import sys
+import time
 from urllib.parse import urlencode
 
 import aiohttp
 import dateutil.parser
 
+# Lifetime, in seconds, of the snapshot of pod metrics shared by all requests.
+# The metrics API itself only refreshes every 15-60 seconds.
+METRICS_TTL = float(os.environ.get("AE5_K8S_METRICS_TTL", "15"))
+
 
 def _or_raise(exc, return_exceptions):
     if return_exceptions:
@@ -29,30 +35,42 @@ def _to_datetime(rec):
     return rec
 
 
+# Kubernetes quantity suffixes: binary and decimal multiples, and decimal fractions
+QUANTITY_MULTIPLES = {
+    "Ki": 2.0**10,
+    "Mi": 2.0**20,
+    "Gi": 2.0**30,
+    "Ti": 2.0**40,
+    "Pi": 2.0**50,
+    "Ei": 2.0**60,
+    "k": 1.0e3,
+    "M": 1.0e6,
+    "G": 1.0e9,
+    "T": 1.0e12,
+    "P": 1.0e15,
+    "E": 1.0e18,
+}
+QUANTITY_FRACTIONS = {"n": 1.0e9, "u": 1.0e6, "m": 1.0e3}
+_QUANTITY_RE = re.compile(r"^((?:[0-9]+(?:[.][0-9]*)?|[.][0-9]+)(?:[eE][+-]?[0-9]+)?|inf)\s*([KMGTPE]i|[numkMGTPE])?$")
+
+
 def _to_float(text):
+    """Parse a Kubernetes quantity, such as "1.5Gi", "16G" or "250m", into a number of bytes or cores.
+
+    Values that are not strings are returned unchanged, as is text that is not a quantity.
+    """
     if isinstance(text, dict):
         return {k: _to_float(v) for k, v in text.items()}
     elif not isinstance(text, str):
         return text
-    match = re.match(r"^([0-9]+(?:[.][0-9]*)?|inf)\s*(m|Ki|Mi|Gi|Ti)?$", text)
+    match = _QUANTITY_RE.match(text)
     if not match:
         return text
     value, suffix = match.groups()
     value = float(value)
-    if suffix == "":
-        return value
-    elif suffix == "m":
-        return value / 1000.0
-    elif suffix == "Ki":
-        return value * 1000.0
-    elif suffix == "Mi":
-        return value * 1.0e6
-    elif suffix == "Gi":
-        return value * 1.0e9
-    elif suffix == "Ti":
-        return value * 1.0e9
-    else:
-        return value
+    if suffix in QUANTITY_FRACTIONS:
+        return value / QUANTITY_FRACTIONS[suffix]
+    return value * QUANTITY_MULTIPLES.get(suffix, 1.0)
 
 
 def _to_text(value):
@@ -66,14 +84,14 @@ def _to_text(value):
         return "inf"
     elif value < 1.0:
         mult, suffix = 0.001, "m"
-    elif value > 1.0e12:
-        mult, suffix = 1.0e12, "Ti"
-    elif value > 1.0e9:
-        mult, suffix = 1.0e9, "Gi"
-    elif value > 1.0e6:
-        mult, suffix = 1.0e6, "Mi"
-    elif value > 1.0e3:
-        mult, suffix = 1.0e3, "Ki"
+    elif value >= 2.0**40:
+        mult, suffix = 2.0**40, "Ti"
+    elif value >= 2.0**30:
+        mult, suffix = 2.0**30, "Gi"
+    elif value >= 2.0**20:
+        mult, suffix = 2.0**20, "Mi"
+    elif value >= 2.0**10:
+        mult, suffix = 2.0**10, "Ki"
     else:
         mult, suffix = 1.0, ""
     value /= mult
@@ -92,12 +110,29 @@ def _to_text2(value):
     return _to_text(_to_float(value))
 
 
+def _to_raw(value):
+    """Return a summed quantity as a plain number, or None for an unbounded limit, which JSON cannot represent."""
+    return None if value == float("inf") else value
+
+
 FIELD_RENAMES = {"gpu": "nvidia.com/gpu", "mem": "memory"}
 
+# The pod labels that carry AE5 ids, as (id prefix, label, value prefix), in the
+# order in which they are searched. The label value is the value prefix
+# followed by the id without its prefix.
+ID_LABELS = (
+    ("a1", "anaconda-session-id", ""),
+    ("a1", "session-id", ""),
+    ("a2", "app-id", ""),
+    ("a2", "anaconda-app-id", ""),
+    ("a2", "job-id", ""),
+    ("a2", "job-name", "anaconda-job-"),
+)
 
-def _k8s_pod_to_record(pRec):
+
+def _k8s_pod_to_record(pRec, raw=False):
     if isinstance(pRec, list):
-        return [_k8s_pod_to_record(rec) for rec in pRec]
+        return [_k8s_pod_to_record(rec, raw) for rec in pRec]
     npRec = {
         "name": pRec["metadata"]["name"],
         "node": pRec["spec"]["nodeName"],
@@ -132,16 +167,17 @@ def _k8s_pod_to_record(pRec):
         default = float("inf") if which == "limits" else 0
         for cRec in pRec["spec"]["containers"]:
             ncRec = cMap[cRec["name"]]
-            src = ncRec[which] = cRec["resources"][which]
+            src = cRec["resources"][which]
+            ncRec[which] = _to_float(src) if raw else src
             for key, value in dst.items():
                 skey = FIELD_RENAMES.get(key, key)
                 dst[key] = value + _to_float(src.get(skey, src.get(key, default)))
         for key, value in dst.items():
-            dst[key] = _to_text(value)
+            dst[key] = _to_raw(value) if raw else _to_text(value)
     return npRec
 
 
-def _pod_merge_metrics(pRec, mRec):
+def _pod_merge_metrics(pRec, mRec, raw=False):
     mRec = mRec or {}
     pRec["window"] = mRec.get("window")
     pRec["timestamp"] = mRec.get("timestamp")
@@ -149,7 +185,8 @@ def _pod_merge_metrics(pRec, mRec):
     dst = pRec["usage"] = {"mem": 0, "cpu": 0, "gpu": 0}
     for mcRec in mRec.get("containers", ()):
         cRec = cMap.get(mcRec["name"])
-        src = cRec["usage"] = mcRec["usage"]
+        # A copy, as the metrics record is shared with other requests
+        src = cRec["usage"] = _to_float(mcRec["usage"]) if raw else dict(mcRec["usage"])
         src["gpu"] = cRec["requests"]["nvidia.com/gpu"]
         for key, value in dst.items():
             skey = FIELD_RENAMES.get(key, key)
@@ -157,9 +194,100 @@ def _pod_merge_metrics(pRec, mRec):
     for cRec in pRec["containers"].values():
         cRec.setdefault("usage", {})
         for field in ("mem", "cpu", "gpu"):
-            cRec["usage"].setdefault(field, "0")
+            cRec["usage"].setdefault(field, 0 if raw else "0")
     for key, value in dst.items():
-        dst[key] = _to_text(value)
+        dst[key] = value if raw else _to_text(value)
+
+
+NODE_SUBSETS = ("total", "sessions", "deployments", "middleware", "system")
+
+
+def _resources():
+    return {"mem": 0, "cpu": 0, "gpu": 0}
+
+
+def _node_record(rec, raw=False):
+    """Return the record of a node, with empty totals for each subset of its pods."""
+    allocatable = rec["status"]["allocatable"]
+    capacity = {
+        "pods": allocatable["pods"],
+        "mem": allocatable["memory"],
+        "cpu": allocatable["cpu"],
+        "gpu": allocatable.get("nvidia.com/gpu", "0"),
+    }
+    if raw:
+        capacity = _to_float(capacity)
+        capacity["pods"] = int(capacity["pods"])
+    else:
+        capacity["mem"] = _to_text2(capacity["mem"])
+    nodeRec = {
+        "name": rec["metadata"]["name"],
+        "role": rec["metadata"]["labels"]["role"],
+        "capacity": capacity,
+        "ready": any(c["type"] == "Ready" and c["status"] == "True" for c in rec["status"]["conditions"]),
+        "conditions": [c["type"] for c in rec["status"]["conditions"] if c["type"] != "Ready" and c["status"] == "True"],
+        "timestamp": None,
+        "window": None,
+    }
+    for subset in NODE_SUBSETS:
+        nodeRec[subset] = {"pods": 0, "pending": 0, "requests": _resources(), "limits": _resources(), "usage": _resources()}
+    return nodeRec
+
+
+def _pod_placement(pod):
+    """Return the node, subset, and count field under which a pod is totalled, or None if it is not running or pending on a node."""
+    nodeName = pod["spec"].get("nodeName")
+    phase = pod["status"]["phase"]
+    if phase in ("Failed", "Succeeded") or not nodeName:
+        return None
+    podName = pod["metadata"]["name"]
+    if podName.startswith("anaconda-session"):
+        t_sub = "sessions"
+    elif podName.startswith("anaconda-app"):
+        t_sub = "deployments"
+    elif podName.startswith("anaconda-"):
+        t_sub = "middleware"
+    else:
+        t_sub = "system"
+    return nodeName, t_sub, "pending" if phase == "Pending" else "pods"
+
+
+def _pod_resources(pod):
+    """Return the requests and limits of a pod, summed over its containers, as numbers."""
+    result = {"requests": _resources(), "limits": _resources()}
+    for container in pod["spec"]["containers"]:
+        for which in ("requests", "limits"):
+            src = container["resources"].get(which, {})
+            dst = result[which]
+            for key, value in dst.items():
+                skey = FIELD_RENAMES.get(key, key)
+                default = "inf" if which == "limits" and key != "gpu" else "0"
+                dst[key] = value + _to_float(src.get(skey, src.get(key, default)))
+    return result
+
+
+def _pod_usage(mRec):
+    """Return the usage of a pod metrics record, summed over its containers, as numbers."""
+    dst = _resources()
+    for container in mRec["containers"]:
+        uRec = container["usage"]
+        for key, value in dst.items():
+            skey = FIELD_RENAMES.get(key, key)
+            dst[key] = value + _to_float(uRec.get(skey, uRec.get(key, "0")))
+    return dst
+
+
+def _add_resources(dst, src):
+    for key, value in src.items():
+        dst[key] += value
+
+
+def _format_node(nodeRec, raw=False):
+    for subset in NODE_SUBSETS:
+        for which in ("requests", "limits", "usage"):
+            dst = nodeRec[subset][which]
+            for key, value in dst.items():
+                dst[key] = _to_raw(value) if raw else _to_text(value)
 
 
 _period_regex = re.compile(r"((?P<weeks>\d+?)w)?((?P<days>\d+?)d)?((?P<hours>\d+?)h)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?")
@@ -204,6 +332,13 @@ class AE5BaseTransformer(object):
         self._session = None
         self._url = url.rstrip("/")
         self._metrics_url = None
+        # An informer which, while fresh, answers pod lookups from memory
+        self.informer = None
+        # Node aggregates which, while fresh, answer node_info from memory
+        self.node_aggregates = None
+        # (expiry, metrics by pod name) of the latest bulk metrics query, and the lock that single-flights it
+        self._metrics = None
+        self._metrics_lock = None
 
     async def connect(self):
         if self._session is None:
@@ -237,6 +372,29 @@ class AE5BaseTransformer(object):
             else:
                 return resp
 
+    async def watch(self, path, **params):
+        """Yield the events of a Kubernetes watch stream on a collection, until the server ends it."""
+        await self.connect()
+        if not path.startswith("/"):
+            path = "/api/v1/" + path
+        url = self._url + path + "?" + urlencode(dict(params, watch="true"))
+        # The server closes the stream after timeoutSeconds, so only guard against a silent connection
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=int(params.get("timeoutSeconds", 300)) + 60)
+        async with self._session.get(url, headers=self._headers, timeout=timeout) as resp:
+            resp.raise_for_status()
+            # Events are newline-delimited; a single pod can exceed the line limit of readline
+            buffer = bytearray()
+            async for chunk in resp.content.iter_any():
+                buffer.extend(chunk)
+                while True:
+                    end = buffer.find(b"\n")
+                    if end < 0:
+                        break
+                    line = bytes(buffer[:end])
+                    del buffer[: end + 1]
+                    if line.strip():
+                        yield json.loads(line)
+
 
 class AE5K8STransformer(AE5BaseTransformer):
     async def metrics_url(self):
@@ -250,20 +408,42 @@ class AE5K8STransformer(AE5BaseTransformer):
                 self._metrics_url = ""
         return self._metrics_url
 
-    async def _pod_info(self, id, return_exceptions=False):
+    async def metrics_snapshot(self):
+        """Return the metrics of every pod in the namespace, as a dict of metrics records by pod name.
+
+        The list is fetched with a single bulk query and shared for METRICS_TTL
+        seconds. Concurrent callers that find it expired wait for one refresh.
+        """
+        if self._metrics is not None and time.monotonic() < self._metrics[0]:
+            return self._metrics[1]
+        if self._metrics_lock is None:
+            self._metrics_lock = asyncio.Lock()
+        async with self._metrics_lock:
+            if self._metrics is None or time.monotonic() >= self._metrics[0]:
+                url = await self.metrics_url()
+                resp = await self.get(url, ok404=True, ok403=True) if url else None
+                metrics = {mRec["metadata"]["name"]: mRec for mRec in (resp["items"] if resp else ())}
+                self._metrics = (time.monotonic() + METRICS_TTL, metrics)
+            return self._metrics[1]
+
+    async def _pod_info(self, id, return_exceptions=False, raw=False):
         if not re.match(r"[a-f0-9]{2}-[a-f0-9]{32}", id) or not id.startswith(("a1", "a2")):
             return _or_raise(ValueError(f"Invalid ID: {id}"), return_exceptions)
+        informer = self.informer
+        if informer is not None and informer.fresh():
+            pod = informer.get(id)
+            # A pod created within the watch latency is not indexed yet, so a
+            # miss falls through to the label queries
+            if pod is not None:
+                return _k8s_pod_to_record(pod, raw)
         prefix, slug = id.split("-", 1)
-        if prefix == "a1":
-            queries = (f"anaconda-session-id={slug}", f"session-id={slug}")
-        else:
-            queries = (f"app-id={slug}", f"anaconda-app-id={slug}", f"job-id={slug}", f"job-name=anaconda-job-{slug}")
+        queries = [f"{label}={vprefix}{slug}" for lprefix, label, vprefix in ID_LABELS if lprefix == prefix]
         for query in queries:
             query = urlencode({"labelSelector": query, "limit": 1})
             path = f"namespaces/{self._ns}/pods?{query}"
             resp1 = await self.get(path)
             if isinstance(resp1, dict) and resp1.get("items"):
-                return _k8s_pod_to_record(resp1["items"][0])
+                return _k8s_pod_to_record(resp1["items"][0], raw)
         else:
             return _or_raise(KeyError(f"Pod not found: {id}"), return_exceptions)
 
@@ -329,22 +509,26 @@ class AE5K8STransformer(AE5BaseTransformer):
                 result["mtime"] = max(result.get("mtime") or "", line.split()[0])
         return result
 
-    async def pod_info(self, id, return_exceptions=False):
+    async def pod_info(self, id, return_exceptions=False, raw=False):
+        """Return the record of a pod, or of each of a list of pods.
+
+        Quantities are formatted as text, such as "1.234Gi" or "250m", unless raw
+        is true, in which case they are numbers of bytes and cores, and
+        unbounded limits are None.
+        """
         if isinstance(id, list):
-            return await asyncio.gather(*(self.pod_info(t) for t in id), return_exceptions=return_exceptions)
-        nrec = await self._pod_info(id, return_exceptions=return_exceptions)
+            return await asyncio.gather(*(self.pod_info(t, raw=raw) for t in id), return_exceptions=return_exceptions)
+        nrec = await self._pod_info(id, return_exceptions=return_exceptions, raw=raw)
         if isinstance(nrec, Exception):
             return nrec
         name = nrec["name"]
-        url = await self.metrics_url()
         # self._pod_changes is not working and it's not clear how long that has been the case.
         # for now we are skipping it. It relies on _pod_exec and websockets. To debug it, put
         # the original gather code back.
-        resp2 = self.get(f"{url}/{name}", ok404=True, ok403=True) if url else self._none()
+        resp2 = (await self.metrics_snapshot()).get(name)
         # resp3 = self._none() if id.startswith("a2-") else self._pod_changes(nrec)
-        # resp2, resp3 = await asyncio.gather(resp2, resp3)
-        resp2, resp3 = await resp2, None
-        _pod_merge_metrics(nrec, resp2)
+        resp3 = None
+        _pod_merge_metrics(nrec, resp2, raw)
         if resp3 is not None:
             nrec["changes"] = resp3
         return nrec
@@ -380,72 +564,38 @@ class AE5K8STransformer(AE5BaseTransformer):
     async def _none(self):
         return None
 
-    async def node_info(self):
-        resp1 = self.get("nodes")
-        resp2 = self.get("pods")
-        url = await self.metrics_url()
-        resp3 = self.get(url) if url else self._empty_list()
-        resp1, resp2, resp3 = await asyncio.gather(resp1, resp2, resp3)
-        resp1, resp2, resp3 = resp1["items"], resp2["items"], resp3["items"]
+    async def node_info(self, raw=False):
+        """Return the records of the nodes, with quantities formatted as for pod_info."""
+        aggregates = self.node_aggregates
+        if aggregates is not None and aggregates.fresh():
+            return aggregates.node_records(raw)
+        resp1, resp2, resp3 = await asyncio.gather(self.get("nodes"), self.get("pods"), self.metrics_snapshot())
+        resp1, resp2 = resp1["items"], resp2["items"]
 
         nodeMap = {}
         nodeList = []
-        subsets = ("total", "sessions", "deployments", "middleware", "system")
-        whiches = ("requests", "limits", "usage")
         for rec in resp1:
-            nodeRec = {
-                "name": rec["metadata"]["name"],
-                "role": rec["metadata"]["labels"]["role"],
-                "capacity": {
-                    "pods": rec["status"]["allocatable"]["pods"],
-                    "mem": _to_text2(rec["status"]["allocatable"]["memory"]),
-                    "cpu": rec["status"]["allocatable"]["cpu"],
-                    "gpu": rec["status"]["allocatable"].get("nvidia.com/gpu", "0"),
-                },
-                "ready": any(c["type"] == "Ready" and c["status"] == "True" for c in rec["status"]["conditions"]),
-                "conditions": [c["type"] for c in rec["status"]["conditions"] if c["type"] != "Ready" and c["status"] == "True"],
-                "timestamp": None,
-                "window": None,
-            }
-            for subset in subsets:
-                srec = nodeRec[subset] = {"pods": 0, "pending": 0}
-                for which in whiches:
-                    srec[which] = {"mem": 0, "cpu": 0, "gpu": 0}
+            nodeRec = _node_record(rec, raw)
             nodeMap[nodeRec["name"]] = nodeRec
             nodeList.append(nodeRec)
 
         podMap = {}
         for pod in resp2:
-            nodeName = pod["spec"]["nodeName"]
-            phase = pod["status"]["phase"]
-            if phase in ("Failed", "Succeeded") or nodeName not in nodeMap:
+            placement = _pod_placement(pod)
+            if placement is None or placement[0] not in nodeMap:
                 continue
-            pfld = "pending" if phase == "Pending" else "pods"
-            podName = pod["metadata"]["name"]
-            if podName.startswith("anaconda-session"):
-                t_sub = "sessions"
-            elif podName.startswith("anaconda-app"):
-                t_sub = "deployments"
-            elif podName.startswith("anaconda-"):
-                t_sub = "middleware"
-            else:
-                t_sub = "system"
+            nodeName, t_sub, pfld = placement
             nodeRec = nodeMap[nodeName]
-            podMap[podName] = [nodeRec, t_sub]
+            podMap[pod["metadata"]["name"]] = [nodeRec, t_sub]
+            resources = _pod_resources(pod)
             for subset in ("total", t_sub):
                 subRec = nodeRec[subset]
                 subRec[pfld] += 1
-                for container in pod["spec"]["containers"]:
-                    for which in ("requests", "limits"):
-                        src = container["resources"].get(which, {})
-                        dst = subRec[which]
-                        for key, value in dst.items():
-                            skey = FIELD_RENAMES.get(key, key)
-                            default = "inf" if which == "limits" and key != "gpu" else "0"
-                            dst[key] = value + _to_float(src.get(skey, src.get(key, default)))
+                for which in ("requests", "limits"):
+                    _add_resources(subRec[which], resources[which])
                 subRec["usage"]["gpu"] = subRec["requests"]["gpu"]
 
-        for pod in resp3:
+        for pod in resp3.values():
             podName = pod["metadata"]["name"]
             if podName in podMap:
                 nodeRec, t_sub = podMap[podName]
@@ -453,21 +603,12 @@ class AE5K8STransformer(AE5BaseTransformer):
                     nodeRec["window"] = pod["window"]
                 if nodeRec["timestamp"] is None:
                     nodeRec["timestamp"] = pod["timestamp"]
+                usage = _pod_usage(pod)
                 for subset in ("total", t_sub):
-                    subRec = nodeRec[subset]
-                    dst = subRec["usage"]
-                    for container in pod["containers"]:
-                        uRec = container["usage"]
-                        for key, value in dst.items():
-                            skey = FIELD_RENAMES.get(key, key)
-                            dst[key] += _to_float(uRec.get(skey, uRec.get(key, "0")))
+                    _add_resources(nodeRec[subset]["usage"], usage)
 
         for nodeRec in nodeList:
-            for subset in subsets:
-                for which in whiches:
-                    dst = nodeRec[subset][which]
-                    for key, value in dst.items():
-                        dst[key] = _to_text(value)
+            _format_node(nodeRec, raw)
 
         return nodeList
 
@@ -0,0 +1,75 @@
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+def atomic_save(filename, save):
+    """Write a session file without exposing partially written contents.
+
+    The save callable is given the name of a temporary file in the same
+    directory; once it returns, the file is made private and atomically
+    renamed over the original. Concurrent readers, in this process or
+    another, therefore see either the old or the new contents.
+    """
+    dirname = os.path.dirname(filename)
+    os.makedirs(dirname, mode=0o700, exist_ok=True)
+    # The leading dot keeps the temporary file out of the config listing.
+    fd, tmpname = tempfile.mkstemp(prefix="." + os.path.basename(filename) + ".", dir=dirname)
+    os.close(fd)
+    try:
+        save(tmpname)
+        os.chmod(tmpname, 0o600)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """Hold an exclusive lock, shared between processes, on behalf of a state file.
+
+    The lock is taken on a companion file, whose name is that of the state
+    file with a leading dot and a ".lock" suffix. On platforms without fcntl
+    the lock is a no-op.
+    """
+    dirname, basename = os.path.split(filename)
+    os.makedirs(dirname, mode=0o700, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(dirname, f".{basename}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def load_snapshot(filename, ttl):
+    """Return the data saved in a JSON snapshot, or None if it is missing, unreadable, or older than ttl seconds."""
+    try:
+        with open(filename, "r") as fp:
+            snapshot = json.load(fp)
+        if 0 <= time.time() - snapshot["created"] < ttl:
+            return snapshot["data"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_snapshot(filename, data):
+    """Save data, with the current time, to a private JSON snapshot file."""
+
+    def _dump(fname):
+        with open(fname, "w") as fp:
+            json.dump({"created": time.time(), "data": data}, fp)
+
+    atomic_save(filename, _dump)
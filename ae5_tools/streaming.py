@@ -0,0 +1,150 @@
+import binascii
+import os
+import queue
+import threading
+
+# Size of the chunks in which generated upload content is passed to the network
+UPLOAD_CHUNK_SIZE = int(os.environ.get("AE5_UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+# Maximum number of chunks buffered between the producer and the network
+UPLOAD_QUEUE_DEPTH = int(os.environ.get("AE5_UPLOAD_QUEUE_DEPTH", "8"))
+
+_DONE = object()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _QueueWriter(object):
+    """A write-only file object that passes its content to a queue in chunks."""
+
+    def __init__(self, queue, cancelled):
+        self._queue = queue
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= UPLOAD_CHUNK_SIZE:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+        self.put(_DONE)
+
+    def put(self, item):
+        # Wait for room in the queue, but give up if the consumer has gone away
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise _Cancelled()
+
+
+def iter_produced(produce):
+    """Run produce(fp) on a background thread, yielding the bytes it writes to fp.
+
+    At most UPLOAD_QUEUE_DEPTH chunks of UPLOAD_CHUNK_SIZE bytes are buffered
+    at any time, so memory use is bounded regardless of the size of the output.
+    An exception raised by produce is re-raised in the consuming thread, and
+    the producer is stopped if the consumer abandons the iteration.
+    """
+    chunks = queue.Queue(UPLOAD_QUEUE_DEPTH)
+    cancelled = threading.Event()
+
+    def _run():
+        writer = _QueueWriter(chunks, cancelled)
+        try:
+            produce(writer)
+            writer.finish()
+        except _Cancelled:
+            pass
+        except BaseException as exc:
+            try:
+                writer.put((_DONE, exc))
+            except _Cancelled:
+                pass
+
+    thread = threading.Thread(target=_run, name="ae5-upload-producer", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, tuple):
+                raise item[1]
+            yield item
+    finally:
+        cancelled.set()
+        thread.join()
+
+
+def _quote(value):
+    # The same escaping applied by urllib3 to multipart header parameters
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartBody(object):
+    """A multipart/form-data request body that is generated while it is sent.
+
+    The body consists of a set of form fields followed by a single file part,
+    laid out exactly as requests would encode them. The file content may be
+    supplied as bytes, as the path of a file, or as a callable that writes the
+    content to a file object; a callable is run on a producer thread so that,
+    for instance, an archive can be uploaded while it is being created.
+
+    Each iteration over the body starts afresh, so it can be sent again if the
+    request needs to be retried. The body is passed to requests as data, along
+    with the content_type header. When the size of the content is known in
+    advance the body has a len, and is sent with a Content-Length header;
+    otherwise it is sent with chunked transfer encoding.
+    """
+
+    def __init__(self, fields, name, filename, source):
+        self.boundary = binascii.hexlify(os.urandom(16)).decode()
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        parts = []
+        for key, value in fields.items():
+            parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(key)}"\r\n\r\n{value}\r\n')
+        parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"; filename="{_quote(filename)}"\r\n\r\n')
+        self._head = "".join(parts).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._source = source
+
+    @property
+    def len(self):
+        if isinstance(self._source, bytes):
+            size = len(self._source)
+        elif isinstance(self._source, str):
+            size = os.path.getsize(self._source)
+        else:
+            return None
+        return len(self._head) + size + len(self._tail)
+
+    def _iter_source(self):
+        if isinstance(self._source, bytes):
+            yield self._source
+        elif isinstance(self._source, str):
+            with open(self._source, "rb") as fp:
+                while True:
+                    chunk = fp.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+        else:
+            yield from iter_produced(self._source)
+
+    def __iter__(self):
+        yield self._head
+        yield from self._iter_source()
+        yield self._tail
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import random
+import time
+
+# Delay before the first poll of a pending operation, in seconds
+WAIT_INITIAL_INTERVAL = float(os.environ.get("AE5_WAIT_INITIAL_INTERVAL", "0.5"))
+# Longest delay between polls, in seconds
+WAIT_MAX_INTERVAL = float(os.environ.get("AE5_WAIT_MAX_INTERVAL", "5"))
+# Factor by which the delay grows after each poll
+WAIT_BACKOFF = float(os.environ.get("AE5_WAIT_BACKOFF", "1.5"))
+# Random variation applied to each delay, as a fraction of it
+WAIT_JITTER = float(os.environ.get("AE5_WAIT_JITTER", "0.1"))
+# Overall limit on a wait, in seconds. Zero means no limit.
+WAIT_TIMEOUT = float(os.environ.get("AE5_WAIT_TIMEOUT", "0"))
+
+
+class Backoff(object):
+    """A schedule of polling delays, with exponential backoff, jitter, and a deadline.
+
+    The deadline is measured from the creation of the schedule; once it has
+    passed, next_delay raises TimeoutError. The final delay is shortened so
+    that the last poll happens at the deadline.
+    """
+
+    def __init__(self, initial=None, maximum=None, factor=None, jitter=None, timeout=None):
+        self._delay = WAIT_INITIAL_INTERVAL if initial is None else initial
+        self.maximum = WAIT_MAX_INTERVAL if maximum is None else maximum
+        self.factor = WAIT_BACKOFF if factor is None else factor
+        self.jitter = WAIT_JITTER if jitter is None else jitter
+        timeout = WAIT_TIMEOUT if timeout is None else timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def next_delay(self):
+        """Return the time to wait before the next poll."""
+        delay = self._delay * (1 + random.uniform(-self.jitter, self.jitter))
+        self._delay = min(self._delay * self.factor, self.maximum)
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Deadline exceeded")
+            delay = min(delay, remaining)
+        return delay
+
+
+def _update(pending, states, done):
+    # Record the new states, and return the keys that are still pending
+    pending.update((key, state) for key, state in states.items() if key in pending)
+    return [key for key, state in pending.items() if not done(state)]
+
+
+def _timeout(keys):
+    return TimeoutError(f'Timed out waiting for {", ".join(str(key) for key in keys)}')
+
+
+def wait_for(states, fetch, done, backoff=None):
+    """Poll a set of pending operations until all of them are done.
+
+    Rather than polling each operation separately, the operations that are
+    still pending are checked together, with a single call to fetch per poll.
+
+    Parameters
+    ----------
+    states: dict
+        The current state of each operation, keyed by an identifier.
+    fetch: callable
+        Called with a list of the identifiers of the pending operations. It
+        returns a dict of their new states; operations that are missing from
+        it remain pending.
+    done: callable
+        Called with the state of an operation, returning True once it is done.
+    backoff: Backoff, optional
+        The polling schedule. By default, a new schedule with the settings
+        given by the AE5_WAIT_* environment variables is used.
+
+    Returns
+    -------
+    A dict of the final states, keyed by identifier. TimeoutError is raised
+    if the deadline of the schedule passes first.
+    """
+    backoff = backoff or Backoff()
+    states = dict(states)
+    keys = _update(states, {}, done)
+    while keys:
+        try:
+            time.sleep(backoff.next_delay())
+        except TimeoutError:
+            raise _timeout(keys) from None
+        keys = _update(states, fetch(keys), done)
+    return states
+
+
+async def async_wait_for(states, fetch, done, backoff=None):
+    """The asynchronous equivalent of wait_for, where fetch is a coroutine function."""
+    backoff = backoff or Backoff()
+    states = dict(states)
+    keys = _update(states, {}, done)
+    while keys:
+        try:
+            await asyncio.sleep(backoff.next_delay())
+        except TimeoutError:
+            raise _timeout(keys) from None
+        keys = _update(states, await fetch(keys), done)
+    return states
@@ -0,0 +1,27 @@
+"""Micro-benchmarks comparing optimized code paths with their predecessors.
+
+These are not collected by pytest. Run each one as a module, e.g.
+
+    python -m tests.benchmark.bench_filter
+"""
+
+import time
+
+
+def best_of(func, repeat=3):
+    """Return the result of func and the best wall-clock time over repeated calls."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def report(rows):
+    """Print (label, legacy seconds, new seconds) rows with the speedup."""
+    width = max(len(row[0]) for row in rows)
+    print(f'{"case":<{width}}  {"legacy":>9}  {"new":>9}  {"speedup":>7}')
+    for label, old, new in rows:
+        print(f"{label:<{width}}  {old:9.4f}  {new:9.4f}  {old / new:6.1f}x")
@@ -0,0 +1,79 @@
+"""Compare project archive compression throughput with the original tarfile "w|gz".
+
+Usage: python -m tests.benchmark.bench_archiver [SIZE_MB]
+
+A synthetic project tree of SIZE_MB megabytes (default 1024), half text and
+half incompressible binary data, is created in a temporary directory.
+"""
+
+import os
+import random
+import sys
+import tarfile
+from tempfile import TemporaryDirectory
+
+from ae5_tools.archiver import ARCHIVE_COMPRESSION_THREADS, _list_project, create_tar_archive
+
+from . import best_of
+
+FILE_SIZE = 8 * 1024 * 1024
+
+
+class CountingSink(object):
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def legacy_create_tar_archive(project_directory, arcname, fp):
+    with tarfile.open(fileobj=fp, mode="w|gz") as tf:
+        for abspath, relpath in _list_project(project_directory):
+            tf.add(abspath, os.path.join(arcname, relpath))
+
+
+def make_tree(root, size):
+    rng = random.Random(0)
+    words = [bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz", k=rng.randrange(3, 12))) for _ in range(5000)]
+    text = b" ".join(rng.choice(words) for _ in range(FILE_SIZE // 7))[:FILE_SIZE]
+    with open(os.path.join(root, "anaconda-project.yml"), "w") as fp:
+        fp.write("name: benchmark\n")
+    for k in range(max(1, size // FILE_SIZE)):
+        subdir = os.path.join(root, f"dir{k % 16}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, f"file{k}.dat"), "wb") as fp:
+            fp.write(text if k % 2 == 0 else os.urandom(FILE_SIZE))
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 1024 * 1024 * 1024
+    with TemporaryDirectory() as root:
+        make_tree(root, size)
+        cases = [
+            ("legacy tarfile w|gz", lambda fp: legacy_create_tar_archive(root, "project", fp)),
+            ("gz level 6, 1 thread", lambda fp: create_tar_archive(root, "project", fp, "gz", 6, threads=1)),
+            (f"gz level 6, {ARCHIVE_COMPRESSION_THREADS} threads", lambda fp: create_tar_archive(root, "project", fp, "gz", 6)),
+            (f"gz level 1, {ARCHIVE_COMPRESSION_THREADS} threads", lambda fp: create_tar_archive(root, "project", fp, "gz", 1)),
+            ("bz2 level 9", lambda fp: create_tar_archive(root, "project", fp, "bz2")),
+            ("xz level 6", lambda fp: create_tar_archive(root, "project", fp, "xz")),
+        ]
+        print(f"Archiving {size // (1024 * 1024)} MB on {os.cpu_count()} CPUs")
+        print(f'{"case":<24}  {"seconds":>8}  {"MB/s":>7}  {"ratio":>6}')
+        for label, func in cases:
+
+            def run():
+                sink = CountingSink()
+                func(sink)
+                return sink.size
+
+            nbytes, elapsed = best_of(run, repeat=1)
+            print(f"{label:<24}  {elapsed:8.2f}  {size / elapsed / 1048576:7.1f}  {nbytes / size:6.3f}")
+
+
+if __name__ == "__main__":
+    main()
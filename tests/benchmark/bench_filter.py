@@ -0,0 +1,77 @@
+"""Compare the compiled filter engine with the original mask-based evaluation."""
+
+import random
+import re
+
+from ae5_tools.filter import OPS, _str, filter_list_of_dicts
+
+from . import best_of, report
+
+N_RECORDS = 100_000
+
+FILTERS = [
+    "owner=user-1*",
+    "name=project-*7,owner!=user-2",
+    "owner=user-3|owner=user-4|name=*99",
+    "state=started&owner=user-5*|state=stopped",
+    ("owner=user-1*", "id>a0-5"),
+]
+
+
+def legacy_filter_list_of_dicts(records, filter):
+    if not filter or not records:
+        return records
+    mask0 = None
+    rec0 = records[0]
+    if isinstance(filter, str):
+        filter = (filter,)
+    for filt1 in filter or ():
+        mask1 = None
+        for filt2 in filt1.split(","):
+            mask2 = None
+            for filt3 in filt2.split("|"):
+                mask3 = None
+                for filt4 in filt3.split("&"):
+                    parts = re.split(r"(==?|!=|>=?|<=?)", filt4.strip())
+                    if len(parts) != 3:
+                        raise ValueError(f"Invalid filter string: {filt4}\n   Required format: <fieldname><op><value>")
+                    field, op, value = list(map(str.strip, parts))
+                    if field not in rec0:
+                        raise ValueError(f'Invalid filter string: unknown field "{field}"')
+                    mask4 = [OPS[op](_str(rec[field]), value) if field in rec else False for rec in records]
+                    mask3 = mask4 if mask3 is None else [m1 and m2 for m1, m2 in zip(mask3, mask4)]
+                mask2 = mask3 if mask2 is None else [m1 or m2 for m1, m2 in zip(mask2, mask3)]
+            mask1 = mask2 if mask1 is None else [m1 and m2 for m1, m2 in zip(mask1, mask2)]
+        mask0 = mask1 if mask0 is None else [m1 and m2 for m1, m2 in zip(mask0, mask1)]
+    if mask0:
+        records = [rec for rec, flag in zip(records, mask0) if flag]
+    return records
+
+
+def make_records(n):
+    rng = random.Random(0)
+    return [
+        {
+            "id": "a0-%032x" % rng.getrandbits(128),
+            "name": f"project-{k}",
+            "owner": f"user-{rng.randrange(100)}",
+            "state": rng.choice(("started", "stopped", "failed")),
+        }
+        for k in range(n)
+    ]
+
+
+def main():
+    records = make_records(N_RECORDS)
+    rows = []
+    for filter in FILTERS:
+        expected, t_old = best_of(lambda: legacy_filter_list_of_dicts(records, filter))
+        result, t_new = best_of(lambda: filter_list_of_dicts(records, filter))
+        assert result == expected, filter
+        rows.append((str(filter), t_old, t_new))
+    print(f"Filtering {N_RECORDS} records")
+    report(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compare the k8s server's JSON responses with the original indented, uncompressed ones.
+
+Usage: python -m tests.benchmark.bench_k8s_json [NPODS]
+
+NPODS pod records (default 2000), as returned by /pods, are served from an
+in-process aiohttp server and fetched by a client that accepts gzip, as the
+CLI's requests session does. Payload sizes are the bytes on the wire.
+"""
+
+import asyncio
+import json
+import sys
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from ae5_tools.k8s import server
+from ae5_tools.k8s.transformer import _k8s_pod_to_record, _pod_merge_metrics
+
+from . import best_of, report
+
+
+def legacy_json(result, headers=None):
+    text = json.dumps(result, indent=2)
+    return web.Response(text=text, content_type="application/json", headers=headers)
+
+
+def make_records(npods):
+    records = {}
+    for k in range(npods):
+        containers = [
+            {
+                "name": name,
+                "resources": {"requests": {"cpu": "250m", "memory": "512Mi", "nvidia.com/gpu": "0"}, "limits": {"cpu": "2", "memory": "4Gi"}},
+            }
+            for name in ("app", "anaconda-proxy", "anaconda-sync")
+        ]
+        pod = {
+            "metadata": {"name": f"anaconda-app-{k:032x}-7d9f8c6b5-x2x4z"},
+            "spec": {"nodeName": f"node-{k % 20}", "containers": containers},
+            "status": {
+                "phase": "Running",
+                "conditions": [{"lastTransitionTime": "2024-01-01T00:00:00Z"}],
+                "containerStatuses": [
+                    {"name": c["name"], "ready": True, "state": {"running": {"startedAt": "2024-01-01T00:00:00Z"}}, "restartCount": k % 3}
+                    for c in containers
+                ],
+            },
+        }
+        record = _k8s_pod_to_record(pod)
+        usage = {"cpu": f"{k % 900 + 1}m", "memory": f"{k % 3000 + 1}Mi"}
+        _pod_merge_metrics(record, {"window": "30s", "timestamp": "2024-01-01T00:00:30Z", "containers": [{"name": "app", "usage": usage}]})
+        records[f"a2-{k:032x}"] = record
+    return records
+
+
+async def measure(respond, records, nrequests=20):
+    app = web.Application()
+    app.router.add_get("/pods", lambda request: respond(records))
+    # Without decompression, the body read is the payload as sent
+    async with TestServer(app) as test_server, ClientSession(auto_decompress=False) as client:
+        url = test_server.make_url("/pods")
+        loop = asyncio.get_running_loop()
+        best = None
+        for _ in range(nrequests):
+            start = loop.time()
+            async with client.get(url, headers={"Accept-Encoding": "gzip, deflate"}) as resp:
+                body = await resp.read()
+            elapsed = loop.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return len(body), best
+
+
+def main():
+    npods = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    records = make_records(npods)
+
+    old_size, old_latency = asyncio.run(measure(legacy_json, records))
+    new_size, new_latency = asyncio.run(measure(server._json, records))
+    _, old_encode = best_of(lambda: json.dumps(records, indent=2).encode())
+    _, new_encode = best_of(lambda: server._dumps(records))
+
+    encoder = "orjson" if server.orjson is not None else "json"
+    print(f"{npods} pod records; compact encoder: {encoder}")
+    print(f"payload bytes: legacy {old_size}, new {new_size} ({old_size / new_size:.1f}x smaller)")
+    report([("encode", old_encode, new_encode), ("request round trip", old_latency, new_latency)])
+
+
+if __name__ == "__main__":
+    main()
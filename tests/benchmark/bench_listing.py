@@ -0,0 +1,107 @@
+"""Compare project file enumeration with the original os.walk and regex scan.
+
+Usage: python -m tests.benchmark.bench_listing [NFILES]
+
+A synthetic project tree of NFILES files (default 50000), including ignored
+build and cache directories, is created in a temporary directory, along with
+a .projectignore file of typical rules.
+"""
+
+import fnmatch
+import os
+import re
+import sys
+from tempfile import TemporaryDirectory
+
+from ae5_tools.archiver import _list_project
+
+from . import best_of, report
+
+IGNORE_RULES = [
+    "*.pyc",
+    "*.pyo",
+    "*.so",
+    "*.o",
+    "*.tmp",
+    "*~",
+    "__pycache__/",
+    ".ipynb_checkpoints/",
+    "*.egg-info/",
+    "build/",
+    "/dist/",
+    "/envs",
+    ".DS_Store",
+    "node_modules/",
+    "*.log",
+    "tmp*",
+    "/docs/_build/",
+    "*.sw[po]",
+]
+
+
+def legacy_list_project(project_directory):
+    anchors, nonanchors = [".git/"], []
+    with open(os.path.join(project_directory, ".projectignore"), "r") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            pattern = fnmatch.translate(line.lstrip("/"))[4:-3]
+            pattern = re.sub(r"(?<!\\)[.]", "[^/]", pattern)
+            if line.endswith("/"):
+                pattern = pattern + r".*"
+            if line.startswith("/"):
+                anchors.append(pattern)
+            else:
+                nonanchors.append(pattern)
+    nonanchors = "(?:" + "|".join(nonanchors) + ")"
+    anchors.append(r"(?:.*/)?" + nonanchors)
+    regex = re.compile(r"\A(?:" + "|".join(anchors) + r")(?:/.*)?\Z")
+    for root, dirs, files in os.walk(project_directory):
+        filtered_dirs = []
+        for d in dirs:
+            relpath = os.path.relpath(os.path.join(root, d), project_directory)
+            if not regex.match(relpath + "/"):
+                filtered_dirs.append(d)
+        dirs[:] = filtered_dirs
+        for f in files:
+            abspath = os.path.join(root, f)
+            relpath = os.path.relpath(abspath, project_directory)
+            if not regex.match(relpath):
+                yield (abspath, relpath)
+
+
+def make_tree(root, nfiles):
+    with open(os.path.join(root, ".projectignore"), "w") as fp:
+        fp.write("\n".join(IGNORE_RULES) + "\n")
+    for k in range(nfiles):
+        package = f"pkg{k % 20}/sub{k % 97}"
+        kind = k % 10
+        if kind < 6:
+            path = f"{package}/module{k}.py"
+        elif kind == 6:
+            path = f"{package}/__pycache__/module{k}.cpython-311.pyc"
+        elif kind == 7:
+            path = f"build/lib/{package}/module{k}.py"
+        elif kind == 8:
+            path = f"{package}/data{k}.csv"
+        else:
+            path = f"{package}/notes{k}.log"
+        abspath = os.path.join(root, path)
+        os.makedirs(os.path.dirname(abspath), exist_ok=True)
+        open(abspath, "w").close()
+
+
+def main():
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with TemporaryDirectory() as root:
+        make_tree(root, nfiles)
+        expected, old = best_of(lambda: list(legacy_list_project(root)))
+        result, new = best_of(lambda: list(_list_project(root)))
+        assert result == expected
+        print(f"Listing {nfiles} files, {len(expected)} included")
+        report([("walk and match", old, new)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare the user_list role and group merges with the original per-user scans.
+
+Usage: python -m tests.benchmark.bench_realm_merge [NUSERS] [NGROUPS]
+
+A synthetic realm of NUSERS users (default 50000) and NGROUPS groups (default
+500) is generated, with each user a member of a few groups. The original scan
+is quadratic, so it is timed on a sample of users and scaled up.
+"""
+
+import random
+import sys
+
+from ae5_tools.api import AEAdminSession
+
+from . import best_of, report
+
+SAMPLE = 200
+
+
+def legacy_get_user_realm_groups(user, group_maps):
+    user_realm_groups = []
+    for group_name, group_users in group_maps.items():
+        for group_user in group_users:
+            if user["id"] == group_user["id"]:
+                user_realm_groups.append(group_name)
+    return user_realm_groups
+
+
+def legacy_merge_users_with_realm_groups(users, group_maps):
+    for user in users:
+        user["realm_groups"] = legacy_get_user_realm_groups(user, group_maps)
+    return users
+
+
+def make_realm(nusers, ngroups):
+    rng = random.Random(0)
+    users = [{"id": f"{k:08x}-0000-4000-8000-000000000000", "username": f"user{k}"} for k in range(nusers)]
+    group_maps = {f"group-{k}": [] for k in range(ngroups)}
+    names = list(group_maps)
+    for user in users:
+        for name in rng.sample(names, rng.randrange(1, 6)):
+            group_maps[name].append(user)
+    return users, group_maps
+
+
+def main():
+    nusers = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    ngroups = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    users, group_maps = make_realm(nusers, ngroups)
+    session = AEAdminSession("mock-hostname", "mock-username", persist=False)
+    sample = users[:SAMPLE]
+
+    expected, old = best_of(
+        lambda: [u["realm_groups"] for u in legacy_merge_users_with_realm_groups([dict(u) for u in sample], group_maps)], repeat=1
+    )
+    result, new = best_of(lambda: [u["realm_groups"] for u in session._merge_users_with_realm_groups([dict(u) for u in users], group_maps)])
+    assert result[:SAMPLE] == expected
+    memberships = sum(len(members) for members in group_maps.values())
+    print(f"{nusers} users, {ngroups} groups, {memberships} memberships; legacy timed on {SAMPLE} users and scaled")
+    report([("merge realm groups", old * nusers / SAMPLE, new)])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import json
 import os
+import time
 from unittest.mock import MagicMock
 
+import pytest
 import requests
 
-from ae5_tools.api import AEAdminSession, AESessionBase, AEUserSession
+from ae5_tools.api import AEAdminSession, AEException, AESessionBase, AEUserSession
 
 base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
 
@@ -118,3 +120,80 @@ def test_admin_session_gracefully_failures_with_exceeded_retry_count():
     admin_session.session.post = MagicMock(side_effect=[requests.exceptions.RetryError("Boom!")])
     admin_session._connect(password=base_params["password"])
     assert admin_session._sdata == {}
+
+
+def save_token(tmp_path, issued_at, access_token="mock-access", expires_in=300):
+    sdata = {"access_token": access_token, "refresh_token": "mock-refresh", "expires_in": expires_in, "issued_at": issued_at}
+    os.makedirs(tmp_path / "tokens", exist_ok=True)
+    with open(tmp_path / "tokens" / "mock-username@mock-hostname", "w") as fp:
+        json.dump(sdata, fp)
+
+
+def mock_token_post(monkeypatch, status_code=200, access_token="new-access"):
+    response = MagicMock(status_code=status_code)
+    response.json = MagicMock(return_value={"access_token": access_token, "refresh_token": "new-refresh", "expires_in": 300})
+    post = MagicMock(return_value=response)
+    monkeypatch.setattr("requests.Session.post", post)
+    return post
+
+
+def test_admin_session_reuses_valid_token(tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    save_token(tmp_path, time.time() - 100)
+    post = mock_token_post(monkeypatch)
+
+    admin_session = AEAdminSession(**dict(base_params, persist=True))
+
+    assert admin_session.connected
+    assert admin_session.session.headers["Authorization"] == "Bearer mock-access"
+    post.assert_not_called()
+
+
+def test_admin_session_refreshes_expiring_token(tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    save_token(tmp_path, time.time() - 290)
+    post = mock_token_post(monkeypatch)
+
+    admin_session = AEAdminSession(**dict(base_params, persist=True))
+
+    assert admin_session.session.headers["Authorization"] == "Bearer new-access"
+    assert post.call_args.kwargs["data"]["refresh_token"] == "mock-refresh"
+    with open(tmp_path / "tokens" / "mock-username@mock-hostname") as fp:
+        saved = json.load(fp)
+    # The issue time is recorded, so the next process can reuse the token
+    assert saved["access_token"] == "new-access" and time.time() - 5 < saved["issued_at"] <= time.time()
+
+
+def test_admin_session_reauthorize_uses_token_from_another_process(tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    save_token(tmp_path, time.time())
+    post = mock_token_post(monkeypatch)
+    admin_session = AEAdminSession(**dict(base_params, persist=True, password=None))
+    admin_session._password_prompt = MagicMock()
+
+    # The server rejects the token, which another process has already renewed
+    save_token(tmp_path, time.time(), access_token="other-access")
+    admin_session.authorize()
+    assert admin_session.session.headers["Authorization"] == "Bearer other-access"
+
+    # Once that one is rejected too, it is refreshed rather than prompting for a password
+    admin_session.authorize()
+    assert admin_session.session.headers["Authorization"] == "Bearer new-access"
+    post.assert_called_once()
+    admin_session._password_prompt.assert_not_called()
+
+
+def test_admin_session_rejected_refresh_falls_back_to_password(tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    save_token(tmp_path, 0)
+    post = mock_token_post(monkeypatch, status_code=400)
+
+    admin_session = AEAdminSession(**dict(base_params, persist=True))
+    assert not admin_session.connected
+    admin_session._connect = MagicMock()
+    with pytest.raises(AEException, match="Invalid username or password"):
+        admin_session.authorize()
+
+    # The rejected refresh token is not tried a second time
+    post.assert_called_once()
+    admin_session._connect.assert_called_once_with("<PASSWORD>")
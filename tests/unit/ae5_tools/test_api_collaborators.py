@@ -0,0 +1,63 @@
+import random
+import threading
+import time
+
+import pytest
+
+from ae5_tools import AEUserSession
+from ae5_tools.api import MAX_WORKERS, REQUEST_TIMEOUT, AEUnexpectedResponseError
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+
+@pytest.fixture
+def user_session():
+    session = AEUserSession(**base_params)
+    session.connected = True
+    yield session
+    session.connected = False
+
+
+def test_join_collaborators_concurrently_in_order(user_session):
+    records = [{"id": f"a0-{k:04d}", "_record_type": "project"} for k in range(40)]
+    lock = threading.Lock()
+    active, peak, kwargs = [0], [0], []
+
+    def mock_get_records(endpoint, api_kwargs=None):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            kwargs.append(api_kwargs)
+        # Finish out of order
+        time.sleep(random.uniform(0, 0.01))
+        with lock:
+            active[0] -= 1
+        return [{"id": "owner-" + endpoint.split("/")[1]}, {"id": "mock-user"}]
+
+    user_session._get_records = mock_get_records
+    user_session._join_collaborators("projects", records)
+
+    assert [r["collaborators"] for r in records] == [f"owner-{r['id']}, mock-user" for r in records]
+    assert [r["_collaborators"][0]["id"] for r in records] == [f"owner-{r['id']}" for r in records]
+    assert 1 < peak[0] <= MAX_WORKERS
+    assert all(k == {"timeout": REQUEST_TIMEOUT} for k in kwargs)
+
+
+def test_join_collaborators_single_record(user_session):
+    record = {"id": "a2-mock", "_record_type": "deployment"}
+    user_session._get_records = lambda endpoint, api_kwargs=None: [{"id": endpoint}]
+    user_session._join_collaborators("deployments", record)
+    assert record["collaborators"] == "deployments/a2-mock/collaborators"
+
+
+def test_join_collaborators_propagates_errors(user_session):
+    records = [{"id": f"a0-{k}", "_record_type": "project"} for k in range(20)]
+
+    def mock_get_records(endpoint, api_kwargs=None):
+        if endpoint == "projects/a0-3/collaborators":
+            raise AEUnexpectedResponseError("Connection timeout", "get", endpoint)
+        return []
+
+    user_session._get_records = mock_get_records
+    with pytest.raises(AEUnexpectedResponseError, match="Connection timeout"):
+        user_session._join_collaborators("projects", records)
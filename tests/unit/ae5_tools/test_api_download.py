@@ -0,0 +1,69 @@
+import hashlib
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import AEUserSession
+from ae5_tools.api import AEException
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+CHUNKS = [b"a" * 1000, b"b" * 1000, b"c" * 500]
+CONTENT = b"".join(CHUNKS)
+
+
+@pytest.fixture(scope="function")
+def user_session():
+    session = AEUserSession(**base_params)
+    session.connected = True
+    response = MagicMock(status_code=200, headers={"content-type": "application/octet-stream", "content-length": str(len(CONTENT))})
+    response.iter_content.return_value = iter(CHUNKS)
+    session.session = MagicMock()
+    session.session.get.return_value = response
+    yield session
+    session.connected = False
+
+
+def test_download_streams_to_file(user_session, tmp_path):
+    filename = str(tmp_path / "archive.tar.gz")
+    progress = MagicMock()
+
+    nbytes, digest = user_session._download("mock-archive", filename, progress=progress, sha256=True)
+
+    assert nbytes == len(CONTENT)
+    assert digest == hashlib.sha256(CONTENT).hexdigest()
+    assert open(filename, "rb").read() == CONTENT
+    assert [call.args for call in progress.call_args_list] == [(1000, 2500), (2000, 2500), (2500, 2500)]
+    assert user_session.session.get.call_args.kwargs["stream"] is True
+    assert [p.name for p in tmp_path.iterdir()] == ["archive.tar.gz"]
+
+
+def test_download_verifies_sha256(user_session, tmp_path):
+    filename = str(tmp_path / "archive.tar.gz")
+    with pytest.raises(AEException, match="SHA-256 mismatch"):
+        user_session._download("mock-archive", filename, sha256="0" * 64)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_project_download(user_session, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    user_session._revision = MagicMock(return_value={"id": "mock-rev-id", "name": "1.0.0", "_project": {"id": "a0-mock", "name": "mock-project"}})
+
+    filename = user_session.project_download("mock-project", sha256=hashlib.sha256(CONTENT).hexdigest())
+
+    assert filename == "mock-project-1.0.0.tar.gz"
+    assert (tmp_path / filename).read_bytes() == CONTENT
+    assert user_session.session.get.call_args.args[0] == "https://mock-hostname/api/v2/projects/a0-mock/revisions/mock-rev-id/archive"
+
+
+def test_project_download_report(user_session, tmp_path):
+    user_session._revision = MagicMock(return_value={"id": "mock-rev-id", "name": "latest", "_project": {"id": "a0-mock", "name": "mock-project"}})
+    filename = str(tmp_path / "archive.tar.gz")
+
+    # A supplied filename is not returned, unless a report is requested
+    assert user_session.project_download("mock-project", filename=filename) is None
+    user_session.session.get.return_value.iter_content.return_value = iter(CHUNKS)
+    records, columns = user_session.project_download("mock-project", filename=filename, format="table", report=True)
+
+    assert columns == ["field", "value"]
+    assert records == [("filename", filename), ("size", len(CONTENT))]
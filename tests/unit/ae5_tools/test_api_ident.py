@@ -0,0 +1,73 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import AEUserSession
+from ae5_tools.api import AEException, AEUnexpectedResponseError
+from ae5_tools.filter import exact_value
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+PID = "1" * 32
+DID = "a2-" + "2" * 32
+
+
+@pytest.fixture(scope="function")
+def user_session():
+    session = AEUserSession(**base_params)
+    session.deployment_list = MagicMock()
+    yield session
+    session.connected = False
+
+
+def mock_deployment():
+    return {"id": DID, "name": "mock-name", "owner": "mock-owner", "project_url": f"https://mock/projects/{PID}", "endpoint": None}
+
+
+def test_exact_value():
+    assert exact_value(f"id={DID}", "id") == DID
+    assert exact_value(("name=mock-name", f"owner=mock-owner,id=={DID}"), "id") == DID
+    assert exact_value(f"name=x&id={DID}", "id") == DID
+    assert exact_value(f"name=x|id={DID}", "id") is None
+    assert exact_value("id=a2-*", "id") is None
+    assert exact_value(f"id!={DID}", "id") is None
+
+
+def test_ident_record_direct_id(user_session):
+    user_session._get = MagicMock(return_value=mock_deployment())
+
+    record = user_session.deployment_info(DID)
+
+    user_session._get.assert_called_once_with(f"deployments/{DID}")
+    user_session.deployment_list.assert_not_called()
+    assert record["project_id"] == "a0-" + PID
+    assert record["_record_type"] == "deployment"
+
+
+def test_ident_record_direct_id_applies_full_filter(user_session):
+    user_session._get = MagicMock(return_value=mock_deployment())
+    with pytest.raises(AEException, match="No deployments found matching"):
+        user_session._ident_record("deployment", ("owner=someone-else", f"id={DID}"))
+
+
+def test_ident_record_direct_id_not_found(user_session):
+    response = MagicMock(status_code=404, reason="Not Found", headers={}, text="")
+    user_session._get = MagicMock(side_effect=AEUnexpectedResponseError(response, "get", "mock-url"))
+    with pytest.raises(AEException, match=f"No deployments found matching id={DID}"):
+        user_session.deployment_info(DID)
+    user_session.deployment_list.assert_not_called()
+
+
+def test_ident_record_direct_id_falls_back_on_error(user_session):
+    response = MagicMock(status_code=403, reason="Forbidden", headers={}, text="")
+    user_session._get = MagicMock(side_effect=AEUnexpectedResponseError(response, "get", "mock-url"))
+    user_session.deployment_list.return_value = [dict(mock_deployment(), _record_type="deployment")]
+    assert user_session.deployment_info(DID)["id"] == DID
+    user_session.deployment_list.assert_called_once_with(filter=f"id={DID}", collaborators=False, k8s=False)
+
+
+def test_ident_record_wildcards_scan_list(user_session):
+    user_session._get = MagicMock()
+    user_session.deployment_list.return_value = [dict(mock_deployment(), _record_type="deployment")]
+    assert user_session.deployment_info("mock-owner/mock-*")["id"] == DID
+    user_session._get.assert_not_called()
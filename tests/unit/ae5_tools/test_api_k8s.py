@@ -0,0 +1,115 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import AEUserSession
+from ae5_tools.api import K8S_JSON_LIST_MAX, AEUnexpectedResponseError
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+
+def pod(id):
+    return {"phase": "Running", "since": "mock", "restarts": 0, "usage": {"mem": 1, "cpu": 2, "gpu": 0}, "node": "mock-node", "id": id}
+
+
+@pytest.fixture
+def user_session():
+    session = AEUserSession(**base_params)
+    session._k8s_client = MagicMock()
+    yield session
+
+
+def test_join_k8s_chunks_concurrently_in_order(user_session):
+    user_session._k8s_chunk_size = 7
+    threads = set()
+
+    def pod_info(ids):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.01)
+        return [pod(id) if not id.endswith("3") else None for id in ids]
+
+    user_session._k8s_client.pod_info.side_effect = pod_info
+    records = [{"id": f"a1-{k:03d}", "_record_type": "session"} for k in range(50)]
+
+    result = user_session._join_k8s(records)
+
+    assert [r["id"] for r in result] == [r["id"] for r in records if not r["id"].endswith("3")]
+    assert all(r["_k8s"]["id"] == r["id"] and r["node"] == "mock-node" for r in result)
+    assert [len(c.args[0]) for c in user_session._k8s_client.pod_info.call_args_list] == [7] * 7 + [1]
+    assert len(threads) > 1
+
+
+def test_join_k8s_adapts_chunk_size(user_session):
+    calls = []
+
+    def pod_info(ids):
+        calls.append(len(ids))
+        if len(ids) > 30:
+            raise AEUnexpectedResponseError(MagicMock(status_code=413, reason="Request Entity Too Large", headers={}, text=""), "post", "pods")
+        return [pod(id) for id in ids]
+
+    user_session._k8s_client.pod_info.side_effect = pod_info
+    records = [{"id": f"a1-{k:03d}", "_record_type": "session"} for k in range(100)]
+
+    result = user_session._join_k8s(records)
+
+    assert [r["_k8s"]["id"] for r in result] == [r["id"] for r in records]
+    # The rejected request is split in half until it is accepted, and later
+    # requests use the reduced size from the start
+    assert calls[:4] == [100, 50, 25, 25]
+    assert user_session._k8s_chunk_size == 25
+    calls.clear()
+    user_session._join_k8s(records)
+    assert calls == [25, 25, 25, 25]
+
+
+def test_join_k8s_propagates_other_errors(user_session):
+    error = AEUnexpectedResponseError(MagicMock(status_code=500, reason="Server Error", headers={}, text=""), "post", "pods")
+    user_session._k8s_client.pod_info.side_effect = error
+    with pytest.raises(AEUnexpectedResponseError):
+        user_session._join_k8s([{"id": "a1-mock", "_record_type": "session"}, {"id": "a1-mock2", "_record_type": "session"}])
+
+
+def test_join_k8s_stores_numbers(user_session):
+    def pod_info(ids):
+        # Text, as given by k8s endpoints that predate raw quantities, and numbers
+        return [dict(pod(ids[0]), usage={"mem": "1.500Gi", "cpu": "250m", "gpu": "0"}), pod(ids[1])]
+
+    user_session._k8s_client.pod_info.side_effect = pod_info
+    records = [{"id": f"a1-{k:03d}", "_record_type": "session"} for k in range(2)]
+
+    result = user_session._join_k8s(records)
+
+    assert [(r["usage/mem"], r["usage/cpu"], r["usage/gpu"]) for r in result] == [(1.5 * 2**30, 0.25, 0.0), (1, 2, 0)]
+
+
+def test_join_k8s_saves_chunk_size(monkeypatch, tmp_path):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    calls = []
+
+    def pod_info(ids):
+        calls.append(len(ids))
+        if len(ids) > 30:
+            raise AEUnexpectedResponseError(MagicMock(status_code=413, reason="Request Entity Too Large", headers={}, text=""), "post", "pods")
+        return [pod(id) for id in ids]
+
+    records = [{"id": f"a1-{k:03d}", "_record_type": "session"} for k in range(100)]
+    session = AEUserSession(**dict(base_params, persist=True))
+    session._k8s_client = MagicMock()
+    session._k8s_client.pod_info.side_effect = pod_info
+    session._join_k8s(records)
+    assert session._k8s_chunk_size == 25
+
+    # A later session for the same host starts from the learned size
+    calls.clear()
+    session = AEUserSession(**dict(base_params, persist=True))
+    session._k8s_client = MagicMock()
+    session._k8s_client.pod_info.side_effect = pod_info
+    session._join_k8s(records)
+    assert calls == [25, 25, 25, 25]
+
+    # Until the saved size expires
+    monkeypatch.setattr("ae5_tools.api.K8S_CHUNK_SIZE_TTL", 0)
+    assert AEUserSession(**dict(base_params, persist=True))._k8s_chunk_size == K8S_JSON_LIST_MAX
@@ -0,0 +1,126 @@
+import asyncio
+import sys
+import threading
+
+import pytest
+
+from ae5_tools import AEAdminSession, AEAsyncAdminSession
+from ae5_tools.api import KEYCLOAK_PREFETCH
+
+admin_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+
+def legacy_get_paginated(get, path, page_max, **kwargs):
+    # The original sequential implementation
+    records = []
+    limit = kwargs.pop("limit", sys.maxsize)
+    kwargs.setdefault("first", 0)
+    while True:
+        kwargs["max"] = min(page_max, limit)
+        t_records = get(path, params=dict(kwargs))
+        records.extend(t_records)
+        n_records = len(t_records)
+        if n_records < kwargs["max"] or n_records == limit:
+            return records
+        kwargs["first"] += n_records
+        limit -= n_records
+
+
+class MockKeycloak(object):
+    def __init__(self, nrecords, count=None):
+        self.records = [{"id": k, "name": f"record-{k}"} for k in range(nrecords)]
+        self.count = nrecords if count is None else count
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, path, params=None):
+        with self.lock:
+            self.calls.append((path, params))
+        if path.endswith("/count"):
+            return self.count
+        return self.records[params["first"] : params["first"] + params["max"]]
+
+
+@pytest.fixture
+def admin_session(monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.KEYCLOAK_PAGE_MAX", 10)
+    return AEAdminSession(**admin_params)
+
+
+@pytest.mark.parametrize("path", ["users", "events"])
+@pytest.mark.parametrize("nrecords", [0, 5, 10, 11, 95, 100])
+@pytest.mark.parametrize("first, limit", [(0, None), (0, 30), (0, 25), (7, None), (7, 13), (120, None)])
+def test_get_paginated_matches_sequential(admin_session, path, nrecords, first, limit):
+    kwargs = {"first": first} if limit is None else {"first": first, "limit": limit}
+    keycloak = MockKeycloak(nrecords)
+    expected = legacy_get_paginated(keycloak.get, path, 10, type="LOGIN", **kwargs)
+    admin_session._get = keycloak.get
+    assert admin_session._get_paginated(path, type="LOGIN", **kwargs) == expected
+
+
+def test_get_paginated_plans_pages_from_count(admin_session):
+    keycloak = MockKeycloak(95)
+    admin_session._get = keycloak.get
+    assert len(admin_session._get_paginated("users", search="mock")) == 95
+    assert keycloak.calls[0] == ("users/count", {"search": "mock"})
+    # Exactly the ten pages needed, with no empty trailing request
+    assert sorted(params["first"] for _, params in keycloak.calls[1:]) == list(range(0, 100, 10))
+
+
+def test_get_paginated_prefetches_without_count(admin_session):
+    keycloak = MockKeycloak(25)
+    admin_session._get = keycloak.get
+    assert len(admin_session._get_paginated("events")) == 25
+    # A full first page, then a batch of speculative pages
+    assert [params["first"] for _, params in keycloak.calls] == [0] + [k * 10 for k in range(1, KEYCLOAK_PREFETCH + 1)]
+
+
+@pytest.mark.parametrize("count", [0, 40, 200])
+def test_get_paginated_stale_count(admin_session, count):
+    # Records added or removed after the count do not affect the result
+    keycloak = MockKeycloak(57, count=count)
+    admin_session._get = keycloak.get
+    assert admin_session._get_paginated("users") == keycloak.records
+
+
+def test_async_get_paginated(monkeypatch):
+    monkeypatch.setattr("ae5_tools.async_api.KEYCLOAK_PAGE_MAX", 10)
+    keycloak = MockKeycloak(95)
+
+    async def mock_get(path, params=None):
+        return keycloak.get(path, params)
+
+    admin_session = AEAsyncAdminSession(**admin_params)
+    admin_session._get = mock_get
+    assert asyncio.run(admin_session._get_paginated("users")) == keycloak.records
+    assert asyncio.run(admin_session._get_paginated("events", first=3, limit=40)) == keycloak.records[3:43]
+
+
+def test_async_get_paginated_is_bounded(monkeypatch):
+    monkeypatch.setattr("ae5_tools.async_api.KEYCLOAK_PAGE_MAX", 10)
+    monkeypatch.setattr("ae5_tools.async_api.ASYNC_CONCURRENCY", 2)
+    keycloak = MockKeycloak(95)
+    in_flight = {"pages": 0, "users": 0}
+    peak = {"pages": 0, "users": 0}
+
+    async def mock_get(path, params=None):
+        kind = "users" if "role-mappings" in path else "pages"
+        in_flight[kind] += 1
+        peak[kind] = max(peak[kind], in_flight[kind])
+        await asyncio.sleep(0.001)
+        in_flight[kind] -= 1
+        return [] if kind == "users" else keycloak.get(path, params)
+
+    async def run(admin_session):
+        assert await admin_session._get_paginated("users") == keycloak.records
+        assert peak == {"pages": 2, "users": 0}
+        # The memberships of each user are joined under the same bounds, without
+        # the nested page requests waiting on the slots held by their users
+        users = [{"id": k} for k in range(5)]
+        await asyncio.wait_for(admin_session._gather(*(admin_session._join_user_memberships(user) for user in users)), 5)
+        assert all(len(user["realm_groups"]) == 95 for user in users)
+        assert peak == {"pages": 2, "users": 2}
+
+    admin_session = AEAsyncAdminSession(**admin_params)
+    admin_session._get = mock_get
+    asyncio.run(run(admin_session))
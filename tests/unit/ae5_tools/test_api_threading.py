@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import LWPCookieJar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import pytest
+from requests.cookies import create_cookie
+
+from ae5_tools.api import AEUserSession
+from ae5_tools.config import config
+
+N_THREADS = 32
+N_CALLS = 20
+# The server invalidates the login after this many requests, so that
+# every thread runs into an expired session at about the same time.
+ROTATE_AFTER = N_THREADS * N_CALLS // 2
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.lock = threading.Lock()
+        self.token = "token-0"
+        self.served = 0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            valid = f"_xsrf={server.token}" in (self.headers.get("Cookie") or "")
+            if valid:
+                server.served += 1
+                if server.served == ROTATE_AFTER:
+                    server.token = "token-1"
+        if not valid:
+            self.send_response(401)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = MockServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_user_session_shared_across_threads(server):
+    session = AEUserSession("mock-hostname", "mock-username", password="<PASSWORD>", persist=False)
+    session.base = f"http://127.0.0.1:{server.server_address[1]}/api/v2/"
+    logins = []
+
+    def mock_connect(password):
+        # Widen the window in which other threads can pile up on the lock
+        time.sleep(0.05)
+        logins.append(server.token)
+        session.session.cookies.set_cookie(create_cookie("_xsrf", server.token))
+
+    session._connect = mock_connect
+
+    def worker(n):
+        return [session._get(f"projects/{n}-{k}") for k in range(N_CALLS)]
+
+    with ThreadPoolExecutor(N_THREADS) as executor:
+        results = list(executor.map(worker, range(N_THREADS)))
+
+    assert logins == ["token-0", "token-1"]
+    for n, result in enumerate(results):
+        assert result == [{"path": f"/api/v2/projects/{n}-{k}"} for k in range(N_CALLS)]
+    session.connected = False
+
+
+def test_user_session_save_is_atomic(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "_path", str(tmp_path))
+    session = AEUserSession("mock-hostname", "mock-username", password="<PASSWORD>", persist=True)
+    session._disconnect = MagicMock()
+    cookies = session.session.cookies
+
+    def worker(n):
+        for k in range(N_CALLS):
+            cookies.set_cookie(create_cookie(f"cookie-{n}", str(k), domain="mock-hostname"))
+            session._save()
+            jar = LWPCookieJar()
+            jar.load(session._filename, ignore_discard=True)
+
+    with ThreadPoolExecutor(N_THREADS) as executor:
+        list(executor.map(worker, range(N_THREADS)))
+
+    jar = LWPCookieJar()
+    jar.load(session._filename, ignore_discard=True)
+    assert {c.name: c.value for c in jar} == {f"cookie-{n}": str(N_CALLS - 1) for n in range(N_THREADS)}
+    assert [f.name for f in (tmp_path / "cookies").iterdir()] == ["mock-username@mock-hostname"]
+
+
+def test_user_session_k8s_client_created_once(monkeypatch):
+    created = []
+
+    class MockClient:
+        def __init__(self, session, endpoint):
+            time.sleep(0.05)
+            created.append(endpoint)
+
+        def error(self):
+            return None
+
+        def status(self):
+            return "ok"
+
+    monkeypatch.setattr("ae5_tools.api.AE5K8SRemoteClient", MockClient)
+    session = AEUserSession("mock-hostname", "mock-username", password="<PASSWORD>", persist=False)
+
+    with ThreadPoolExecutor(N_THREADS) as executor:
+        results = list(executor.map(lambda _: session._k8s("status"), range(N_THREADS)))
+
+    assert results == ["ok"] * N_THREADS
+    assert created == ["k8s"]
@@ -1,11 +1,14 @@
 import datetime
 import sys
+import threading
+import time
 import uuid
 from unittest.mock import MagicMock
 
 import pytest
 
-from ae5_tools.api import AEAdminSession
+from ae5_tools.api import AEAdminSession, AEException, _user_ident
+from ae5_tools.localstate import load_snapshot
 
 
 @pytest.fixture(scope="function")
@@ -154,7 +157,9 @@ def test_build_realm_role_user_map_multiple_returns(admin_session, generate_raw_
 
     # Set up the test
     admin_session._get_realm_roles = MagicMock(return_value=test_case["realm_roles"])
-    admin_session._get_role_users = MagicMock(side_effect=[test_case["role_users_1"], test_case["role_users_2"], test_case["role_users_3"]])
+    # The roles are fetched concurrently, so the results are keyed by role rather than call order
+    role_users = dict(zip(["ae-admin", "ae-reader", "fake-role"], [test_case["role_users_1"], test_case["role_users_2"], test_case["role_users_3"]]))
+    admin_session._get_role_users = MagicMock(side_effect=lambda role_name: role_users[role_name])
 
     # Execute the test
     role_maps = admin_session._build_realm_role_user_map()
@@ -190,7 +195,7 @@ def test_merge_users_with_realm_roles(admin_session, generate_raw_user_fixture):
         assert result == test_case["expected_results"]
 
         mock = admin_session._get_user_realm_roles
-        mock.assert_called_once_with(user=test_case["users"][0], role_maps=test_case["role_maps"])
+        mock.assert_called_once_with(user=test_case["users"][0], role_maps=test_case["role_maps"], index={})
 
 
 #####################################################
@@ -244,3 +249,219 @@ def test_user_list_roles(admin_session, generate_raw_user_fixture):
 
         mock = admin_session._merge_users_with_realm_roles
         mock.assert_called_once_with(users=(test_case["users"] + test_case["events"]), role_maps=test_case["role_maps"])
+
+
+#####################################################
+# Test Cases For the membership index
+#####################################################
+
+
+def test_merge_users_with_realm_memberships_index(admin_session):
+    users = [{"id": f"user-{k}"} for k in range(6)]
+    maps = {
+        "ae-admin": [users[0], users[3]],
+        "ae-reader": [users[3], users[0], users[3]],
+        "ae-empty": [],
+        "ae-editor": [{"id": "other-user"}, users[5]],
+    }
+    # The same result as scanning every membership of every role for each user
+    expected = [[name for name, members in maps.items() for member in members if member["id"] == user["id"]] for user in users]
+
+    merged = admin_session._merge_users_with_realm_roles(users=[dict(u) for u in users], role_maps=maps)
+    assert [u["realm_roles"] for u in merged] == expected
+    merged = admin_session._merge_users_with_realm_groups(users=[dict(u) for u in users], group_maps=maps)
+    assert [u["realm_groups"] for u in merged] == expected
+    # Each user has a list of its own
+    assert merged[0]["realm_groups"] is not merged[1]["realm_groups"]
+
+
+def test_merge_users_with_realm_roles_concurrently(admin_session, monkeypatch):
+    # Concurrent merges on one session each use their own index, built once
+    from ae5_tools import api
+
+    calls = []
+    invert = api._invert_memberships
+    monkeypatch.setattr(api, "_invert_memberships", lambda maps: calls.append(maps) or invert(maps))
+    users = [{"id": f"user-{k}"} for k in range(200)]
+    barrier = threading.Barrier(4)
+    results = {}
+
+    def merge(n):
+        maps = {f"role-{n}": users[n::4]}
+        barrier.wait()
+        results[n] = admin_session._merge_users_with_realm_roles(users=[dict(u) for u in users], role_maps=maps)
+
+    threads = [threading.Thread(target=merge, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 4
+    for n, merged in results.items():
+        assert [u["realm_roles"] for u in merged] == [[f"role-{n}"] if k % 4 == n else [] for k in range(200)]
+
+
+#####################################################
+# Test Cases For the membership fetches and snapshot
+#####################################################
+
+
+def test_build_realm_group_user_map_concurrently(admin_session):
+    groups = [{"id": f"group-id-{k}", "name": f"group-{k}"} for k in range(12)]
+    threads = set()
+
+    def get_group_members(group_id):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.01)
+        return [{"id": "member-of-" + group_id}]
+
+    admin_session._get_realm_groups = MagicMock(return_value=groups)
+    admin_session._get_group_members = MagicMock(side_effect=get_group_members)
+
+    group_maps = admin_session._build_realm_group_user_map()
+
+    assert list(group_maps) == [g["name"] for g in groups]
+    assert all(group_maps[g["name"]] == [{"id": "member-of-" + g["id"]}] for g in groups)
+    assert len(threads) > 1
+
+
+def test_realm_membership_snapshot(admin_session, tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    monkeypatch.setattr("ae5_tools.api.MEMBERSHIP_SNAPSHOT_TTL", 60)
+    role_maps, group_maps = {"ae-admin": [{"id": "user-1"}]}, {"everyone": [{"id": "user-1"}, {"id": "user-2"}]}
+    admin_session._build_realm_role_user_map = MagicMock(return_value=role_maps)
+    admin_session._build_realm_group_user_map = MagicMock(return_value=group_maps)
+
+    assert admin_session._realm_membership_maps() == (role_maps, group_maps)
+    assert admin_session._realm_membership_maps() == (role_maps, group_maps)
+    # The second call is served from the snapshot
+    admin_session._build_realm_role_user_map.assert_called_once()
+    admin_session._build_realm_group_user_map.assert_called_once()
+
+    filename = admin_session._membership_snapshot()
+    assert filename == str(tmp_path / "snapshots" / "memberships-MOCK-AE-USERNAME@MOCK-HOSTNAME.json")
+    assert load_snapshot(filename, 60) == [role_maps, group_maps]
+    assert load_snapshot(filename, 0) is None
+
+    # A change to the memberships discards the snapshot
+    admin_session.user_info = MagicMock(return_value={"id": "user-2"})
+    admin_session._get_user_role_id = MagicMock(return_value="role-id")
+    admin_session._post = MagicMock()
+    admin_session.user_roles_add(username="user-2", names=["ae-admin"])
+    admin_session._realm_membership_maps()
+    assert admin_session._build_realm_role_user_map.call_count == 2
+
+
+def test_realm_membership_snapshot_disabled(admin_session, tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    admin_session._build_realm_role_user_map = MagicMock(return_value={})
+    admin_session._build_realm_group_user_map = MagicMock(return_value={})
+
+    admin_session._realm_membership_maps()
+    admin_session._realm_membership_maps()
+
+    assert admin_session._build_realm_role_user_map.call_count == 2
+    assert admin_session._membership_snapshot() is None
+    assert not (tmp_path / "snapshots").exists()
+
+
+#####################################################
+# Test Cases For the login cursor
+#####################################################
+
+
+def login(user_id, time, **details):
+    return {"userId": user_id, "time": time, "details": details}
+
+
+def test_post_user_login_cursor(admin_session, tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    day = 86400 * 1000
+    history = [login("user-2", 20 * day), login("user-1", 19 * day, response_mode="mock"), login("user-1", 3 * day), login("user-2", 2 * day)]
+    admin_session._get_paginated = MagicMock(return_value=history)
+
+    users = admin_session._post_user([{"id": "user-1"}, {"id": "user-2"}, {"id": "user-3"}], include_login=True)
+
+    assert [u["lastLogin"] for u in users] == [3 * day, 20 * day, 0]
+    admin_session._get_paginated.assert_called_once_with("events", client="anaconda-platform", type="LOGIN")
+
+    # Later calls only read the events since the latest one seen, a day early
+    admin_session._get_paginated = MagicMock(return_value=[login("user-3", 21 * day), login("user-2", 20 * day)])
+    users = admin_session._post_user([{"id": "user-1"}, {"id": "user-2"}, {"id": "user-3"}], include_login=True)
+
+    assert [u["lastLogin"] for u in users] == [3 * day, 20 * day, 21 * day]
+    admin_session._get_paginated.assert_called_once_with("events", client="anaconda-platform", type="LOGIN", dateFrom="1970-01-20")
+
+
+def test_post_user_without_login_cursor(admin_session, tmp_path, monkeypatch):
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path))
+    admin_session.persist = False
+    admin_session._get_paginated = MagicMock(return_value=[login("user-1", 2000), login("user-1", 1000)])
+
+    assert admin_session._post_user([{"id": "user-1"}], include_login=True)[0]["lastLogin"] == 2000
+    assert admin_session._post_user([{"id": "user-1"}], include_login=True)[0]["lastLogin"] == 2000
+    assert admin_session._get_paginated.call_count == 2
+    assert not (tmp_path / "logins").exists()
+
+    # No events are read when there are no users
+    assert admin_session._post_user([], include_login=True) == []
+    assert admin_session._get_paginated.call_count == 2
+
+
+#####################################################
+# Test Cases For the direct user lookup
+#####################################################
+
+UID = "0b4f5a52-64c3-4d1c-9d0e-8ec2b7a0f3a1"
+
+
+def test_user_ident():
+    assert _user_ident("username=alice|id=alice") == ("alice", None)
+    assert _user_ident(f"username={UID}|id={UID}") == (UID, UID)
+    assert _user_ident(("email=alice@example.com", "username=alice")) == ("alice", None)
+    assert _user_ident(f"id={UID}") == (None, UID)
+    assert _user_ident("username=ali*|id=ali*") == (None, None)
+    assert _user_ident("username=alice|id=bob") == (None, None)
+
+
+def test_user_info_by_username(admin_session):
+    admin_session._get = MagicMock(return_value=[{"id": UID, "username": "alice"}])
+    admin_session._get_paginated = MagicMock()
+
+    record = admin_session.user_info("alice", fast=True)
+
+    assert record["id"] == UID and record["_record_type"] == "user"
+    admin_session._get.assert_called_once_with("users", params={"username": "alice", "exact": "true"})
+    admin_session._get_paginated.assert_not_called()
+
+
+def test_user_info_by_id_with_memberships(admin_session):
+    responses = {
+        f"users/{UID}": {"id": UID, "username": "alice"},
+        f"users/{UID}/role-mappings/realm": [{"name": "ae-admin"}, {"name": "ae-reader"}],
+    }
+    admin_session._get = MagicMock(side_effect=lambda endpoint, **kwargs: responses[endpoint])
+    admin_session._get_paginated = MagicMock(return_value=[{"name": "everyone"}])
+
+    record = admin_session.user_info(UID, include_login=False)
+
+    assert record["realm_roles"] == ["ae-admin", "ae-reader"]
+    assert record["realm_groups"] == ["everyone"]
+    admin_session._get_paginated.assert_called_once_with(f"users/{UID}/groups")
+
+
+def test_user_info_by_username_not_found(admin_session):
+    admin_session._get = MagicMock(return_value=[{"id": UID, "username": "alice2"}])
+    admin_session._get_paginated = MagicMock()
+    with pytest.raises(AEException, match="No users found matching username=alice|id=alice"):
+        admin_session.user_info("alice", fast=True)
+    admin_session._get_paginated.assert_not_called()
+
+
+def test_user_info_wildcard_scans_list(admin_session):
+    admin_session._get = MagicMock()
+    admin_session._get_paginated = MagicMock(return_value=[{"id": UID, "username": "alice"}])
+    assert admin_session.user_info("ali*", fast=True)["id"] == UID
+    admin_session._get.assert_not_called()
+    admin_session._get_paginated.assert_called_once_with("users")
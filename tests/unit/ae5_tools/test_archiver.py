@@ -0,0 +1,113 @@
+import gzip
+import io
+import os
+import random
+import tarfile
+import zlib
+
+import pytest
+
+from ae5_tools.archiver import ArchiveCache, ParallelGzipWriter, create_tar_archive
+
+
+def make_data(size):
+    rng = random.Random(0)
+    words = [bytes(rng.choices(b"abcdefghij", k=rng.randrange(2, 10))) for _ in range(200)]
+    return b" ".join(rng.choice(words) for _ in range(size // 6))[:size]
+
+
+@pytest.mark.parametrize("size", [0, 1, 1000, 65536, 300000])
+def test_parallel_gzip_roundtrip(size):
+    data = make_data(size)
+    fp = io.BytesIO()
+    writer = ParallelGzipWriter(fp, level=6, threads=4, block_size=65536)
+    # Uneven writes, so blocks straddle write boundaries
+    for k in range(0, len(data), 7777):
+        writer.write(data[k : k + 7777])
+    writer.close()
+    output = fp.getvalue()
+
+    assert gzip.decompress(output) == data
+    # A single gzip member, with a reproducible header
+    dobj = zlib.decompressobj(31)
+    assert dobj.decompress(output) == data and dobj.eof and not dobj.unused_data
+    assert output[4:8] == b"\x00\x00\x00\x00"
+
+
+def test_parallel_gzip_uses_dictionary():
+    # Repeats that span block boundaries only compress well if each
+    # block is primed with the preceding input
+    data = os.urandom(16384) * 32
+    fp = io.BytesIO()
+    writer = ParallelGzipWriter(fp, level=6, threads=4, block_size=16384)
+    writer.write(data)
+    writer.close()
+    assert len(fp.getvalue()) < 2 * 16384
+
+
+@pytest.fixture
+def project_dir(tmp_path):
+    project = tmp_path / "project"
+    (project / "data").mkdir(parents=True)
+    (project / "anaconda-project.yml").write_text("name: mock-project\n")
+    (project / "data" / "values.csv").write_bytes(make_data(200000))
+    return str(project)
+
+
+@pytest.mark.parametrize("compression, threads", [("gz", 1), ("gz", 4), ("bz2", None), ("xz", None)])
+def test_create_tar_archive(project_dir, compression, threads):
+    fp = io.BytesIO()
+    create_tar_archive(project_dir, "project", fp, compression=compression, level=1, threads=threads)
+    fp.seek(0)
+    with tarfile.open(fileobj=fp, mode=f"r:{compression}") as tf:
+        assert sorted(tf.getnames()) == ["project/anaconda-project.yml", "project/data/values.csv"]
+        assert tf.extractfile("project/data/values.csv").read() == make_data(200000)
+
+
+def test_create_tar_archive_invalid_compression(project_dir):
+    with pytest.raises(ValueError, match="Unsupported archive compression"):
+        create_tar_archive(project_dir, "project", io.BytesIO(), compression="zip")
+
+
+def produce(source):
+    fp = io.BytesIO()
+    source(fp)
+    return fp.getvalue()
+
+
+def test_archive_cache_reuses_unchanged_project(project_dir, tmp_path):
+    cache = ArchiveCache(str(tmp_path / "archives"))
+    source = cache.source(project_dir, "project", "gz", 1)
+    assert callable(source)
+    data = produce(source)
+
+    # The archive is cached as it is produced, and reused while the project is unchanged
+    cached = cache.source(project_dir, "project", "gz", 1)
+    assert isinstance(cached, str) and open(cached, "rb").read() == data
+    with tarfile.open(cached, "r:gz") as tf:
+        assert all(m.mtime == 0 and m.uid == 0 and m.uname == "" for m in tf.getmembers())
+    # Different settings, or a modified file, need a new archive
+    assert callable(cache.source(project_dir, "project", "xz", 1))
+    with open(os.path.join(project_dir, "data", "values.csv"), "ab") as fp:
+        fp.write(b"more")
+    assert callable(cache.source(project_dir, "project", "gz", 1))
+
+
+def test_archive_cache_is_deterministic(project_dir, tmp_path):
+    # With content hashing, a touched file still matches, and the archive is identical
+    cache = ArchiveCache(str(tmp_path / "archives"), content_hash=True)
+    data = produce(cache.source(project_dir, "project", "gz", 1))
+    os.utime(os.path.join(project_dir, "anaconda-project.yml"), (1, 1))
+    assert isinstance(cache.source(project_dir, "project", "gz", 1), str)
+    cache.clear()
+    assert produce(cache.source(project_dir, "project", "gz", 1)) == data
+
+
+def test_archive_cache_evicts_least_recently_used(project_dir, tmp_path):
+    cache = ArchiveCache(str(tmp_path / "archives"), max_size=0)
+    produce(cache.source(project_dir, "project", "gz", 1))
+    first = cache.source(project_dir, "project", "gz", 1)
+    produce(cache.source(project_dir, "project", "bz2", 1))
+    # The newest archive is kept even though it exceeds the limit
+    assert not os.path.exists(first)
+    assert [entry.name.endswith(".tar.bz2") for entry in cache._entries()] == [True]
@@ -0,0 +1,232 @@
+import fnmatch
+import os
+import random
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from ae5_tools.archiver import _ignore_rules, _IgnoreMatcher, _list_project
+
+has_git = shutil.which("git") is not None
+
+
+def legacy_list_project(project_directory):
+    # The original implementation, which the fast enumeration must match exactly
+    anchors, nonanchors = [".git/"], []
+
+    gitdir = os.path.join(project_directory, ".git")
+    if os.path.exists(gitdir):
+        output = subprocess.check_output(["git", "ls-files", "--others", "--ignored", "--exclude-standard", "--directory"], cwd=project_directory)
+        anchors.extend(output.decode("utf-8").splitlines())
+
+    igfile = os.path.join(project_directory, ".projectignore")
+    if os.path.exists(igfile):
+        with open(igfile, "r") as fp:
+            for line in fp:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith(r"\#"):
+                    line = line[1:]
+                pattern = fnmatch.translate(line.lstrip("/"))[4:-3]
+                pattern = re.sub(r"(?<!\\)[.]", "[^/]", pattern)
+                if line.endswith("/"):
+                    pattern = pattern + r".*"
+                if line.startswith("/"):
+                    anchors.append(pattern)
+                else:
+                    nonanchors.append(pattern)
+
+    if anchors or nonanchors:
+        if nonanchors:
+            nonanchors = nonanchors[0] if len(nonanchors) == 1 else "(?:" + "|".join(nonanchors) + ")"
+            anchors.append(r"(?:.*/)?" + nonanchors)
+        anchors = anchors[0] if len(anchors) == 1 else "(?:" + "|".join(anchors) + ")"
+        pattern = r"\A" + anchors + r"(?:/.*)?\Z"
+    else:
+        pattern = "^$"
+    regex = re.compile(pattern)
+
+    for root, dirs, files in os.walk(project_directory):
+        filtered_dirs = []
+        for d in dirs:
+            abspath = os.path.join(root, d)
+            relpath = os.path.relpath(abspath, project_directory)
+            if not regex.match(relpath + "/"):
+                filtered_dirs.append(d)
+        dirs[:] = filtered_dirs
+        for f in files:
+            abspath = os.path.join(root, f)
+            relpath = os.path.relpath(abspath, project_directory)
+            if not regex.match(relpath):
+                yield (abspath, relpath)
+
+
+IGNORE_RULES = """
+# comment
+\\#hash
+*.pyc
+__pycache__/
+build
+/dist
+/docs/_build/
+.ipynb_checkpoints/
+*.egg-info/
+tmp*
+*~
+data/raw
+/notes.txt
+a?c
+[xy]z
+*.log.*
+*/deep
+file.dat
+*foo*
+.hidden
+"""
+
+PATHS = [
+    "anaconda-project.yml",
+    "#hash",
+    "main.py",
+    "main.pyc",
+    "mainXpyc",
+    "pkg/__pycache__/mod.pyc",
+    "pkg/__pycache___/mod.py",
+    "pkg/mod.py",
+    "pkg/build/out.o",
+    "pkg/building/out.o",
+    "build",
+    "dist/a.whl",
+    "pkg/dist/a.whl",
+    "docs/_build/index.html",
+    "docs/_build",
+    "pkg/docs/_build/index.html",
+    "nb/.ipynb_checkpoints/x.ipynb",
+    "nb/Xipynb_checkpoints/x.ipynb",
+    "mypkg.egg-info/PKG-INFO",
+    "mypkg.egg-info.txt",
+    "tmpfile",
+    "pkg/tmpdir/x",
+    "atmp",
+    "backup~",
+    "data/raw/x.csv",
+    "data/rawer/x.csv",
+    "pkg/data/raw",
+    "notes.txt",
+    "notesXtxt",
+    "pkg/notes.txt",
+    "abc",
+    "a/c",
+    "xz",
+    "pkg/yz",
+    "server.log.1",
+    "server.log",
+    "x/deep",
+    "deep",
+    "file.dat",
+    "fileXdat",
+    "barfoobaz",
+    ".hidden",
+    "xhidden",
+    "pkg/xhidden/y",
+]
+
+
+def make_tree(root, paths):
+    for path in paths:
+        abspath = os.path.join(root, path)
+        os.makedirs(os.path.dirname(abspath), exist_ok=True)
+        if not os.path.isdir(abspath):
+            with open(abspath, "w") as fp:
+                fp.write(path)
+
+
+def assert_parity(root, **kwargs):
+    expected = list(legacy_list_project(root))
+    assert list(_list_project(root, **kwargs)) == expected
+    return expected
+
+
+def test_listing_matches_legacy(tmp_path):
+    root = str(tmp_path)
+    make_tree(root, PATHS)
+    (tmp_path / ".projectignore").write_text(IGNORE_RULES)
+    listed = [relpath for _, relpath in assert_parity(root)]
+    assert "main.py" in listed and "main.pyc" not in listed
+
+
+def test_listing_matches_legacy_with_links_and_odd_names(tmp_path):
+    root = str(tmp_path)
+    make_tree(root, ["real/file.txt", "a\nb/file.txt", "name\nwith newline", "sp ace/(x).txt", "x.git/y", "xgit/y"])
+    os.symlink(os.path.join(root, "real"), os.path.join(root, "linkdir"))
+    os.symlink(os.path.join(root, "real", "file.txt"), os.path.join(root, "linkfile"))
+    os.symlink(os.path.join(root, "missing"), os.path.join(root, "dangling"))
+    (tmp_path / ".projectignore").write_text("b\n(x).txt\n/a?b/\n")
+    assert_parity(root)
+
+
+def test_listing_without_rules(tmp_path):
+    make_tree(str(tmp_path), PATHS)
+    assert_parity(str(tmp_path))
+    assert list(_list_project(str(tmp_path / "missing"))) == []
+
+
+def test_listing_matches_legacy_randomized(tmp_path):
+    rng = random.Random(1234)
+    names = ["a", "b", "ab", "a.b", "aXb", "build", "cache", "x.py", "x.pyc", ".env", "tmp1", "data", "log.txt"]
+    rules = ["*.pyc", "build/", "/data", "/a/b", "tmp*", "*.txt", "ab", "/cache/", "a.b", "a?b", "*b/", "[ab]", "x.*", "/.env", "*/ab", "c*e"]
+    for trial in range(20):
+        root = tmp_path / f"trial{trial}"
+        paths = ["/".join(rng.choice(names) for _ in range(rng.randrange(1, 5))) for _ in range(60)]
+        # Leaf files only, so no path is both a file and a directory
+        paths = [p for p in paths if not any(q.startswith(p + "/") for q in paths)]
+        make_tree(str(root), paths)
+        (root / ".projectignore").write_text("\n".join(rng.sample(rules, rng.randrange(0, len(rules)))))
+        assert_parity(str(root))
+
+
+def test_matcher_indexes_simple_rules(tmp_path):
+    (tmp_path / ".projectignore").write_text("*.pyc\nbuild/\n/dist\ntmp*\n[ab]c\n")
+    matcher = _IgnoreMatcher(_ignore_rules(str(tmp_path)))
+    assert matcher.fast
+    # Only the character set needs a regular expression
+    assert matcher.complex.pattern == r"\A(?:.*/)?[ab]c(?:/.*)?\Z"
+    assert matcher.match_file("pkg/mod.pyc", "mod.pyc")
+    assert matcher.match_dir("pkg/build", "build")
+    assert not matcher.match_file("pkg/build", "build")
+    assert matcher.match_dir("dist", "dist") and not matcher.match_dir("pkg/dist", "dist")
+    assert matcher.match_file("pkg/bc", "bc")
+
+
+def git(root, *args):
+    subprocess.check_call(["git", "-c", "user.name=mock", "-c", "user.email=mock@mock", *args], cwd=root, stdout=subprocess.DEVNULL)
+
+
+@pytest.fixture
+def git_project(tmp_path):
+    root = str(tmp_path)
+    make_tree(root, PATHS + ["venv/bin/python", "secret.key", "tracked.key", "sub/out.tmp", "sub/keep.txt"])
+    (tmp_path / ".projectignore").write_text(IGNORE_RULES)
+    (tmp_path / ".gitignore").write_text("venv/\n*.key\n*.tmp\n")
+    git(root, "init", "-q")
+    git(root, "add", "-f", "tracked.key")
+    git(root, "add", ".")
+    git(root, "commit", "-q", "-m", "mock")
+    (tmp_path / "untracked.txt").write_text("mock")
+    os.remove(os.path.join(root, "main.py"))
+    return root
+
+
+@pytest.mark.skipif(not has_git, reason="git is not installed")
+def test_listing_matches_legacy_in_git_repo(git_project):
+    listed = [relpath for _, relpath in assert_parity(git_project, use_git=False)]
+    assert "tracked.key" in listed and "secret.key" not in listed and "untracked.txt" in listed
+
+
+@pytest.mark.skipif(not has_git, reason="git is not installed")
+def test_git_listing_matches_legacy_files(git_project):
+    expected = sorted(legacy_list_project(git_project))
+    assert sorted(_list_project(git_project, use_git=True)) == expected
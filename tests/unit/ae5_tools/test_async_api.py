@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from http.cookiejar import Cookie, LWPCookieJar
+from unittest.mock import AsyncMock
+
+import pytest
+from aiohttp import web
+from multidict import CIMultiDict
+
+from ae5_tools.api import AEException, EmptyRecordList
+from ae5_tools.async_api import AEAsyncResponse, AEAsyncUserSession
+from ae5_tools.config import config
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+
+def make_response(status_code, content=b"", headers=None):
+    headers = CIMultiDict(headers or {})
+    return AEAsyncResponse("get", "https://mock-hostname/", status_code, "MOCK", headers, content)
+
+
+def make_cookie(name, value, domain):
+    return Cookie(0, name, value, None, False, domain, False, False, "/", True, False, int(time.time()) + 3600, False, None, None, {})
+
+
+@pytest.fixture(scope="function")
+def user_session():
+    session = AEAsyncUserSession(**base_params)
+    session.connected = True
+    return session
+
+
+def test_async_user_session_shares_saved_cookies(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "_path", str(tmp_path))
+    os.makedirs(tmp_path / "cookies")
+    jar = LWPCookieJar()
+    jar.set_cookie(make_cookie("_xsrf", "mock-xsrf", "mock-hostname"))
+    jar.save(str(tmp_path / "cookies" / "mock-username@mock-hostname"), ignore_discard=True)
+
+    session = AEAsyncUserSession("mock-hostname", "mock-username", persist=True)
+    assert session.connected
+    assert session.headers["x-xsrftoken"] == "mock-xsrf"
+
+
+def test_async_api_follows_redirects_and_reauthorizes(user_session):
+    user_session._send = AsyncMock(
+        side_effect=[
+            make_response(302, headers={"location": "/api/v2/elsewhere"}),
+            make_response(401),
+            make_response(200, b'{"key": "value"}', {"content-type": "application/json"}),
+        ]
+    )
+    user_session.authorize = AsyncMock()
+
+    result = asyncio.run(user_session._get("projects"))
+
+    assert result == {"key": "value"}
+    user_session.authorize.assert_awaited_once()
+    urls = [call.args[1] for call in user_session._send.await_args_list]
+    assert urls == ["https://mock-hostname/api/v2/projects"] + ["https://mock-hostname/api/v2/elsewhere"] * 2
+
+
+def test_async_fix_records_runs_async_stages(user_session):
+    projects = [{"id": "a0-" + "1" * 32, "name": "mock-project", "owner": "mock-owner"}]
+    sessions = [{"id": "a1-" + "2" * 32, "name": "2" * 32, "owner": "mock-owner", "project_url": "https://mock/projects/" + "1" * 32}]
+
+    async def mock_api(method, endpoint, **kwargs):
+        return {"projects": projects, "sessions": sessions}[endpoint]
+
+    user_session._api = mock_api
+
+    records = asyncio.run(user_session.session_list(filter="name=mock-*"))
+
+    assert len(records) == 1
+    assert records[0]["name"] == "mock-project"
+    assert records[0]["project_id"] == projects[0]["id"]
+    assert records[0]["_record_type"] == "session"
+
+
+def test_async_ident_record_requires_one_match(user_session):
+    user_session.project_list = AsyncMock(return_value=EmptyRecordList("project"))
+    with pytest.raises(AEException, match="No projects found matching"):
+        asyncio.run(user_session._ident_record("project", "mock-project"))
+    user_session.project_list.assert_awaited_once_with(filter="name=mock-project")
+
+
+def test_async_send_manages_cookies_across_redirects(user_session):
+    seen = {}
+
+    async def login(request):
+        response = web.HTTPFound("/landing")
+        response.set_cookie("_xsrf", "mock-xsrf")
+        raise response
+
+    async def landing(request):
+        seen["cookie"] = request.headers.get("Cookie")
+        return web.Response(text="landed")
+
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get("/login", login), web.get("/landing", landing)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            response = await user_session._send("get", f"http://127.0.0.1:{port}/login", allow_redirects=True)
+        finally:
+            await user_session.close()
+            await runner.cleanup()
+        return response
+
+    response = asyncio.run(run())
+
+    assert response.text == "landed"
+    assert seen["cookie"] == "_xsrf=mock-xsrf"
+    assert user_session._connected()
+
+
+def test_async_ident_record_direct_id(user_session):
+    pid = "a0-" + "1" * 32
+    user_session._get = AsyncMock(return_value={"id": pid, "name": "mock-project", "owner": "mock-owner"})
+    user_session.project_list = AsyncMock()
+
+    record = asyncio.run(user_session._ident_record("project", pid))
+
+    assert record["name"] == "mock-project"
+    user_session._get.assert_awaited_once_with(f"projects/{pid}")
+    user_session.project_list.assert_not_awaited()
@@ -0,0 +1,164 @@
+import json
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import AEUserSession
+from ae5_tools.cache import ResponseCache
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+
+def make_response(data):
+    response = MagicMock(status_code=200, content=json.dumps(data).encode(), headers={"content-type": "application/json"})
+    response.json.side_effect = lambda: json.loads(response.content)
+    return response
+
+
+def test_response_cache_lru_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("ae5_tools.cache.time.monotonic", lambda: now[0])
+    cache = ResponseCache(ttl=10, maxsize=2)
+    cache.put("a", "projects", 1)
+    cache.put("b", "projects", 2)
+    assert cache.get("a") == 1
+    cache.put("c", "sessions", 3)
+    # "b" was the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 2, "misses": 2, "size": 1}
+
+
+def test_response_cache_invalidate_by_prefix():
+    cache = ResponseCache(ttl=10, maxsize=10)
+    cache.put("a", "projects", 1)
+    cache.put("b", "sessions", 2)
+    cache.invalidate("projects")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_response_cache_disabled():
+    cache = ResponseCache(ttl=0)
+    cache.put("a", "projects", 1)
+    assert cache.get("a") is None
+
+
+def test_api_caches_get_until_write():
+    user_session = AEUserSession(**base_params)
+    user_session.connected = True
+    user_session.session = MagicMock()
+    user_session.session.get.side_effect = lambda *args, **kwargs: make_response([{"id": "a0-1"}])
+    user_session.session.post.return_value = make_response({})
+
+    first = user_session._get("projects", cache=True)
+    first[0]["name"] = "mutated"
+    second = user_session._get("projects", cache=True)
+    assert second == [{"id": "a0-1"}]
+    assert user_session.session.get.call_count == 1
+
+    # Uncached reads always go to the server
+    user_session._get("projects")
+    assert user_session.session.get.call_count == 2
+
+    user_session._post("projects/a0-1/sessions")
+    user_session._get("projects", cache=True)
+    assert user_session.session.get.call_count == 3
+    assert user_session._cache.stats() == {"hits": 1, "misses": 2, "size": 1}
+    user_session.connected = False
+
+
+def test_project_map_shared_across_record_types():
+    user_session = AEUserSession(**base_params)
+    user_session.connected = True
+    pid = "1" * 32
+    projects = [{"id": "a0-" + pid, "name": "mock-project", "owner": "mock-owner"}]
+    records = {
+        "projects": projects,
+        "sessions": [{"id": "a1-" + "2" * 32, "name": "2" * 32, "owner": "mock-owner", "project_url": "https://mock/projects/" + pid}],
+        "jobs": [{"id": "a4-" + "3" * 32, "name": "mock-job", "owner": "mock-owner", "project_url": "https://mock/projects/" + pid}],
+    }
+    user_session.session = MagicMock()
+    user_session.session.get.side_effect = lambda url, **kwargs: make_response(records[url.rsplit("/", 1)[-1]])
+
+    user_session.session_list()
+    user_session.job_list()
+
+    urls = [call.args[0].rsplit("/", 1)[-1] for call in user_session.session.get.call_args_list]
+    assert urls == ["sessions", "projects", "jobs"]
+    user_session.connected = False
+
+
+def test_response_cache_single_flight():
+    cache = ResponseCache(ttl=10, maxsize=8)
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        started.set()
+        release.wait()
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("a", "projects", load))) for _ in range(8)]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ["value"] * 8
+    assert len(loads) == 1
+
+
+def test_response_cache_single_flight_failure():
+    cache = ResponseCache(ttl=10, maxsize=8)
+
+    def load():
+        raise RuntimeError("mock-error")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("a", "projects", load)
+    # A failed load is not cached, and does not block later attempts
+    assert cache.get_or_load("a", "projects", lambda: "value") == "value"
+
+
+def test_pod_list_fetches_listings_concurrently():
+    user_session = AEUserSession(**base_params)
+    user_session.connected = True
+    pid = "1" * 32
+    project_url = "https://mock/projects/" + pid
+    records = {
+        "projects": [{"id": "a0-" + pid, "name": "mock-project", "owner": "mock-owner"}],
+        "sessions": [{"id": "a1-" + "2" * 32, "name": "2" * 32, "owner": "mock-owner", "resource_profile": "default", "project_url": project_url}],
+        "deployments": [
+            {"id": "a2-" + "3" * 32, "name": "mock-deployment", "owner": "mock-owner", "resource_profile": "default", "project_url": project_url}
+        ],
+        "runs": [{"id": "a5-" + "4" * 32, "name": "mock-run", "owner": "mock-owner", "resource_profile": "default", "project_url": project_url}],
+    }
+    # Each listing waits until all three requests are in flight at once
+    barrier = threading.Barrier(3, timeout=5)
+
+    def mock_get(url, **kwargs):
+        resource = url.rsplit("/", 1)[-1]
+        if resource != "projects":
+            barrier.wait()
+        return make_response(records[resource])
+
+    user_session.session = MagicMock()
+    user_session.session.get.side_effect = mock_get
+    k8s = {"phase": "Running", "since": "mock", "restarts": 0, "usage": {"mem": 1, "cpu": 2, "gpu": 0}, "node": "mock-node"}
+    user_session._pod_info = lambda ids: [k8s for _ in ids]
+
+    result = user_session.pod_list()
+
+    assert [r["id"][:2] for r in result] == ["a1", "a2", "a5"]
+    # The sessions and runs share one request for the project list
+    urls = [call.args[0].rsplit("/", 1)[-1] for call in user_session.session.get.call_args_list]
+    assert sorted(urls) == ["deployments", "projects", "runs", "sessions"]
+    user_session.connected = False
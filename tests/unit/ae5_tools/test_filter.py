@@ -0,0 +1,158 @@
+import json
+import re
+from datetime import datetime
+
+import click
+import pytest
+
+from ae5_tools.cli.format import filter_df, format_quantities, print_output, sort_df
+from ae5_tools.filter import OPS, _str, filter_list_of_dicts, parse_filter
+
+RECORDS = [
+    {"name": "alpha", "owner": "alice", "size": "10", "created": datetime(2023, 1, 2, 3, 4, 5)},
+    {"name": "beta", "owner": "bob", "size": "2", "created": None},
+    {"name": "gamma", "owner": "alice", "size": "30", "created": datetime(2024, 6, 7, 8, 9, 10)},
+    {"name": "delta", "owner": "carol", "size": "4"},
+]
+
+FILTERS = [
+    "name=alpha",
+    "name=*a",
+    "name!=*a",
+    "owner=alice,name=g*",
+    "owner=bob|name=gamma",
+    "owner=alice&name=alpha|owner=carol",
+    "owner=alice,name=alpha|name=gamma",
+    ("owner=a*", "size>2"),
+    "size<=2",
+    "size>=30",
+    "name==beta",
+    "name == beta",
+    "created=2023-*",
+    "created=",
+    "name=[ab]*",
+]
+
+
+def reference_filter(records, filter):
+    # The original mask-based evaluation, kept here to verify the compiled filters
+    if isinstance(filter, str):
+        filter = (filter,)
+    mask0 = None
+    for filt1 in filter:
+        mask1 = None
+        for filt2 in filt1.split(","):
+            mask2 = None
+            for filt3 in filt2.split("|"):
+                mask3 = None
+                for filt4 in filt3.split("&"):
+                    field, op, value = map(str.strip, re.split(r"(==?|!=|>=?|<=?)", filt4.strip()))
+                    mask4 = [OPS[op](_str(rec[field]), value) if field in rec else False for rec in records]
+                    mask3 = mask4 if mask3 is None else [m1 and m2 for m1, m2 in zip(mask3, mask4)]
+                mask2 = mask3 if mask2 is None else [m1 or m2 for m1, m2 in zip(mask2, mask3)]
+            mask1 = mask2 if mask1 is None else [m1 and m2 for m1, m2 in zip(mask1, mask2)]
+        mask0 = mask1 if mask0 is None else [m1 and m2 for m1, m2 in zip(mask0, mask1)]
+    return [rec for rec, flag in zip(records, mask0) if flag]
+
+
+@pytest.mark.parametrize("filter", FILTERS)
+def test_filter_list_of_dicts_matches_reference(filter):
+    assert filter_list_of_dicts(RECORDS, filter) == reference_filter(RECORDS, filter)
+
+
+@pytest.mark.parametrize("filter", FILTERS)
+def test_filter_df_matches_reference(filter):
+    columns = ["name", "owner", "size", "created"]
+    rows = [[rec.get(c) for c in columns] for rec in RECORDS]
+    expected = [[rec.get(c) for c in columns] for rec in reference_filter([dict(zip(columns, row)) for row in rows], filter)]
+    filter = (filter,) if isinstance(filter, str) else filter
+    assert filter_df(rows, columns, filter, None, False) == (expected, columns)
+
+
+def test_filter_errors():
+    with pytest.raises(ValueError, match='unknown field "missing"'):
+        filter_list_of_dicts(RECORDS, "missing=x")
+    with pytest.raises(ValueError, match="Invalid filter string: name"):
+        filter_list_of_dicts(RECORDS, "name")
+    # Errors are reported in the order the terms appear
+    with pytest.raises(ValueError, match="unknown field"):
+        filter_list_of_dicts(RECORDS, "missing=x,name")
+    with pytest.raises(click.UsageError, match="Invalid filter field: missing"):
+        filter_df([], ["name"], ("missing=x",), None, False)
+    with pytest.raises(click.UsageError, match="Invalid filter string: name"):
+        filter_df([], ["name"], ("name",), None, False)
+
+
+def test_parse_filter_is_cached():
+    assert parse_filter(("name=a*,owner=b",)) is parse_filter(("name=a*,owner=b",))
+
+
+POD_RECORDS = [
+    {"name": "small", "usage/mem": 512 * 2**20, "usage/cpu": 0.25},
+    {"name": "large", "usage/mem": 4 * 2**30, "usage/cpu": 2.0},
+    # As given by k8s endpoints that predate raw quantities
+    {"name": "legacy", "usage/mem": "1.500Gi", "usage/cpu": "750m"},
+]
+
+
+@pytest.mark.parametrize(
+    "filter, expected",
+    [
+        ("usage/mem>1Gi", ["large", "legacy"]),
+        ("usage/mem<=512Mi", ["small"]),
+        ("usage/cpu=250m", ["small"]),
+        ("usage/cpu!=2", ["small", "legacy"]),
+        ("usage/cpu>=0.75", ["large", "legacy"]),
+        ("usage/mem>1G", ["large", "legacy"]),
+        ("usage/mem<1G", ["small"]),
+        ("usage/cpu<300000u", ["small"]),
+        # Values that are not quantities are matched as text
+        ("usage/mem=*Gi", ["legacy"]),
+    ],
+)
+def test_filter_quantities(filter, expected):
+    assert [rec["name"] for rec in filter_list_of_dicts(POD_RECORDS, filter)] == expected
+    columns = list(POD_RECORDS[0])
+    rows = [[rec[c] for c in columns] for rec in POD_RECORDS]
+    assert [row[0] for row in filter_df(rows, columns, (filter,), None, False)[0]] == expected
+
+
+def test_sort_and_format_quantities():
+    columns = list(POD_RECORDS[0])
+    rows = [[rec[c] for c in columns] for rec in POD_RECORDS]
+    rows = sort_df(rows, columns, "-usage/mem")
+    assert [row[0] for row in rows] == ["large", "legacy", "small"]
+    assert format_quantities(rows, columns) == [["large", "4.000Gi", "2.000"], ["legacy", "1.500Gi", "750m"], ["small", "512.0Mi", "250m"]]
+
+
+def _print_output(capsys, **options):
+    columns = list(POD_RECORDS[0])
+    rows = [[rec[c] for c in columns] for rec in POD_RECORDS]
+    ctx = click.Context(click.Command("test"), obj={"options": dict(sort="name", **options)})
+    with ctx:
+        print_output((rows, columns))
+    return capsys.readouterr().out
+
+
+def test_print_output_table_quantities(capsys):
+    lines = _print_output(capsys, wide=True).splitlines()
+    assert "4.000Gi" in lines[-3] and "1.500Gi" in lines[-2] and "512.0Mi" in lines[-1]
+
+
+def test_print_output_csv_quantities(capsys):
+    lines = _print_output(capsys, format="csv").splitlines()
+    assert lines[1:] == ["large,4.000Gi,2.000", "legacy,1.500Gi,750m", "small,512.0Mi,250m"]
+    lines = _print_output(capsys, format="csv", raw=True).splitlines()
+    assert lines[1:] == ["large,4294967296,2.0", "legacy,1610612736.0,0.75", "small,536870912,0.25"]
+
+
+def test_print_output_json_quantities(capsys):
+    result = json.loads(_print_output(capsys, format="json"))
+    assert [(rec["usage/mem"], rec["usage/cpu"]) for rec in result] == [("4.000Gi", "2.000"), ("1.500Gi", "750m"), ("512.0Mi", "250m")]
+    result = json.loads(_print_output(capsys, format="json", raw=True))
+    assert [(rec["usage/mem"], rec["usage/cpu"]) for rec in result] == [(4 * 2**30, 2), (1.5 * 2**30, 0.75), (2**29, 0.25)]
+
+
+def test_format_quantities_field_value():
+    records = [["name", "large"], ["usage/mem", 4 * 2**30], ["usage/cpu", 0.25]]
+    assert format_quantities(records, ["field", "value"]) == [["name", "large"], ["usage/mem", "4.000Gi"], ["usage/cpu", "250m"]]
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ae5_tools.k8s.informer import NodeAggregates, PodInformer
+from ae5_tools.k8s.transformer import AE5K8STransformer
+
+SLUG = "0123456789abcdef0123456789abcdef"
+
+
+def mock_pod(name, rv="1", **labels):
+    return {
+        "metadata": {"name": name, "namespace": "mock-ns", "labels": labels, "resourceVersion": rv},
+        "spec": {"nodeName": "mock-node", "containers": [{"name": "app", "resources": {"requests": {}, "limits": {}}}]},
+        "status": {
+            "phase": "Running",
+            "conditions": [{"lastTransitionTime": "2024-01-01T00:00:00Z"}],
+            "containerStatuses": [{"name": "app", "ready": True, "state": {}, "restartCount": 0}],
+        },
+    }
+
+
+class MockTransformer(AE5K8STransformer):
+    def __init__(self, listing, events):
+        super(MockTransformer, self).__init__("https://mock-k8s", None, "mock-ns")
+        self.listing = listing
+        self.events = events
+        self.paths = []
+
+    async def get(self, path, **kwargs):
+        self.paths.append(path)
+        return self.listing(path) if callable(self.listing) else self.listing
+
+    async def watch(self, path, **params):
+        self.paths.append((path, params.get("resourceVersion")))
+        for event in self.events:
+            yield event
+
+
+def test_pod_informer_index():
+    informer = PodInformer(None, "mock-ns")
+    informer.replace([mock_pod("anaconda-app-b", **{"anaconda-app-id": SLUG}), mock_pod("anaconda-session-x", **{"session-id": SLUG})], "10")
+
+    assert informer.get(f"a2-{SLUG}")["metadata"]["name"] == "anaconda-app-b"
+    assert informer.get(f"a1-{SLUG}")["metadata"]["name"] == "anaconda-session-x"
+
+    # A pod matched by an earlier label in the search order wins
+    informer.apply("ADDED", mock_pod("anaconda-app-c", "11", **{"app-id": SLUG}))
+    assert informer.get(f"a2-{SLUG}")["metadata"]["name"] == "anaconda-app-c"
+    informer.apply("DELETED", mock_pod("anaconda-app-c", "12", **{"app-id": SLUG}))
+    assert informer.get(f"a2-{SLUG}")["metadata"]["name"] == "anaconda-app-b"
+
+    # A relabelled pod moves in the index
+    informer.apply("MODIFIED", mock_pod("anaconda-app-b", "13", **{"job-name": f"anaconda-job-{SLUG[::-1]}"}))
+    assert informer.get(f"a2-{SLUG}") is None
+    assert informer.get(f"a2-{SLUG[::-1]}")["metadata"]["name"] == "anaconda-app-b"
+    assert informer.resource_version == "13"
+    assert informer.status()["ids"] == 2
+
+
+def test_informer_list_and_watch():
+    events = [
+        {"type": "ADDED", "object": mock_pod("anaconda-app-a", "6", **{"app-id": SLUG})},
+        {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "7"}}},
+        {"type": "ERROR", "object": {"code": 410, "message": "too old resource version"}},
+    ]
+    xfrm = MockTransformer({"metadata": {"resourceVersion": "5"}, "items": []}, events)
+    informer = PodInformer(xfrm, "mock-ns")
+
+    async def run():
+        await informer._list()
+        await informer._watch()
+
+    asyncio.run(run())
+
+    assert xfrm.paths == ["namespaces/mock-ns/pods", ("namespaces/mock-ns/pods", "5")]
+    assert informer.get(f"a2-{SLUG}") is not None
+    assert informer.resource_version == "7"
+    assert informer.events == 1
+    assert informer.last_error.startswith("410")
+    # The watch has ended, so the informer is current only for a while
+    assert not informer.watching and informer.fresh()
+    informer.last_contact -= 3600
+    assert not informer.fresh()
+
+
+def test_pod_info_uses_informer_while_fresh():
+    def listing(path):
+        # Label-selector queries, used only when the informer is not fresh
+        return {"items": [mock_pod("anaconda-app-q", **{"app-id": SLUG})]}
+
+    xfrm = MockTransformer(listing, [])
+    xfrm.informer = PodInformer(xfrm, "mock-ns")
+    xfrm.informer.replace([mock_pod("anaconda-app-i", **{"app-id": SLUG})], "1")
+    xfrm.informer.watching = True
+
+    async def lookup(id):
+        return await xfrm._pod_info(id, return_exceptions=True)
+
+    assert asyncio.run(lookup(f"a2-{SLUG}"))["name"] == "anaconda-app-i"
+    assert xfrm.paths == []
+
+    # A pod the watch has not delivered yet is found with the label queries
+    assert asyncio.run(lookup(f"a1-{SLUG}"))["name"] == "anaconda-app-q"
+    assert xfrm.paths == ["namespaces/mock-ns/pods?labelSelector=anaconda-session-id%3D" + SLUG + "&limit=1"]
+    xfrm.paths.clear()
+
+    xfrm.informer.watching = False
+    xfrm.informer.last_contact = time.time() - 3600
+    assert asyncio.run(lookup(f"a2-{SLUG}"))["name"] == "anaconda-app-q"
+    assert xfrm.paths == ["namespaces/mock-ns/pods?labelSelector=app-id%3D" + SLUG + "&limit=1"]
+
+
+def test_transformer_watch_splits_chunked_events():
+    events = [{"type": "ADDED", "object": mock_pod(f"pod-{k}", str(k))} for k in range(3)]
+    payload = b"".join(json.dumps(e).encode() + b"\n" for e in events)
+
+    async def handler(request):
+        assert request.query["watch"] == "true"
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for k in range(0, len(payload), 100):
+            await response.write(payload[k : k + 100])
+        return response
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/api/v1/namespaces/mock-ns/pods", handler)
+        async with TestServer(app) as server:
+            xfrm = AE5K8STransformer(str(server.make_url("/")), None, "mock-ns")
+            try:
+                return [event async for event in xfrm.watch("namespaces/mock-ns/pods", timeoutSeconds=5)]
+            finally:
+                await xfrm.close()
+
+    assert asyncio.run(run()) == events
+
+
+def mock_node(name):
+    return {
+        "metadata": {"name": name, "labels": {"role": "worker"}},
+        "status": {
+            "allocatable": {"pods": "110", "memory": "64Gi", "cpu": "16"},
+            "conditions": [{"type": "Ready", "status": "True"}, {"type": "DiskPressure", "status": "False"}],
+        },
+    }
+
+
+def mock_cluster_pod(k, node, phase="Running"):
+    prefix = ("anaconda-session-", "anaconda-app-", "anaconda-postgres-", "kube-proxy-")[k % 4]
+    resources = {"requests": {"cpu": f"{100 * (k % 5)}m", "memory": f"{k % 7}Gi"}}
+    if k % 3:
+        resources["limits"] = {"cpu": "2", "memory": "8Gi", "nvidia.com/gpu": str(k % 2)}
+    return {
+        "metadata": {"name": f"{prefix}{k}", "namespace": "mock-ns" if k % 4 < 3 else "kube-system", "resourceVersion": str(k)},
+        "spec": {"nodeName": node, "containers": [{"name": "app", "resources": resources}, {"name": "sync", "resources": {}}]},
+        "status": {"phase": phase},
+    }
+
+
+def mock_metrics(pod):
+    usage = {"cpu": f'{len(pod["metadata"]["name"])}m', "memory": "100Mi"}
+    metadata = {"name": pod["metadata"]["name"], "namespace": pod["metadata"]["namespace"]}
+    return {"metadata": metadata, "window": "30s", "timestamp": "mock-time", "containers": [{"name": "app", "usage": usage}]}
+
+
+def test_node_aggregates_match_node_info():
+    nodes = [mock_node(f"node-{n}") for n in range(3)]
+    phases = ("Running", "Pending", "Succeeded")
+    pods = [mock_cluster_pod(k, f"node-{k % 4}", phases[k % 5 % 3]) for k in range(40)]
+    listings = {"nodes": {"items": nodes}, "pods": {"items": pods}, "metrics": {"items": [mock_metrics(p) for p in pods[::2]]}}
+    for listing in listings.values():
+        listing["metadata"] = {"resourceVersion": "100"}
+    xfrm = MockTransformer(listings.get, [])
+    xfrm._metrics_url = "metrics"
+    aggregates = NodeAggregates(xfrm)
+
+    async def node_info(use_aggregates):
+        xfrm.node_aggregates = aggregates if use_aggregates else None
+        return await xfrm.node_info()
+
+    async def start():
+        await aggregates.pods._list()
+        await aggregates.nodes._list()
+        await aggregates.merge_metrics()
+        aggregates.pods.watching = aggregates.nodes.watching = True
+
+    assert not aggregates.fresh()
+    asyncio.run(start())
+    assert aggregates.fresh()
+    assert asyncio.run(node_info(True)) == asyncio.run(node_info(False))
+
+    # Incremental changes give the same result as a full recomputation
+    changed = mock_cluster_pod(5, "node-2")
+    aggregates.pods.apply("MODIFIED", changed)
+    pods[5] = changed
+    aggregates.pods.apply("DELETED", pods.pop(8))
+    added = mock_cluster_pod(41, "node-0", "Pending")
+    aggregates.pods.apply("ADDED", added)
+    pods.append(added)
+    assert aggregates._dirty == {"node-0", "node-1", "node-2", "node-3"}
+    listings["metrics"]["items"].append(mock_metrics(added))
+    xfrm._metrics = None
+    asyncio.run(aggregates.merge_metrics())
+    requests = len(xfrm.paths)
+    result = asyncio.run(node_info(True))
+    assert len(xfrm.paths) == requests
+    assert result == asyncio.run(node_info(False))
+    # The totals of the dirty nodes are summed again when read; node-3 is not listed
+    assert aggregates._dirty == {"node-3"}
+
+
+def test_informer_failing_watch_backs_off(monkeypatch):
+    # The watch is refused at once, as when listing is allowed but watching is not
+    class RefusedTransformer(MockTransformer):
+        async def watch(self, path, **params):
+            self.paths.append((path, params.get("resourceVersion")))
+            raise RuntimeError("403 Forbidden")
+            yield
+
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+        if len(delays) == 5:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr("ae5_tools.k8s.informer.asyncio.sleep", sleep)
+    xfrm = RefusedTransformer({"metadata": {"resourceVersion": "5"}, "items": [mock_pod("anaconda-app-a", **{"app-id": SLUG})]}, [])
+    informer = PodInformer(xfrm, "mock-ns")
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(informer._run())
+
+    assert delays == [1, 2, 4, 8, 16]
+    assert informer.lists == 5 and informer.watch_failures == 5
+    # Though just listed, the informer no longer answers requests
+    assert not informer.fresh()
+
+    # A watch that delivers events resets the failures
+    informer._xfrm = MockTransformer(xfrm.listing, [{"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "6"}}}])
+    assert asyncio.run(informer._watch()) is True
+    assert informer.watch_failures == 0 and informer.fresh()
+
+
+def test_informer_empty_watch_fails():
+    xfrm = MockTransformer({"metadata": {"resourceVersion": "5"}, "items": []}, [])
+    informer = PodInformer(xfrm, "mock-ns")
+    asyncio.run(informer._list())
+    contact = informer.last_contact
+    # A watch that ends at once, with no events, does not count as contact
+    assert asyncio.run(informer._watch()) is False
+    assert informer.last_contact == contact and informer.watch_failures == 1
@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from ae5_tools.k8s.server import AE5K8SHandler, _dumps, _json
+
+from .test_k8s_informer import SLUG, MockTransformer, mock_node, mock_pod
+
+
+def test_dumps_is_compact():
+    assert json.loads(_dumps({"a": [1, 2.5, "x"]})) == {"a": [1, 2.5, "x"]}
+    assert b" " not in _dumps({"a": [1, 2.5, "x"], "b": {"c": None}})
+
+
+@pytest.mark.parametrize(
+    "size, encoding, expected", [(10, "gzip", None), (2000, "gzip", "gzip"), (2000, "deflate", "deflate"), (2000, "identity", None)]
+)
+def test_json_compression(size, encoding, expected):
+    result = [{"name": f"pod-{k}", "usage": {"mem": "1.234Gi", "cpu": "250m"}} for k in range(size)]
+
+    async def handler(request):
+        return _json(result)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/pods", handler)
+        async with TestServer(app) as server, ClientSession() as client:
+            async with client.get(server.make_url("/pods"), headers={"Accept-Encoding": encoding}) as resp:
+                return resp.headers.get("Content-Encoding"), await resp.json()
+
+    assert asyncio.run(run()) == (expected, result)
+
+
+def test_raw_quantities():
+    pod = mock_pod("anaconda-app-r", **{"app-id": SLUG})
+    listings = {"nodes": {"items": [mock_node("node-0")]}, "pods": {"items": []}}
+
+    def listing(path):
+        return listings.get(path, {"items": [pod]})
+
+    async def run():
+        handler = AE5K8SHandler("https://mock-k8s", None, "mock-ns")
+        handler.xfrm = MockTransformer(listing, [])
+        handler.xfrm._metrics_url = ""
+        app = web.Application()
+        app.router.add_get("/nodes", handler.nodeinfo)
+        app.router.add_get("/pods", handler.podinfo_get_query)
+        app.router.add_post("/pods", handler.podinfo_post)
+        results = []
+        async with TestServer(app) as server, ClientSession() as client:
+            for method, path, kwargs in [
+                ("get", "/nodes", {}),
+                ("get", "/nodes?raw=1", {}),
+                ("get", f"/pods?id=a2-{SLUG}&raw=1", {}),
+                ("post", "/pods?raw=1", {"json": [f"a2-{SLUG}"]}),
+            ]:
+                async with client.request(method, server.make_url(path), **kwargs) as resp:
+                    results.append(await resp.json())
+        return results
+
+    text_nodes, raw_nodes, get_pods, post_pods = asyncio.run(run())
+    assert text_nodes[0]["capacity"] == {"pods": "110", "mem": "64.00Gi", "cpu": "16", "gpu": "0"}
+    assert raw_nodes[0]["capacity"] == {"pods": 110, "mem": 64 * 2**30, "cpu": 16.0, "gpu": 0.0}
+    assert raw_nodes[0]["total"]["limits"] == {"mem": 0, "cpu": 0, "gpu": 0}
+    assert get_pods == post_pods
+    assert get_pods[f"a2-{SLUG}"]["limits"] == {"mem": None, "cpu": None, "gpu": None}
+    assert get_pods[f"a2-{SLUG}"]["usage"] == {"mem": 0, "cpu": 0, "gpu": 0}
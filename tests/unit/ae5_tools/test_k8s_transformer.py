@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from ae5_tools.k8s.transformer import _to_float, _to_text
+
+from .test_k8s_informer import SLUG, MockTransformer, mock_pod
+
+
+def mock_pod_metrics(name, cpu):
+    return {
+        "metadata": {"name": name},
+        "window": "30s",
+        "timestamp": "mock-time",
+        "containers": [{"name": "app", "usage": {"cpu": cpu, "memory": "1Mi"}}],
+    }
+
+
+def test_pod_info_shares_bulk_metrics():
+    ids = [f"a2-{k:032x}" for k in range(20)]
+
+    def listing(path):
+        if path.startswith("namespaces/mock-ns/pods?"):
+            slug = path.split("%3D")[1].split("&")[0]
+            pod = mock_pod(f"anaconda-app-{slug}", **{"app-id": slug})
+            pod["spec"]["containers"][0]["resources"]["requests"]["nvidia.com/gpu"] = "0"
+            return {"items": [pod]}
+        return {"items": [mock_pod_metrics(f"anaconda-app-{k:032x}", f"{k}m") for k in range(0, 20, 2)]}
+
+    xfrm = MockTransformer(listing, [])
+    xfrm._metrics_url = "metrics"
+
+    records = asyncio.run(xfrm.pod_info(ids))
+
+    # A single bulk query, however many pods are looked up at once
+    assert [path for path in xfrm.paths if not path.startswith("namespaces/")] == ["metrics"]
+    assert [r["usage"]["cpu"] for r in records[:4]] == ["0", "0", "2m", "0"]
+    assert all(r["window"] == ("30s" if k % 2 == 0 else None) for k, r in enumerate(records))
+
+
+def test_metrics_snapshot_ttl(monkeypatch):
+    xfrm = MockTransformer({"items": [mock_pod_metrics("pod-a", "1m")]}, [])
+    xfrm._metrics_url = "metrics"
+
+    assert list(asyncio.run(xfrm.metrics_snapshot())) == ["pod-a"]
+    assert list(asyncio.run(xfrm.metrics_snapshot())) == ["pod-a"]
+    assert xfrm.paths == ["metrics"]
+
+    monkeypatch.setattr("ae5_tools.k8s.transformer.METRICS_TTL", 0)
+    xfrm._metrics = None
+    asyncio.run(xfrm.metrics_snapshot())
+    asyncio.run(xfrm.metrics_snapshot())
+    assert xfrm.paths == ["metrics"] * 3
+
+
+def test_metrics_snapshot_unavailable():
+    xfrm = MockTransformer(None, [])
+    xfrm._metrics_url = ""
+    assert asyncio.run(xfrm.metrics_snapshot()) == {}
+    xfrm._metrics_url = "metrics"
+    xfrm._metrics = None
+    # A 403 or 404 from the metrics API
+    assert asyncio.run(xfrm.metrics_snapshot()) == {}
+
+
+def test_pod_info_raw_quantities():
+    pod = mock_pod("anaconda-app-r", **{"app-id": SLUG})
+    pod["spec"]["containers"][0]["resources"] = {"requests": {"cpu": "250m", "memory": "512Mi", "nvidia.com/gpu": "1"}, "limits": {"cpu": "2"}}
+    xfrm = MockTransformer({"items": [pod]}, [])
+    xfrm._metrics = (float("inf"), {"anaconda-app-r": mock_pod_metrics("anaconda-app-r", "1500m")})
+
+    text = asyncio.run(xfrm.pod_info(f"a2-{SLUG}"))
+    raw = asyncio.run(xfrm.pod_info(f"a2-{SLUG}", raw=True))
+
+    assert text["requests"] == {"mem": "512.0Mi", "cpu": "250m", "gpu": "1.000"}
+    assert text["limits"] == {"mem": "inf", "cpu": "2.000", "gpu": "inf"}
+    assert raw["requests"] == {"mem": 512 * 2**20, "cpu": 0.25, "gpu": 1.0}
+    # Unbounded limits, which JSON cannot represent as numbers
+    assert raw["limits"] == {"mem": None, "cpu": 2.0, "gpu": None}
+    assert raw["usage"] == {"mem": 2**20, "cpu": 1.5, "gpu": 1.0}
+    assert raw["containers"]["app"]["usage"]["memory"] == 2**20
+    # The shared metrics snapshot is not modified
+    assert xfrm._metrics[1]["anaconda-app-r"]["containers"][0]["usage"] == {"cpu": "1500m", "memory": "1Mi"}
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("1Ki", 1024.0),
+        ("512Mi", 512 * 2.0**20),
+        ("1.5Gi", 1.5 * 2.0**30),
+        ("1Ti", 2.0**40),
+        ("2Pi", 2 * 2.0**50),
+        ("1k", 1.0e3),
+        ("16G", 16.0e9),
+        ("3M", 3.0e6),
+        ("2T", 2.0e12),
+        ("250m", 0.25),
+        ("500u", 0.0005),
+        ("250n", 2.5e-7),
+        ("16", 16.0),
+        (".5", 0.5),
+        ("1e3", 1000.0),
+        ("1E", 1.0e18),
+        ("inf", float("inf")),
+        # Not quantities
+        ("16Gb", "16Gb"),
+        ("mock", "mock"),
+    ],
+)
+def test_to_float_suffixes(text, expected):
+    if isinstance(expected, str):
+        assert _to_float(text) == expected
+    else:
+        assert _to_float(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [("1Gi", "1.000Gi"), ("64Gi", "64.00Gi"), ("512Mi", "512.0Mi"), ("1Ki", "1.000Ki"), ("16G", "14.90Gi"), ("250m", "250m"), ("2", "2.000")],
+)
+def test_to_text_round_trip(text, expected):
+    assert _to_text(_to_float(text)) == expected
@@ -0,0 +1,124 @@
+import gzip
+import io
+import tarfile
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from ae5_tools import AEUserSession
+from ae5_tools.streaming import UPLOAD_QUEUE_DEPTH, MultipartBody, iter_produced
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+
+def test_multipart_body_matches_requests_encoding(tmp_path):
+    archive = tmp_path / "mock-project.tar.gz"
+    archive.write_bytes(b"mock-archive-content")
+    data = {"name": "mock-project", "tag": "1.2.3"}
+    body = MultipartBody(data, "project_file", str(archive), str(archive))
+
+    with open(archive, "rb") as fp:
+        request = requests.Request("POST", "https://mock", data=data, files={b"project_file": (str(archive), fp)}).prepare()
+    boundary = request.headers["Content-Type"].split("boundary=")[1]
+    expected = request.body.replace(boundary.encode(), body.boundary.encode())
+
+    assert b"".join(body) == expected
+    assert body.len == len(expected)
+    # The body can be generated again, e.g. for a retry
+    assert b"".join(body) == expected
+
+
+def test_iter_produced_bounds_buffering():
+    written = []
+
+    def produce(fp):
+        for k in range(UPLOAD_QUEUE_DEPTH * 4):
+            fp.write(bytes([k % 256]) * (256 * 1024))
+            written.append(k)
+
+    chunks = iter_produced(produce)
+    next(chunks)
+    # The producer stalls once the queue is full, rather than running ahead
+    threading.Event().wait(0.2)
+    assert len(written) <= UPLOAD_QUEUE_DEPTH + 2
+    assert len(b"".join(chunks)) == (UPLOAD_QUEUE_DEPTH * 4 - 1) * 256 * 1024
+
+
+def test_iter_produced_propagates_errors():
+    def produce(fp):
+        fp.write(b"partial")
+        raise OSError("mock-error")
+
+    with pytest.raises(OSError, match="mock-error"):
+        list(iter_produced(produce))
+
+
+def test_iter_produced_stops_abandoned_producer():
+    def produce(fp):
+        while True:
+            fp.write(b"x" * 1024 * 1024)
+
+    chunks = iter_produced(produce)
+    next(chunks)
+    # Closing the generator cancels the producer and joins its thread
+    chunks.close()
+    assert not any(t.name == "ae5-upload-producer" for t in threading.enumerate())
+
+
+def test_project_upload_streams_directory(tmp_path):
+    (tmp_path / "anaconda-project.yml").write_text("name: mock-project\n")
+    (tmp_path / "data.txt").write_text("mock-data\n")
+    user_session = AEUserSession(**base_params)
+    user_session.connected = True
+    received = []
+
+    def mock_post(url, data=None, headers=None, **kwargs):
+        received.append(b"".join(data))
+        assert headers["Content-Type"] == data.content_type
+        assert data.len is None
+        return MagicMock(
+            status_code=200, content=b"{}", headers={"content-type": "application/json"}, json=lambda: {"id": "a0-mock", "action": {"error": False}}
+        )
+
+    user_session.session = MagicMock()
+    user_session.session.post.side_effect = mock_post
+
+    user_session.project_upload(str(tmp_path), "mock-project", None, wait=False)
+
+    head, _, rest = received[0].partition(b"\r\n\r\n")
+    head, _, rest = rest.partition(b"\r\n\r\n")
+    assert f'filename="{tmp_path}.tar.gz"'.encode() in head
+    archive = rest[: rest.rindex(b"\r\n--")]
+    with tarfile.open(fileobj=io.BytesIO(gzip.decompress(archive))) as tf:
+        assert sorted(tf.getnames()) == ["project/anaconda-project.yml", "project/data.txt"]
+    user_session.connected = False
+
+
+def test_project_upload_reuses_cached_archive(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "anaconda-project.yml").write_text("name: mock-project\n")
+    monkeypatch.setattr("ae5_tools.api.config._path", str(tmp_path / "config"))
+    user_session = AEUserSession(**base_params)
+    user_session.connected = True
+    received = []
+
+    def mock_post(url, data=None, headers=None, **kwargs):
+        received.append((data.len, b"".join(data)))
+        return MagicMock(
+            status_code=200, content=b"{}", headers={"content-type": "application/json"}, json=lambda: {"id": "a0-mock", "action": {"error": False}}
+        )
+
+    user_session.session = MagicMock()
+    user_session.session.post.side_effect = mock_post
+
+    user_session.project_upload(str(project), "mock-project", None, wait=False, cache=True)
+    user_session.project_upload(str(project), "mock-project", None, wait=False, cache=True)
+
+    # The second upload sends the cached archive, whose size is known in advance
+    assert received[0][0] is None and received[1][0] == len(received[1][1])
+    archives = list((tmp_path / "config" / "archives").iterdir())
+    assert len(archives) == 1 and archives[0].read_bytes() in received[1][1]
+    user_session.connected = False
@@ -0,0 +1,113 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import AEAsyncUserSession, AEException, AEUserSession
+from ae5_tools.waiter import Backoff, async_wait_for, wait_for
+
+base_params: dict = {"hostname": "mock-hostname", "username": "mock-username", "password": "<PASSWORD>", "persist": False}
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr("ae5_tools.waiter.WAIT_INITIAL_INTERVAL", 0)
+
+
+def test_backoff_grows_to_maximum():
+    backoff = Backoff(initial=1, maximum=4, factor=2, jitter=0.1)
+    delays = [backoff.next_delay() for _ in range(5)]
+    for delay, expected in zip(delays, [1, 2, 4, 4, 4]):
+        assert expected * 0.9 <= delay <= expected * 1.1
+
+
+def test_backoff_deadline():
+    backoff = Backoff(initial=10, jitter=0, timeout=0.05)
+    # The delay is cut short at the deadline, after which the schedule ends
+    assert backoff.next_delay() <= 0.05
+    backoff.deadline -= 1
+    with pytest.raises(TimeoutError):
+        backoff.next_delay()
+
+
+def test_wait_for_batches_pending_operations():
+    polls = {"a": [1, 2], "b": [3], "c": []}
+    calls = []
+
+    def fetch(keys):
+        calls.append(keys)
+        return {key: polls[key].pop(0) if polls[key] else "done" for key in keys}
+
+    states = wait_for({"a": "pending", "b": "pending", "c": "pending", "d": "done"}, fetch, lambda s: s == "done")
+
+    assert states == {"a": "done", "b": "done", "c": "done", "d": "done"}
+    # One call per poll, for only the operations still pending
+    assert calls == [["a", "b", "c"], ["a", "b"], ["a"]]
+
+
+def test_wait_for_timeout():
+    with pytest.raises(TimeoutError, match="Timed out waiting for b"):
+        wait_for({"a": True, "b": False}, lambda keys: {}, bool, backoff=Backoff(initial=0.01, timeout=0.05))
+
+
+def test_async_wait_for():
+    async def fetch(keys):
+        return {key: True for key in keys}
+
+    assert asyncio.run(async_wait_for({"a": False}, fetch, bool)) == {"a": True}
+
+
+@pytest.fixture
+def user_session():
+    session = AEUserSession(**base_params)
+    session.connected = True
+    yield session
+    session.connected = False
+
+
+def test_wait_action(user_session):
+    activity = [
+        {"data": [{"id": "act-2", "done": False, "error": False}]},
+        {"data": [{"id": "act-2", "done": False, "error": False}, {"id": "act-1", "done": False, "error": False}]},
+        {"data": [{"id": "act-2", "done": True, "error": False}, {"id": "act-1", "done": True, "error": False}]},
+    ]
+    user_session._get = MagicMock(side_effect=activity)
+    response = {"id": "a0-mock", "action": {"id": "act-1", "done": False, "error": False}}
+
+    user_session._wait(response)
+
+    assert response["action"] == {"id": "act-1", "done": True, "error": False}
+    # The activity is read further back when the action is not in the latest page
+    assert [c.kwargs["params"]["page[size]"] for c in user_session._get.call_args_list] == [1, 2, 2]
+
+
+def test_async_wait_action():
+    activity = [{"data": []}, {"data": [{"id": "act-1", "done": False, "error": True}]}]
+
+    async def mock_get(path, params=None):
+        assert path == "projects/a0-mock/activity"
+        return activity.pop(0)
+
+    session = AEAsyncUserSession(**base_params)
+    session._get = mock_get
+    response = {"id": "a0-other", "project_id": "a0-mock", "action": {"id": "act-1", "done": False, "error": False}}
+    asyncio.run(session._wait(response))
+    assert response["action"]["error"] is True
+
+
+def test_wait_record(user_session):
+    records = [{"id": "a2-1", "state": "starting"}, {"id": "a2-1", "state": "failed"}]
+    user_session._get_records = MagicMock(side_effect=records)
+
+    result = user_session._wait_record("deployment", {"id": "a2-1", "state": "initial"}, lambda r: r["state"] not in ("initial", "starting"))
+
+    assert result == {"id": "a2-1", "state": "failed"}
+    assert [c.args[0] for c in user_session._get_records.call_args_list] == ["deployments/a2-1", "deployments/a2-1"]
+
+
+def test_wait_timeout_is_reported(user_session, monkeypatch):
+    monkeypatch.setattr("ae5_tools.waiter.WAIT_TIMEOUT", 0.05)
+    monkeypatch.setattr("ae5_tools.waiter.WAIT_INITIAL_INTERVAL", 0.01)
+    user_session._get_records = MagicMock(return_value={"id": "a2-1", "state": "starting"})
+    with pytest.raises(AEException, match="Timed out waiting for a2-1"):
+        user_session._wait_record("deployment", {"id": "a2-1", "state": "starting"}, lambda r: r["state"] != "starting")